@@ -0,0 +1,220 @@
+"""
+Aggregate-only scoring for PSI 05-15: counts, rates and exclusion reasons without per-row results.
+
+Dashboards only need Total Cases / Inclusions / Exclusions / Rate per 1000 and the exclusion-reason
+breakdown per PSI (and per group, e.g. facility). This mode streams the input in row chunks through
+normalization, the data quality stage, the denominator prefilter and the rule evaluation, and adds each
+chunk's outcomes to counters; no result record, results DataFrame or whole-input copy is built, so memory
+stays bounded by the chunk size however large the input is. The summary equals summarize_results over the
+full results; duplicate encounters are scored once within each chunk. The data quality counts are summed over
+the chunks; duplicates are only found within a chunk (finding them across chunks would mean keeping every
+encounter's fingerprint), so that issue is reported as "Duplicate encounter within chunk (scored once)".
+
+Usage:
+    python psi_aggregate.py --inputs discharges_2024.parquet --appendix Unified_PSI_Appendix_05_14.xlsx \
+        --group-by Facility --output-dir dashboard/2024
+
+Outputs (in --output-dir):
+    aggregate_summary.csv   Total Cases / Inclusions / Exclusions / Rate per 1000 per group and PSI
+    exclusion_reasons.csv   Exclusions per group, PSI and reason (first rationale entry), with its reason code
+    data_quality_summary.csv Data quality issue counts over all inputs (duplicates: within chunks only)
+"""
+import argparse
+import os
+import time
+from collections import Counter
+
+import pandas as pd
+
+from psi_engine import (
+    ALL_PSIS,
+    build_data_quality_report,
+    build_prefilter_rationales,
+    build_procedure_feature_records,
+    compile_lazy_appendix,
+    evaluate_psi_comprehensive,
+    fingerprint_encounters,
+    get_organ_maps,
+    get_rationale_category,
+    get_required_input_columns,
+    iter_input_chunks,
+    normalize_input_schema,
+)
+
+DEFAULT_AGGREGATE_CHUNK_SIZE = 10000 # Rows normalized and scored at a time; bounds peak memory
+CHUNK_DQ_ISSUES = { # Data quality issues only counted within each chunk, and how they are reported
+    "Duplicate encounter (scored once)": "Duplicate encounter within chunk (scored once)",
+}
+
+
+class AggregateAccumulator:
+    """
+    Running counts of PSI outcomes per group: {(group values..., PSI): [cases, inclusions]} and
+    {(group values..., PSI, reason): exclusions}, plus the data quality issue counts. Its size depends on
+    the number of groups and distinct reasons, not on the number of encounters.
+    """
+
+    def __init__(self, group_columns=None):
+        self.group_columns = list(group_columns or [])
+        self.status_counts = {}
+        self.reason_counts = Counter()
+        self.dq_counts = Counter()
+        self.rows = 0
+
+    def add(self, group_key, psi_name, status, rationale, count=1):
+        counts = self.status_counts.setdefault(group_key + (psi_name,), [0, 0])
+        counts[0] += count
+        if status == "Inclusion":
+            counts[1] += count
+        else:
+            self.reason_counts[group_key + (psi_name, rationale)] += count
+
+    def add_data_quality(self, dq_summary_df):
+        for issue, column, count in dq_summary_df[["Issue", "Column", "Count"]].itertuples(index=False):
+            self.dq_counts[(CHUNK_DQ_ISSUES.get(issue, issue), column)] += count
+
+    def summary(self):
+        """Same columns and order as summarize_results(results_df, group_columns)."""
+        summary_df = pd.DataFrame(
+            [key + tuple(counts) for key, counts in self.status_counts.items()],
+            columns=self.group_columns + ["PSI", "Total Cases", "Inclusions"]
+        ).sort_values(self.group_columns + ["PSI"], ignore_index=True)
+        summary_df["Exclusions"] = summary_df["Total Cases"] - summary_df["Inclusions"]
+        summary_df["Rate per 1000"] = (summary_df["Inclusions"] / summary_df["Total Cases"] * 1000).round(2)
+        return summary_df
+
+    def exclusion_reasons(self):
+        """Exclusions per group, PSI and reason, most frequent first within each group and PSI."""
+        reasons_df = pd.DataFrame(
+            [key + (count,) for key, count in self.reason_counts.items()],
+            columns=self.group_columns + ["PSI", "Reason", "Count"]
+        )
+        reasons_df.insert(len(self.group_columns) + 1, "Reason Code", reasons_df["Reason"].map(get_rationale_category))
+        return reasons_df.sort_values(self.group_columns + ["PSI", "Count", "Reason"],
+                                      ascending=[True] * (len(self.group_columns) + 1) + [False, True], ignore_index=True)
+
+    def data_quality_summary(self):
+        return pd.DataFrame([(issue, column, count) for (issue, column), count in self.dq_counts.items()],
+                            columns=["Issue", "Column", "Count"])
+
+
+def get_group_keys(df_normalized, group_columns):
+    """One tuple of group values per row (missing columns and values count as "")."""
+    if not group_columns:
+        return pd.Series([()] * len(df_normalized), index=df_normalized.index, dtype="object")
+    group_df = pd.DataFrame({c: df_normalized[c] if c in df_normalized.columns else "" for c in group_columns},
+                            index=df_normalized.index)
+    return pd.Series(list(group_df.fillna("").astype(str).itertuples(index=False, name=None)), index=df_normalized.index)
+
+
+def aggregate_psi(df_normalized, psi_name, compiled_appendix, accumulator, dq_rationales=None, validate_timing=True,
+                  fingerprints=None, group_keys=None):
+    """
+    Scores one chunk for one PSI straight into `accumulator`. Prefiltered rows are counted per rationale in bulk;
+    each distinct candidate fingerprint is evaluated once and counted for every row (and group) sharing it.
+    """
+    fingerprints = fingerprint_encounters(df_normalized) if fingerprints is None else fingerprints
+    group_keys = get_group_keys(df_normalized, accumulator.group_columns) if group_keys is None else group_keys
+    prefilter_rationales = build_prefilter_rationales(df_normalized, psi_name, compiled_appendix, dq_rationales)
+    is_candidate = prefilter_rationales.isna()
+
+    excluded_counts = pd.DataFrame({"group": group_keys[~is_candidate], "rationale": prefilter_rationales[~is_candidate]})
+    for (group_key, rationale), count in excluded_counts.groupby(["group", "rationale"], sort=False).size().items():
+        accumulator.add(group_key, psi_name, "Exclusion", rationale, count)
+
+    candidates = df_normalized[is_candidate]
+    candidate_counts = pd.DataFrame({"group": group_keys[is_candidate], "fingerprint": fingerprints[is_candidate]})
+    distinct_candidates = candidates[~candidate_counts["fingerprint"].duplicated().to_numpy()]
+    organ_systems, organ_code_index = get_organ_maps(compiled_appendix, psi_name)
+    feature_records = build_procedure_feature_records(distinct_candidates, psi_name, compiled_appendix["code_sets"])
+    outcomes = {} # fingerprint -> (status, first rationale entry)
+    for (idx, row), procedure_features in zip(distinct_candidates.iterrows(), feature_records):
+        status, rationale, _ = evaluate_psi_comprehensive(
+            row, psi_name, compiled_appendix["code_sets"], organ_systems,
+            validate_timing=validate_timing, organ_code_index=organ_code_index, procedure_features=procedure_features
+        )
+        outcomes[fingerprints[idx]] = (status, rationale[0] if rationale else "")
+    for (group_key, fingerprint), count in candidate_counts.groupby(["group", "fingerprint"], sort=False).size().items():
+        accumulator.add(group_key, psi_name, *outcomes[fingerprint], count)
+
+
+def aggregate_chunk(df_raw, psi_names, compiled_appendix, accumulator, validate_timing=True):
+    """Normalizes, data-quality checks and scores one input chunk into `accumulator`."""
+    df_normalized = normalize_input_schema(df_raw)
+    fingerprints = fingerprint_encounters(df_normalized)
+    dq_summary_df, dq_flags_df = build_data_quality_report(df_raw, df_normalized, fingerprints=fingerprints)
+    accumulator.add_data_quality(dq_summary_df)
+    group_keys = get_group_keys(df_normalized, accumulator.group_columns)
+    for psi in psi_names:
+        aggregate_psi(df_normalized, psi, compiled_appendix, accumulator, dq_rationales=dq_flags_df["DQ_Rationale"],
+                      validate_timing=validate_timing, fingerprints=fingerprints, group_keys=group_keys)
+    accumulator.rows += len(df_raw)
+
+
+def aggregate_dataframe(df_raw, psi_names, compiled_appendix, group_columns=None, validate_timing=True,
+                        chunk_size=DEFAULT_AGGREGATE_CHUNK_SIZE, accumulator=None, progress_callback=None):
+    """
+    Aggregate-only scoring of an in-memory input, `chunk_size` rows at a time.
+    Returns the accumulator (see AggregateAccumulator.summary / exclusion_reasons / data_quality_summary);
+    progress_callback(done_rows, total_rows) is called per chunk.
+    """
+    accumulator = accumulator or AggregateAccumulator(group_columns)
+    for start in range(0, len(df_raw), chunk_size):
+        aggregate_chunk(df_raw.iloc[start:start + chunk_size], psi_names, compiled_appendix, accumulator, validate_timing)
+        if progress_callback:
+            progress_callback(min(start + chunk_size, len(df_raw)), len(df_raw))
+    return accumulator
+
+
+def aggregate_input(input_source, psi_names, compiled_appendix, group_columns=None, validate_timing=True,
+                    chunk_size=DEFAULT_AGGREGATE_CHUNK_SIZE, accumulator=None, progress_callback=None):
+    """
+    Aggregate-only scoring of an input file streamed chunk by chunk (see iter_input_chunks); the whole input
+    is never loaded. progress_callback(done_rows) is called per chunk.
+    """
+    accumulator = accumulator or AggregateAccumulator(group_columns)
+    columns = get_required_input_columns(psi_names, validate_timing, accumulator.group_columns)
+    for df_raw in iter_input_chunks(input_source, columns, chunk_size):
+        aggregate_chunk(df_raw, psi_names, compiled_appendix, accumulator, validate_timing)
+        if progress_callback:
+            progress_callback(accumulator.rows)
+    return accumulator
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate-only PSI scoring (counts, rates, exclusion reasons) in constant memory")
+    parser.add_argument("--inputs", required=True, nargs="+", help="Input files, directories and/or glob patterns")
+    parser.add_argument("--appendix", required=True, help="PSI appendix (.xlsx or .json)")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--psis", default=",".join(ALL_PSIS), help="Comma-separated PSIs (default: all)")
+    parser.add_argument("--no-timing", action="store_true", help="Disable timing validation")
+    parser.add_argument("--group-by", default="", help="Comma-separated input columns to break the counts down by (e.g. Facility)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_AGGREGATE_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    psi_names = [p.strip() for p in args.psis.split(",") if p.strip()]
+    unknown = [p for p in psi_names if p not in ALL_PSIS]
+    if unknown:
+        parser.error(f"Unknown PSI(s): {', '.join(unknown)}")
+    from psi_batch import resolve_input_files
+    input_paths = resolve_input_files(args.inputs)
+    if not input_paths:
+        parser.error("No input files matched")
+
+    start = time.perf_counter()
+    compiled_appendix = compile_lazy_appendix(args.appendix, is_json=args.appendix.lower().endswith(".json"), psi_names=psi_names)
+    accumulator = AggregateAccumulator([c.strip() for c in args.group_by.split(",") if c.strip()])
+    for path in input_paths:
+        aggregate_input(path, psi_names, compiled_appendix, validate_timing=not args.no_timing, chunk_size=args.chunk_size,
+                        accumulator=accumulator,
+                        progress_callback=lambda rows: print(f"  {rows} rows aggregated ({time.perf_counter() - start:.1f}s)"))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    accumulator.summary().to_csv(os.path.join(args.output_dir, "aggregate_summary.csv"), index=False)
+    accumulator.exclusion_reasons().to_csv(os.path.join(args.output_dir, "exclusion_reasons.csv"), index=False)
+    accumulator.data_quality_summary().to_csv(os.path.join(args.output_dir, "data_quality_summary.csv"), index=False)
+    print(f"Done in {time.perf_counter() - start:.1f}s: {accumulator.rows} rows from {len(input_paths)} file(s) aggregated into {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Provider-level PSI rates with bootstrap confidence intervals, for facility and service-line benchmarking.
+
+Works on any results table produced by the engine (score_psi / score_dataframe / batch_results.csv),
+grouped by one or more columns such as Facility, MS_DRG or a carried-through service-line column.
+
+Usage:
+    python psi_analytics.py --results results/2025-06/batch_results.csv --group-by Facility --output provider_rates.csv
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from psi_engine import summarize_results
+from psi_preview import wilson_interval
+
+BOOTSTRAP_CHUNK_CELLS = 5_000_000 # Groups x resamples drawn at once; bounds memory for thousands of groups
+
+
+def bootstrap_rate_intervals(total_cases, inclusions, n_resamples=2000, confidence=0.95, random_state=0):
+    """
+    Percentile bootstrap intervals of the rate per 1000 for many groups at once.
+    Resampling a group's n encounters with replacement and counting inclusions is exactly a
+    Binomial(n, inclusions / n) draw, so each resample is one vectorized binomial draw per group
+    instead of a pass over the group's encounters. Returns (low, high) arrays aligned to the inputs.
+    """
+    total_cases = np.asarray(total_cases, dtype=np.int64)
+    inclusions = np.asarray(inclusions, dtype=np.int64)
+    rates = np.divide(inclusions, total_cases, out=np.zeros(len(total_cases)), where=total_cases > 0)
+    rng = np.random.default_rng(random_state)
+    quantiles = [(1 - confidence) / 2, (1 + confidence) / 2]
+
+    low, high = np.zeros(len(total_cases)), np.zeros(len(total_cases))
+    chunk = max(BOOTSTRAP_CHUNK_CELLS // n_resamples, 1)
+    for start in range(0, len(total_cases), chunk):
+        n = total_cases[start:start + chunk, None]
+        draws = rng.binomial(n, rates[start:start + chunk, None], size=(len(n), n_resamples))
+        resampled_rates = np.divide(draws * 1000.0, n, out=np.zeros(draws.shape), where=n > 0)
+        low[start:start + chunk], high[start:start + chunk] = np.quantile(resampled_rates, quantiles, axis=1)
+    return low, high
+
+
+def compute_provider_rates(results_df, group_columns, n_resamples=2000, confidence=0.95, random_state=0):
+    """
+    Observed Total Cases / Inclusions / Exclusions / Rate per 1000 per group and PSI (as summarize_results),
+    plus bootstrap "Rate CI Low"/"Rate CI High" and whether the interval lies "Above", "Below" or
+    "Within" the PSI's overall rate across all groups. Groups with no inclusions or only inclusions get a
+    Wilson interval instead: every bootstrap resample of them is the observed rate, so the percentile
+    interval would be a single point.
+    """
+    group_columns = [group_columns] if isinstance(group_columns, str) else list(group_columns)
+    if results_df.empty:
+        return pd.DataFrame(columns=group_columns + ["PSI", "Total Cases", "Inclusions", "Exclusions", "Rate per 1000",
+                                                     "Rate CI Low", "Rate CI High", "Overall Rate per 1000", "Compared to Overall"])
+
+    rates_df = summarize_results(results_df.assign(**{c: results_df[c].fillna("Unknown") for c in group_columns}), group_columns)
+    low, high = bootstrap_rate_intervals(rates_df["Total Cases"], rates_df["Inclusions"], n_resamples, confidence, random_state)
+    total_cases, inclusions = rates_df["Total Cases"].to_numpy(), rates_df["Inclusions"].to_numpy()
+    degenerate = (inclusions == 0) | (inclusions == total_cases)
+    if degenerate.any():
+        wilson_low, wilson_high = wilson_interval(inclusions[degenerate] / total_cases[degenerate], total_cases[degenerate], confidence)
+        low[degenerate], high[degenerate] = wilson_low * 1000, wilson_high * 1000
+    rates_df["Rate CI Low"] = low.round(2)
+    rates_df["Rate CI High"] = high.round(2)
+
+    overall_rates = summarize_results(results_df).set_index("PSI")["Rate per 1000"]
+    rates_df["Overall Rate per 1000"] = rates_df["PSI"].map(overall_rates)
+    rates_df["Compared to Overall"] = np.select(
+        [rates_df["Rate CI Low"] > rates_df["Overall Rate per 1000"], rates_df["Rate CI High"] < rates_df["Overall Rate per 1000"]],
+        ["Above", "Below"], default="Within"
+    )
+    return rates_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Provider-level PSI rates with bootstrap confidence intervals")
+    parser.add_argument("--results", required=True, help="Results CSV (e.g. batch_results.csv)")
+    parser.add_argument("--group-by", required=True, help="Comma-separated grouping columns (e.g. Facility or Facility,MS_DRG)")
+    parser.add_argument("--output", required=True, help="Output CSV")
+    parser.add_argument("--resamples", type=int, default=2000)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    args = parser.parse_args()
+
+    group_columns = [c.strip() for c in args.group_by.split(",") if c.strip()]
+    results_df = pd.read_csv(args.results, usecols=lambda c: c in group_columns + ["PSI", "Status"])
+    missing = [c for c in group_columns if c not in results_df.columns]
+    if missing:
+        parser.error(f"Column(s) not in results: {', '.join(missing)}")
+
+    rates_df = compute_provider_rates(results_df, group_columns, n_resamples=args.resamples, confidence=args.confidence)
+    rates_df.to_csv(args.output, index=False)
+    flagged = rates_df[rates_df["Compared to Overall"] != "Within"]
+    print(f"{len(rates_df)} group/PSI rates written to {args.output}; {len(flagged)} differ from the overall rate")
+
+
+if __name__ == "__main__":
+    main()
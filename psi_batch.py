@@ -0,0 +1,276 @@
+"""
+Batch mode for PSI 05-15: score many input files (e.g. one workbook per facility per month) in parallel.
+
+The appendix is loaded and compiled once and handed to every worker process; each input file is
+ingested and scored independently, so one bad file does not stop the batch.
+
+Usage:
+    python psi_batch.py --appendix Unified_PSI_Appendix_05_14.xlsx --inputs "drops/2025-06/*.xlsx" --output-dir results/2025-06
+
+Files spanning several appendix versions: pass --appendix-version PERIOD=PATH once per version instead of
+--appendix (e.g. --appendix-version FY2024=appendix_2024.xlsx --appendix-version FY2025=appendix_2025.xlsx).
+
+Inputs can be Excel workbooks, Arrow IPC/Feather files or Parquet files (the latter two need pyarrow).
+
+Cohort search: --cohort-codes and/or --cohort-sets (narrowed by --cohort-position, --cohort-poa, --cohort-from/--cohort-to
+and --cohort-status PSI:STATUS) list the matching encounters of every file (see psi_index.CohortIndex), e.g.
+    python psi_batch.py ... --cohort-sets FOREIID_CODES --cohort-poa N --cohort-status PSI_05:Inclusion
+
+Outputs (in --output-dir):
+    batch_results.csv     All PSI results, tagged with SourceFile and Facility
+    facility_summary.csv  Total Cases / Inclusions / Exclusions / Rate per 1000 (with bootstrap CI) per facility and PSI
+    batch_files.csv       Per-file status (ok/failed), error, rows, duplicate encounters collapsed and elapsed time
+    batch_metrics.json    Stage timings, rows/sec and memory for the batch and for every file (see psi_telemetry)
+    cohort.csv            Encounters matching the cohort query, tagged with SourceFile and Facility (only with a cohort query)
+"""
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from psi_engine import (
+    ALL_PSIS,
+    INPUT_FILE_EXTENSIONS,
+    compile_appendix,
+    get_required_input_columns,
+    load_appendix_df,
+    load_input_df,
+    normalize_input_schema,
+    score_dataframe,
+)
+from psi_analytics import compute_provider_rates
+from psi_checkpoint import ScoringCheckpoint, hash_source, score_dataframe_checkpointed
+from psi_index import COHORT_INPUT_COLUMNS, COHORT_POA_VALUES, COHORT_POSITIONS, CohortIndex, statuses_by_psi
+from psi_registry import AppendixRegistry, build_registry, parse_version_arguments, score_dataframe_versioned
+from psi_telemetry import PipelineTelemetry
+
+_worker_compiled_appendix = None # Set once per worker process by _init_worker
+
+
+def _init_worker(compiled_appendix):
+    global _worker_compiled_appendix
+    _worker_compiled_appendix = compiled_appendix
+
+
+def resolve_input_files(inputs):
+    """Expands directories and glob patterns into a sorted, de-duplicated list of input files."""
+    paths = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            candidates = glob.glob(pattern)
+        paths.extend(
+            p for p in candidates
+            if os.path.isfile(p) and os.path.splitext(p)[1].lower() in INPUT_FILE_EXTENSIONS
+            and not os.path.basename(p).startswith("~$") # Skip Excel lock files
+        )
+    return sorted(set(paths))
+
+
+def facility_from_filename(path):
+    """Default facility tag: the input file name without its extension."""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def score_input_file(path, psi_names, validate_timing=True, facility_column=None, compiled_appendix=None,
+                     checkpoint_dir=None, appendix_hash=None, cohort_query=None):
+    """
+    Ingests and scores one input file. Never raises: failures are returned as status "failed".
+    Uses the worker's shared compiled appendix unless one is passed explicitly; an AppendixRegistry scores
+    every row with the appendix version in effect for its discharge period.
+    With `checkpoint_dir` (and the appendix file's `appendix_hash`), results are checkpointed per chunk
+    and a rerun of an interrupted batch resumes each file where it stopped (see psi_checkpoint).
+    With `cohort_query` (CohortIndex.query keyword arguments), the file's matching encounters are returned as cohort_df.
+    Returns a dict with file, status, error, rows, duplicates_collapsed (rows scored via an identical earlier row),
+    elapsed_seconds, stages (telemetry records), results_df and cohort_df.
+    """
+    compiled_appendix = compiled_appendix or _worker_compiled_appendix
+    telemetry = PipelineTelemetry()
+    start = time.perf_counter()
+    try:
+        with telemetry.stage("Input load") as stage:
+            extra_columns = [facility_column] + (COHORT_INPUT_COLUMNS if cohort_query else [])
+            df_raw = load_input_df(path, columns=get_required_input_columns(psi_names, validate_timing, extra_columns))
+            stage["Rows"] = len(df_raw)
+        carry_columns = [facility_column] if facility_column and facility_column in df_raw.columns else []
+        with telemetry.stage("Score", rows=len(df_raw)):
+            if isinstance(compiled_appendix, AppendixRegistry):
+                results_df, dq_summary_df = score_dataframe_versioned(
+                    df_raw, psi_names, compiled_appendix, validate_timing=validate_timing, carry_columns=carry_columns
+                )
+            elif checkpoint_dir:
+                checkpoint = ScoringCheckpoint(checkpoint_dir, hash_source(path), appendix_hash,
+                                               validate_timing=validate_timing, carry_columns=carry_columns)
+                results_df, dq_summary_df, _ = score_dataframe_checkpointed(df_raw, psi_names, compiled_appendix, checkpoint)
+            else:
+                results_df, dq_summary_df = score_dataframe(
+                    df_raw, psi_names, compiled_appendix, validate_timing=validate_timing, carry_columns=carry_columns
+                )
+        cohort_df = None
+        if cohort_query:
+            with telemetry.stage("Cohort search", rows=len(df_raw)):
+                appendix = compiled_appendix.latest() if isinstance(compiled_appendix, AppendixRegistry) else compiled_appendix
+                cohort_index = CohortIndex(normalize_input_schema(df_raw), appendix["code_sets"])
+                cohort_df = cohort_index.query(**cohort_query, statuses=statuses_by_psi(results_df, len(df_raw)))
+            facility = (df_raw[facility_column].iloc[cohort_df["Row"]] if carry_columns
+                        else pd.Series(None, index=cohort_df.index, dtype="object"))
+            cohort_df.insert(0, "Facility", facility.fillna(facility_from_filename(path)).astype(str).to_numpy())
+            cohort_df.insert(0, "SourceFile", os.path.basename(path))
+        if carry_columns:
+            results_df = results_df.rename(columns={facility_column: "Facility"})
+            results_df["Facility"] = results_df["Facility"].fillna(facility_from_filename(path)).astype(str)
+        else:
+            results_df["Facility"] = facility_from_filename(path)
+        results_df.insert(0, "Facility", results_df.pop("Facility"))
+        results_df.insert(0, "SourceFile", os.path.basename(path))
+        duplicates = int(dq_summary_df.loc[dq_summary_df["Issue"] == "Duplicate encounter (scored once)", "Count"].sum())
+        return {"file": path, "status": "ok", "error": "", "rows": len(df_raw), "duplicates_collapsed": duplicates,
+                "elapsed_seconds": round(time.perf_counter() - start, 2), "stages": telemetry.records, "results_df": results_df,
+                "cohort_df": cohort_df}
+    except Exception as e:
+        return {"file": path, "status": "failed", "error": f"{type(e).__name__}: {e}", "rows": 0, "duplicates_collapsed": 0,
+                "elapsed_seconds": round(time.perf_counter() - start, 2), "stages": telemetry.records, "results_df": None,
+                "cohort_df": None}
+
+
+def run_batch(input_paths, compiled_appendix, psi_names, validate_timing=True, facility_column=None, max_workers=None, on_file_done=None,
+              checkpoint_dir=None, appendix_hash=None, cohort_query=None):
+    """
+    Scores input files in parallel worker processes sharing one compiled appendix (checkpointed per file
+    when `checkpoint_dir` is set, see score_input_file).
+    Returns (results_df, facility_summary_df, files_df, cohort_df); results_df is empty if every file failed,
+    cohort_df holds the encounters of every file matching `cohort_query` (empty without one).
+    """
+    file_outcomes = []
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(compiled_appendix,)) as executor:
+        futures = [
+            executor.submit(score_input_file, path, psi_names, validate_timing, facility_column,
+                            checkpoint_dir=checkpoint_dir, appendix_hash=appendix_hash, cohort_query=cohort_query)
+            for path in input_paths
+        ]
+        for future in as_completed(futures):
+            outcome = future.result()
+            file_outcomes.append(outcome)
+            if on_file_done:
+                on_file_done(outcome)
+
+    file_outcomes.sort(key=lambda o: o["file"]) # Deterministic merge order regardless of completion order
+    result_frames = [o["results_df"] for o in file_outcomes if o["results_df"] is not None]
+    results_df = pd.concat(result_frames, ignore_index=True) if result_frames else pd.DataFrame()
+    facility_summary_df = compute_provider_rates(results_df, ["Facility"]) if len(results_df) else pd.DataFrame()
+    files_df = pd.DataFrame([{k: v for k, v in o.items() if k not in ("results_df", "cohort_df", "stages")} for o in file_outcomes])
+    cohort_frames = [o["cohort_df"] for o in file_outcomes if o["cohort_df"] is not None]
+    cohort_df = pd.concat(cohort_frames, ignore_index=True) if cohort_frames else pd.DataFrame()
+    return results_df, facility_summary_df, files_df, cohort_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score many PSI input files in parallel")
+    appendix_group = parser.add_mutually_exclusive_group(required=True)
+    appendix_group.add_argument("--appendix", help="PSI appendix (.xlsx or .json)")
+    appendix_group.add_argument("--appendix-version", action="append", metavar="PERIOD=PATH",
+                                help="Appendix effective from discharge PERIOD (YYYY, YYYYQn or FYYYYY); repeat per version")
+    parser.add_argument("--inputs", required=True, nargs="+", help="Input directories and/or glob patterns")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--psis", default=",".join(ALL_PSIS), help="Comma-separated PSIs (default: all)")
+    parser.add_argument("--no-timing", action="store_true", help="Disable timing validation")
+    parser.add_argument("--facility-column", default=None,
+                        help="Input column holding the facility id (default: tag rows with the file name)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--checkpoint-dir", default=None,
+                        help="Save results per chunk here so an interrupted batch resumes where it stopped")
+    cohort_group = parser.add_argument_group("cohort search")
+    cohort_group.add_argument("--cohort-codes", default="", help="Comma-separated codes to search for")
+    cohort_group.add_argument("--cohort-sets", default="", help="Comma-separated appendix code sets to search for (e.g. FOREIID_CODES)")
+    cohort_group.add_argument("--cohort-position", default="Any", choices=COHORT_POSITIONS)
+    cohort_group.add_argument("--cohort-poa", default=None, help="Comma-separated POA values of matching diagnoses (Y,N,U,W; 'blank' for none)")
+    cohort_group.add_argument("--cohort-from", default=None, help="Earliest discharge date (YYYY-MM-DD)")
+    cohort_group.add_argument("--cohort-to", default=None, help="Latest discharge date (YYYY-MM-DD)")
+    cohort_group.add_argument("--cohort-status", default=None, metavar="PSI:STATUS", help="e.g. PSI_13:Inclusion")
+    args = parser.parse_args()
+
+    psi_names = [p.strip() for p in args.psis.split(",") if p.strip()]
+    unknown = [p for p in psi_names if p not in ALL_PSIS]
+    if unknown:
+        parser.error(f"Unknown PSI(s): {', '.join(unknown)}")
+
+    try:
+        appendix_versions = parse_version_arguments(args.appendix_version or [])
+    except ValueError as e:
+        parser.error(str(e))
+    if appendix_versions and args.checkpoint_dir:
+        parser.error("--checkpoint-dir cannot be combined with --appendix-version")
+
+    input_paths = resolve_input_files(args.inputs)
+    if not input_paths:
+        parser.error("No input files matched")
+
+    cohort_query = None
+    if args.cohort_codes or args.cohort_sets:
+        poa = [("" if v.strip().lower() == "blank" else v.strip().upper()) for v in args.cohort_poa.split(",")] if args.cohort_poa else None
+        if poa and any(v not in COHORT_POA_VALUES for v in poa):
+            parser.error("--cohort-poa values must be among Y, N, U, W and blank")
+        status_psi, _, status = (args.cohort_status or "").partition(":")
+        if args.cohort_status and (status_psi not in psi_names or status not in ("Inclusion", "Exclusion")):
+            parser.error("--cohort-status must be PSI:Inclusion or PSI:Exclusion for one of the scored PSIs")
+        cohort_query = {
+            "codes": [c.strip() for c in args.cohort_codes.split(",") if c.strip()],
+            "code_sets": [c.strip() for c in args.cohort_sets.split(",") if c.strip()],
+            "position": args.cohort_position, "poa": poa, "date_from": args.cohort_from, "date_to": args.cohort_to,
+            "psi": status_psi or None, "status": status or None,
+        }
+
+    start = time.perf_counter()
+    telemetry = PipelineTelemetry()
+    with telemetry.stage("Appendix load + compile"):
+        if appendix_versions:
+            compiled_appendix = build_registry(appendix_versions) # Shared by the workers like a single appendix
+        else:
+            compiled_appendix = compile_appendix(load_appendix_df(args.appendix, is_json=args.appendix.lower().endswith(".json")))
+    if appendix_versions:
+        print(compiled_appendix.summary().to_string(index=False))
+        print(f"Compiled {len(appendix_versions)} appendix versions; scoring {len(input_paths)} file(s)")
+    else:
+        print(f"Compiled {len(compiled_appendix['code_sets'])} code sets; scoring {len(input_paths)} file(s)")
+    cohort_code_sets = (compiled_appendix.latest() if appendix_versions else compiled_appendix)["code_sets"]
+    unknown_sets = [name for name in (cohort_query or {}).get("code_sets", []) if name not in cohort_code_sets]
+    if unknown_sets:
+        parser.error(f"Unknown code set(s) in --cohort-sets: {', '.join(unknown_sets)}")
+
+    file_stages = {} # Per-file telemetry for batch_metrics.json
+
+    def report(outcome):
+        file_stages[outcome["file"]] = outcome["stages"]
+        detail = f"{outcome['rows']} rows, {outcome['duplicates_collapsed']} duplicates" if outcome["status"] == "ok" else outcome["error"]
+        print(f"  [{outcome['status']}] {os.path.basename(outcome['file'])} ({detail}, {outcome['elapsed_seconds']}s)")
+
+    with telemetry.stage("Score files (parallel)") as stage:
+        results_df, facility_summary_df, files_df, cohort_df = run_batch(
+            input_paths, compiled_appendix, psi_names, validate_timing=not args.no_timing,
+            facility_column=args.facility_column, max_workers=args.workers, on_file_done=report,
+            checkpoint_dir=args.checkpoint_dir, appendix_hash=hash_source(args.appendix) if args.checkpoint_dir else None,
+            cohort_query=cohort_query
+        )
+        stage["Rows"] = int(files_df["rows"].sum())
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    with telemetry.stage("Write outputs", rows=len(results_df)):
+        results_df.to_csv(os.path.join(args.output_dir, "batch_results.csv"), index=False)
+        facility_summary_df.to_csv(os.path.join(args.output_dir, "facility_summary.csv"), index=False)
+        files_df.to_csv(os.path.join(args.output_dir, "batch_files.csv"), index=False)
+        if cohort_query:
+            cohort_df.to_csv(os.path.join(args.output_dir, "cohort.csv"), index=False)
+    telemetry.write_json(os.path.join(args.output_dir, "batch_metrics.json"),
+                         files=dict(sorted(file_stages.items())), workers=args.workers or os.cpu_count())
+
+    failed = int((files_df["status"] == "failed").sum())
+    print(f"Done in {time.perf_counter() - start:.1f}s: {len(files_df) - failed} file(s) scored, {failed} failed, "
+          f"{len(results_df)} result rows written to {args.output_dir}" + (f", {len(cohort_df)} cohort encounter(s)" if cohort_query else ""))
+
+
+if __name__ == "__main__":
+    main()
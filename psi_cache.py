@@ -0,0 +1,197 @@
+"""
+Process-wide cache for PSI 05-15: compiled appendices, parsed inputs and scoring results shared by every
+session of one analyzer server.
+
+Every Streamlit session (and every rerun of a session after a widget change) used to parse the same appendix
+and input and score them again. Cached values are keyed by the SHA-256 of the file contents plus everything
+else that shapes them (selected columns, PSI, settings, engine source), so a session reuses whatever another
+session already computed from identical bytes. Entries are kept in least-recently-used order and evicted once
+their estimated size exceeds the memory budget (PSI_CACHE_MAX_MB, default 1024). Concurrent misses on one key
+compute it once while the other callers wait. Hits, misses and evictions are counted per kind of entry (the
+first element of its key: "appendix", "input", "results", ...).
+
+Cached values are shared between sessions and must be treated as read-only.
+
+Usage:
+    from psi_cache import get_shared_cache
+    shared_cache = get_shared_cache()
+    compiled_appendix = shared_cache.get_or_compute(("appendix", hash_source(appendix_file)), load_appendix)
+    shared_cache.stats_dataframe()
+"""
+import os
+import sys
+import threading
+from collections import Counter, OrderedDict
+from collections.abc import Mapping
+from enum import Enum
+
+import pandas as pd
+
+import psi_engine
+from psi_checkpoint import hash_source
+
+DEFAULT_CACHE_MAX_MB = 1024
+ENGINE_SHA256 = hash_source(psi_engine.__file__) # Part of every results key, so rule changes never reuse old results
+CACHE_STATS_COLUMNS = ["Kind", "Entries", "Size (MB)", "Hits", "Misses", "Evictions", "Hit Rate"]
+
+
+def estimate_size(value, _seen=None):
+    """
+    Approximate bytes held by a value: DataFrames/Series deep, containers and plain objects recursively, objects
+    shared between entries or code sets counted once. LazyCodeSets count only the code sets read so far.
+    """
+    seen = set() if _seen is None else _seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, (str, bytes, int, float, bool, Enum, type)) or value is None or callable(value):
+        return sys.getsizeof(value)
+    if hasattr(value, "loaded_names"): # LazyCodeSets: reading every value would load the whole appendix
+        return sys.getsizeof(value) + sum(estimate_size(value[name], seen) for name in value.loaded_names())
+    if isinstance(value, Mapping):
+        return sys.getsizeof(value) + sum(estimate_size(k, seen) + estimate_size(v, seen) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(estimate_size(item, seen) for item in value)
+    if hasattr(value, "__dict__"):
+        return sys.getsizeof(value) + estimate_size(vars(value), seen)
+    return sys.getsizeof(value)
+
+
+class SharedCache:
+    """
+    Thread-safe LRU cache with a memory budget (max_bytes). Keys are tuples whose first element names the
+    kind of value; sizes come from estimate_size unless given. A value larger than the whole budget is
+    returned but not kept.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_MAX_MB * 2**20):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._entries = OrderedDict() # key -> (value, size_bytes), least recently used first
+        self._computing = {} # key -> threading.Event set when its in-flight compute finishes
+        self._counters = {} # kind -> Counter of hits, misses and evictions
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _kind(key):
+        return key[0] if isinstance(key, tuple) and key else "other"
+
+    def _count(self, key, event):
+        self._counters.setdefault(self._kind(key), Counter())[event] += 1
+
+    def get(self, key, default=None):
+        """The cached value (now the most recently used), or `default` (counted as a miss)."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._count(key, "hits")
+                return self._entries[key][0]
+            self._count(key, "misses")
+            return default
+
+    def put(self, key, value, size_bytes=None):
+        """Stores `value`, evicting least recently used entries to stay within the budget; returns `value`."""
+        size_bytes = estimate_size(value) if size_bytes is None else size_bytes
+        with self._lock:
+            if key in self._entries:
+                self.size_bytes -= self._entries.pop(key)[1]
+            if size_bytes <= self.max_bytes:
+                self._entries[key] = (value, size_bytes)
+                self.size_bytes += size_bytes
+                self._evict()
+        return value
+
+    def get_or_compute(self, key, compute, size_bytes=None):
+        """
+        The cached value of `key`, computing and storing it with compute() on a miss. Callers missing the same
+        key meanwhile wait for that result instead of computing it again (and retry if compute() raises).
+        """
+        while True:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self._count(key, "hits")
+                    return self._entries[key][0]
+                in_flight = self._computing.get(key)
+                if in_flight is None:
+                    self._computing[key] = threading.Event()
+                    self._count(key, "misses")
+                    break
+            in_flight.wait()
+        try:
+            return self.put(key, compute(), size_bytes)
+        finally:
+            with self._lock:
+                self._computing.pop(key).set()
+
+    def refresh_size(self, key):
+        """Re-estimates an entry that has grown since it was stored (e.g. a lazy appendix that loaded more code sets)."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return
+        size_bytes = estimate_size(entry[0])
+        with self._lock:
+            if self._entries.get(key) is entry:
+                self._entries[key] = (entry[0], size_bytes)
+                self.size_bytes += size_bytes - entry[1]
+                self._evict()
+
+    def _evict(self):
+        while self.size_bytes > self.max_bytes and self._entries:
+            key, (_, size_bytes) = self._entries.popitem(last=False)
+            self.size_bytes -= size_bytes
+            self._count(key, "evictions")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def stats(self):
+        """Totals: entries, size and budget (MB), hits, misses, evictions and hit rate."""
+        with self._lock:
+            totals = sum(self._counters.values(), Counter())
+            entries = len(self._entries)
+            size_bytes = self.size_bytes
+        lookups = totals["hits"] + totals["misses"]
+        return {
+            "entries": entries,
+            "size_mb": round(size_bytes / 2**20, 1),
+            "max_mb": round(self.max_bytes / 2**20, 1),
+            "hits": totals["hits"],
+            "misses": totals["misses"],
+            "evictions": totals["evictions"],
+            "hit_rate": round(totals["hits"] / lookups, 3) if lookups else None,
+        }
+
+    def stats_dataframe(self):
+        """One row per kind of entry: entries, size, hits, misses, evictions and hit rate."""
+        with self._lock:
+            kinds = list(dict.fromkeys(list(self._counters) + [self._kind(key) for key in self._entries]))
+            records = []
+            for kind in kinds:
+                counts = self._counters.get(kind, Counter())
+                sizes = [size for key, (_, size) in self._entries.items() if self._kind(key) == kind]
+                lookups = counts["hits"] + counts["misses"]
+                records.append([kind, len(sizes), round(sum(sizes) / 2**20, 1), counts["hits"], counts["misses"],
+                                counts["evictions"], round(counts["hits"] / lookups, 3) if lookups else None])
+        return pd.DataFrame(records, columns=CACHE_STATS_COLUMNS)
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """The process-wide SharedCache, created on first use with a budget of PSI_CACHE_MAX_MB megabytes."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            max_mb = float(os.environ.get("PSI_CACHE_MAX_MB", DEFAULT_CACHE_MAX_MB))
+            _shared_cache = SharedCache(max_bytes=int(max_mb * 2**20))
+        return _shared_cache
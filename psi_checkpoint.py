@@ -0,0 +1,223 @@
+"""
+Checkpointed, resumable scoring for PSI 05-15.
+
+Long runs are scored in fixed row chunks per PSI, and every finished chunk's results are written to a
+local checkpoint directory. A run that is interrupted (closed browser session, killed process) picks up
+from the finished chunks when started again and produces the same output as an uninterrupted run.
+Checkpoints are keyed by a hash of the input file, the appendix file, the engine source and the scoring
+settings (timing validation, carried columns, chunk size), so a changed file or setting starts a new run.
+
+Usage:
+    python psi_checkpoint.py --input discharges_2024.xlsx --appendix Unified_PSI_Appendix_05_14.xlsx \
+        --checkpoint-dir .psi_checkpoints --output results_2024.csv
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import pandas as pd
+
+import psi_engine
+from psi_engine import (
+    ALL_PSIS,
+    RESULT_BASE_COLUMNS,
+    build_data_quality_report,
+    fingerprint_encounters,
+    normalize_input_schema,
+    score_psi,
+)
+from psi_ingest import load_input_and_appendix
+
+CHECKPOINT_FORMAT_VERSION = 1
+DEFAULT_CHUNK_SIZE = 5000 # Rows per checkpointed chunk; at most this much work is lost on interruption
+HASH_BLOCK_SIZE = 2**20
+
+
+def hash_source(source):
+    """SHA-256 of a file path, an uploaded file object (getvalue()/read()) or bytes."""
+    digest = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest.update(source)
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+    elif hasattr(source, "getvalue"):
+        digest.update(source.getvalue())
+    else:
+        position = source.tell()
+        digest.update(source.read())
+        source.seek(position)
+    return digest.hexdigest()
+
+
+class ScoringCheckpoint:
+    """
+    One run's checkpoint directory (<checkpoint_dir>/<run_key>/): a run.json describing the run and one
+    pickled results file per finished chunk, named <PSI>_<start>-<end>.pkl. Files are written to a temporary
+    name and renamed, so a chunk file exists only once it is complete.
+    """
+
+    def __init__(self, checkpoint_dir, input_hash, appendix_hash, validate_timing=True, carry_columns=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        self.validate_timing = validate_timing
+        self.carry_columns = list(carry_columns or [])
+        self.chunk_size = chunk_size
+        self.run_info = {
+            "format_version": CHECKPOINT_FORMAT_VERSION,
+            "input_sha256": input_hash,
+            "appendix_sha256": appendix_hash,
+            "engine_sha256": hash_source(psi_engine.__file__), # Rule changes invalidate old checkpoints
+            "settings": {"validate_timing": validate_timing, "carry_columns": self.carry_columns, "chunk_size": chunk_size},
+        }
+        self.run_key = hashlib.sha256(json.dumps(self.run_info, sort_keys=True).encode()).hexdigest()[:16]
+        self.run_dir = os.path.join(checkpoint_dir, self.run_key)
+        os.makedirs(self.run_dir, exist_ok=True)
+        self._write_atomic(os.path.join(self.run_dir, "run.json"), self._write_run_info)
+
+    def _write_run_info(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.run_info, f, indent=2)
+
+    @staticmethod
+    def _write_atomic(path, write):
+        temp_path = f"{path}.tmp"
+        write(temp_path)
+        os.replace(temp_path, path)
+
+    def chunk_path(self, psi_name, start, end):
+        return os.path.join(self.run_dir, f"{psi_name}_{start:09d}-{end:09d}.pkl")
+
+    def load_chunk(self, psi_name, start, end):
+        """The saved results of a finished chunk, or None."""
+        path = self.chunk_path(psi_name, start, end)
+        return pd.read_pickle(path) if os.path.exists(path) else None
+
+    def save_chunk(self, psi_name, start, end, results_df):
+        self._write_atomic(self.chunk_path(psi_name, start, end), results_df.to_pickle)
+
+    def completed_chunks(self):
+        """(psi, start, end) of every finished chunk."""
+        chunks = []
+        for name in sorted(os.listdir(self.run_dir)):
+            if name.endswith(".pkl"):
+                psi_name, _, row_range = name[:-len(".pkl")].rpartition("_")
+                start, end = row_range.split("-")
+                chunks.append((psi_name, int(start), int(end)))
+        return chunks
+
+    def clear(self):
+        """Deletes this run's checkpoints."""
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+
+
+def open_checkpoint(checkpoint_dir, input_source, appendix_source, validate_timing=True, carry_columns=None,
+                    chunk_size=DEFAULT_CHUNK_SIZE):
+    """Opens (or starts) the checkpoint of a run over `input_source` and `appendix_source` with these settings."""
+    return ScoringCheckpoint(checkpoint_dir, hash_source(input_source), hash_source(appendix_source),
+                             validate_timing=validate_timing, carry_columns=carry_columns, chunk_size=chunk_size)
+
+
+def score_psi_checkpointed(checkpoint, df_normalized, psi_name, compiled_appendix, dq_rationales=None, debug_mode=False,
+                           fingerprints=None, progress_callback=None):
+    """
+    score_psi over row chunks of `df_normalized`, reusing chunks already in `checkpoint` and saving each new one.
+    Timing validation and carry columns come from the checkpoint's settings.
+    Returns (results_df, resumed_chunks); progress_callback(done, total) is called per chunk.
+    """
+    fingerprints = fingerprint_encounters(df_normalized) if fingerprints is None else fingerprints
+    carry_columns = [c for c in checkpoint.carry_columns if c in df_normalized.columns]
+    chunk_ranges = [(start, min(start + checkpoint.chunk_size, len(df_normalized)))
+                    for start in range(0, len(df_normalized), checkpoint.chunk_size)]
+    chunk_frames = []
+    resumed_chunks = 0
+    for done, (start, end) in enumerate(chunk_ranges, start=1):
+        chunk_df = checkpoint.load_chunk(psi_name, start, end)
+        if chunk_df is None:
+            chunk_df = score_psi(
+                df_normalized.iloc[start:end], psi_name, compiled_appendix,
+                dq_rationales=dq_rationales.iloc[start:end] if dq_rationales is not None else None,
+                debug_mode=debug_mode, validate_timing=checkpoint.validate_timing, carry_columns=carry_columns,
+                fingerprints=fingerprints.iloc[start:end]
+            )
+            checkpoint.save_chunk(psi_name, start, end, chunk_df)
+        else:
+            resumed_chunks += 1
+        chunk_frames.append(chunk_df)
+        if progress_callback:
+            progress_callback(done, len(chunk_ranges))
+
+    if not chunk_frames:
+        return score_psi(df_normalized, psi_name, compiled_appendix, validate_timing=checkpoint.validate_timing,
+                         carry_columns=carry_columns), 0
+    results_df = pd.concat(chunk_frames, ignore_index=True)
+    detail_columns = [c for c in results_df.columns if c not in RESULT_BASE_COLUMNS and c not in carry_columns]
+    return results_df[RESULT_BASE_COLUMNS + detail_columns + carry_columns], resumed_chunks
+
+
+def score_dataframe_checkpointed(df_raw, psi_names, compiled_appendix, checkpoint, debug_mode=False, progress_callback=None):
+    """
+    score_dataframe with every PSI scored through score_psi_checkpointed.
+    Returns (results_df, dq_summary_df, resumed_chunks); progress_callback(psi, done, total) is called per chunk.
+    """
+    df_normalized = normalize_input_schema(df_raw)
+    fingerprints = fingerprint_encounters(df_normalized)
+    dq_summary_df, dq_flags_df = build_data_quality_report(df_raw, df_normalized, fingerprints=fingerprints)
+    results_frames = []
+    resumed_chunks = 0
+    for psi in psi_names:
+        results_df, resumed = score_psi_checkpointed(
+            checkpoint, df_normalized, psi, compiled_appendix, dq_rationales=dq_flags_df["DQ_Rationale"],
+            debug_mode=debug_mode, fingerprints=fingerprints,
+            progress_callback=(lambda done, total, psi=psi: progress_callback(psi, done, total)) if progress_callback else None
+        )
+        results_frames.append(results_df)
+        resumed_chunks += resumed
+    results_df = pd.concat(results_frames, ignore_index=True) if results_frames else pd.DataFrame(columns=RESULT_BASE_COLUMNS)
+    return results_df, dq_summary_df, resumed_chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score one PSI input with resumable on-disk checkpoints")
+    parser.add_argument("--input", required=True, help="PSI input file")
+    parser.add_argument("--appendix", required=True, help="PSI appendix (.xlsx or .json)")
+    parser.add_argument("--output", required=True, help="Results CSV")
+    parser.add_argument("--checkpoint-dir", default=".psi_checkpoints")
+    parser.add_argument("--psis", default=",".join(ALL_PSIS), help="Comma-separated PSIs (default: all)")
+    parser.add_argument("--no-timing", action="store_true", help="Disable timing validation")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--keep-checkpoints", action="store_true", help="Keep the checkpoints after a finished run")
+    args = parser.parse_args()
+
+    psi_names = [p.strip() for p in args.psis.split(",") if p.strip()]
+    unknown = [p for p in psi_names if p not in ALL_PSIS]
+    if unknown:
+        parser.error(f"Unknown PSI(s): {', '.join(unknown)}")
+
+    start = time.perf_counter()
+    validate_timing = not args.no_timing
+    checkpoint = open_checkpoint(args.checkpoint_dir, args.input, args.appendix, validate_timing=validate_timing,
+                                 chunk_size=args.chunk_size)
+    finished = checkpoint.completed_chunks()
+    if finished:
+        print(f"Resuming run {checkpoint.run_key}: {len(finished)} chunk(s) already scored")
+
+    df_raw, compiled_appendix = load_input_and_appendix(args.input, args.appendix, psi_names, validate_timing)
+
+    def report(psi, done, total):
+        print(f"  {psi}: chunk {done} of {total} ({time.perf_counter() - start:.1f}s)")
+
+    results_df, _, resumed_chunks = score_dataframe_checkpointed(df_raw, psi_names, compiled_appendix, checkpoint,
+                                                                 progress_callback=report)
+    results_df.to_csv(args.output, index=False)
+    if not args.keep_checkpoints:
+        checkpoint.clear()
+    print(f"Done in {time.perf_counter() - start:.1f}s: {len(results_df)} result rows written to {args.output} "
+          f"({resumed_chunks} chunk(s) resumed from checkpoint)")
+
+
+if __name__ == "__main__":
+    main()
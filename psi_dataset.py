@@ -0,0 +1,303 @@
+"""
+Partitioned Parquet results dataset for PSI 05-15: results written chunk by chunk as they are scored.
+
+The combined "All_PSI_Results" workbook is one concatenated frame of every PSI's results, and BI tools have to
+parse all of it to read any part. This output writes the results as a hive-partitioned Parquet dataset
+instead, one directory per PSI, discharge YEAR and DQTR, so a reader only opens the slices it filters on
+(predicate pushdown in pyarrow, pandas, DuckDB, Spark, Polars ...). Each scored chunk is appended to its
+partition files as soon as it is scored; no combined results frame is ever built.
+
+Every file has the same schema: the base result columns (PSI, YEAR and DQTR live in the directory names),
+any carry columns as text, and "Details", the non-empty Detail_* fields of the record as a JSON object (the
+detail fields differ by PSI and outcome, so they cannot be fixed columns). Each run writes to its own staging
+folder (_staging<random>, which readers skip) and only replaces the previous dataset in the output folder when
+it completes, and only when asked to (--overwrite); a failed run leaves the previous dataset as it was.
+
+Usage:
+    python psi_dataset.py --inputs discharges_2024.parquet --appendix Unified_PSI_Appendix_05_14.xlsx \
+        --output-dir lake/psi_results --carry-columns Facility
+
+    read_results_dataset("lake/psi_results", psis=["PSI_13"], years=[2024], quarters=[3, 4])
+
+Outputs (in --output-dir):
+    PSI=<psi>/YEAR=<year>/DQTR=<quarter>/part-0.parquet   Results of that PSI and discharge quarter
+    (rows without a YEAR or DQTR go to __HIVE_DEFAULT_PARTITION__, which readers load as null)
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from psi_engine import (
+    ALL_PSIS,
+    build_data_quality_report,
+    compile_lazy_appendix,
+    fingerprint_encounters,
+    get_required_input_columns,
+    iter_input_chunks,
+    normalize_input_schema,
+    score_psi,
+)
+
+DEFAULT_DATASET_CHUNK_SIZE = 50000 # Rows scored (and converted to Arrow) at a time; bounds peak memory
+PARTITION_COLUMNS = ["PSI", "YEAR", "DQTR"]
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__" # Read back as null by hive partitioning
+DATASET_TEXT_COLUMNS = ["EncounterID", "Status", "Rationale", "MS_DRG", "PrincipalDX"]
+DATASET_NUMERIC_COLUMNS = ["Age", "ATYPE", "Length_of_Stay"]
+STAGING_DIR_PREFIX = "_staging" # Names starting with "_" are skipped by dataset readers
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("The Parquet results dataset requires pyarrow (pip install pyarrow)")
+    return pa, pq
+
+
+def partition_values(values):
+    """Partition directory values of YEAR or DQTR: whole numbers as text, anything else NULL_PARTITION."""
+    numbers = pd.to_numeric(pd.Series(values), errors="coerce")
+    is_whole = numbers.notna() & (numbers == numbers.round())
+    text = pd.Series(NULL_PARTITION, index=numbers.index, dtype="object")
+    text[is_whole] = numbers[is_whole].astype("int64").astype(str)
+    return text.to_numpy()
+
+
+def _json_value(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def encode_details(results_df):
+    """One JSON object per row of its non-empty Detail_* fields (prefix dropped), or None if there are none."""
+    detail_columns = [c for c in results_df.columns if c.startswith("Detail_")]
+    details = np.full(len(results_df), None, dtype="object")
+    if not detail_columns:
+        return details
+    detail_df = results_df[detail_columns]
+    has_details = detail_df.notna().any(axis=1).to_numpy()
+    details[has_details] = [
+        json.dumps({name[len("Detail_"):]: _json_value(value) for name, value in record.items() if not pd.isna(value)},
+                   default=str)
+        for record in detail_df[has_details].to_dict("records")
+    ]
+    return details
+
+
+class ResultsDatasetWriter:
+    """
+    Appends results frames (from score_psi or score_dataframe) to a hive-partitioned Parquet dataset under
+    `output_dir`, keeping one open ParquetWriter per PSI/YEAR/DQTR partition; each write adds a row group to
+    the partitions its rows fall in, in a staging folder of its own so concurrent writers to the same output_dir
+    do not interfere. close() publishes the dataset (replacing a previous one only with overwrite=True),
+    abort() discards it; used as a context manager, the dataset is published unless the block raises.
+    """
+
+    def __init__(self, output_dir, carry_columns=None, overwrite=False, chunk_size=DEFAULT_DATASET_CHUNK_SIZE):
+        pa, self._pq = _require_pyarrow()
+        self._pa = pa
+        self.output_dir = output_dir
+        self.carry_columns = [c for c in (carry_columns or []) if c not in PARTITION_COLUMNS]
+        self.overwrite = overwrite
+        self.chunk_size = chunk_size
+        self.partition_rows = {} # relative partition path -> rows written
+        self.published = False # Set by close()
+        self.schema = pa.schema(
+            [(c, pa.string()) for c in DATASET_TEXT_COLUMNS] + [(c, pa.float64()) for c in DATASET_NUMERIC_COLUMNS]
+            + [(c, pa.string()) for c in self.carry_columns] + [("Details", pa.string())]
+        )
+        self._check_overwrite()
+        os.makedirs(output_dir, exist_ok=True)
+        self.staging_dir = tempfile.mkdtemp(prefix=STAGING_DIR_PREFIX, dir=output_dir)
+        self._writers = {}
+
+    def _published_partitions(self):
+        if not os.path.isdir(self.output_dir):
+            return []
+        return [name for name in os.listdir(self.output_dir) if name.startswith("PSI=")]
+
+    def _check_overwrite(self):
+        if self._published_partitions() and not self.overwrite:
+            raise ValueError(f"{self.output_dir} already holds a results dataset (replace it with overwrite=True / --overwrite)")
+
+    def to_dataset_frame(self, results_df):
+        """The results in the dataset schema: text and numeric base columns, carry columns as text, Details JSON."""
+        def column(name):
+            return results_df[name] if name in results_df.columns else pd.Series(None, index=results_df.index, dtype="object")
+        frame = pd.DataFrame(index=results_df.index)
+        for name in DATASET_TEXT_COLUMNS + self.carry_columns:
+            frame[name] = column(name).astype("string")
+        for name in DATASET_NUMERIC_COLUMNS:
+            frame[name] = pd.to_numeric(column(name), errors="coerce").astype("float64")
+        frame["Details"] = encode_details(results_df)
+        return frame[self.schema.names]
+
+    def write(self, results_df, periods_df):
+        """
+        Appends `results_df`, whose rows line up with the rows of `periods_df` (the normalized input it was scored
+        from, for its YEAR and DQTR; repeated once per PSI for a score_dataframe result), `chunk_size` rows at a time.
+        """
+        if len(results_df) == 0:
+            return
+        repeats = len(results_df) // len(periods_df) if len(periods_df) else 0
+        if repeats * len(periods_df) != len(results_df):
+            raise ValueError(f"{len(results_df)} result rows do not line up with {len(periods_df)} input rows")
+        years = np.tile(partition_values(periods_df["YEAR"] if "YEAR" in periods_df.columns else [None] * len(periods_df)), repeats)
+        quarters = np.tile(partition_values(periods_df["DQTR"] if "DQTR" in periods_df.columns else [None] * len(periods_df)), repeats)
+        for start in range(0, len(results_df), self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            frame = self.to_dataset_frame(results_df.iloc[chunk])
+            keys_df = pd.DataFrame({"PSI": results_df["PSI"].iloc[chunk].astype(str).to_numpy(),
+                                    "YEAR": years[chunk], "DQTR": quarters[chunk]})
+            for key, positions in keys_df.groupby(PARTITION_COLUMNS, sort=False).indices.items():
+                table = self._pa.Table.from_pandas(frame.iloc[positions], schema=self.schema, preserve_index=False)
+                self._partition_writer(key).write_table(table)
+                path = self._partition_path(key)
+                self.partition_rows[path] = self.partition_rows.get(path, 0) + table.num_rows
+
+    @staticmethod
+    def _partition_path(key):
+        return os.path.join(*(f"{name}={value}" for name, value in zip(PARTITION_COLUMNS, key)))
+
+    def _partition_writer(self, key):
+        writer = self._writers.get(key)
+        if writer is None:
+            directory = os.path.join(self.staging_dir, self._partition_path(key))
+            os.makedirs(directory, exist_ok=True)
+            writer = self._writers[key] = self._pq.ParquetWriter(os.path.join(directory, "part-0.parquet"), self.schema)
+        return writer
+
+    def _close_writers(self):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+    def close(self):
+        """
+        Finishes every partition file and moves the staged dataset into output_dir; returns partition_summary().
+        Raises ValueError (and discards the staged dataset) if another writer published to output_dir in the
+        meantime and overwrite is False.
+        """
+        self._close_writers()
+        try:
+            self._check_overwrite()
+        except ValueError:
+            self.abort()
+            raise
+        for name in self._published_partitions():
+            shutil.rmtree(os.path.join(self.output_dir, name))
+        for name in os.listdir(self.staging_dir):
+            os.replace(os.path.join(self.staging_dir, name), os.path.join(self.output_dir, name))
+        shutil.rmtree(self.staging_dir)
+        self.published = True
+        return self.partition_summary()
+
+    def abort(self):
+        """Discards everything written by this writer; a previously published dataset is kept."""
+        self._close_writers()
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+    def partition_summary(self):
+        """Rows written per partition (PSI, YEAR, DQTR, Rows)."""
+        records = [dict(part.split("=", 1) for part in path.split(os.sep)) | {"Rows": rows}
+                   for path, rows in sorted(self.partition_rows.items())]
+        return pd.DataFrame(records, columns=PARTITION_COLUMNS + ["Rows"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def read_results_dataset(dataset_dir, psis=None, years=None, quarters=None, columns=None):
+    """
+    Reads a results dataset back as a DataFrame, opening only the partitions of the given PSIs, discharge
+    years and quarters (all when None). PSI, YEAR and DQTR come from the partition directories.
+    """
+    _require_pyarrow()
+    import pyarrow.dataset as ds
+    dataset = ds.dataset(dataset_dir, format="parquet", partitioning="hive")
+    row_filter = None
+    for name, values in zip(PARTITION_COLUMNS, (psis, years, quarters)):
+        if values is not None:
+            condition = ds.field(name).isin(list(values))
+            row_filter = condition if row_filter is None else row_filter & condition
+    return dataset.to_table(columns=columns, filter=row_filter).to_pandas()
+
+
+def write_input_dataset(input_source, psi_names, compiled_appendix, writer, validate_timing=True,
+                        chunk_size=DEFAULT_DATASET_CHUNK_SIZE, progress_callback=None):
+    """
+    Streams an input file chunk by chunk (see iter_input_chunks) through normalization, the data quality stage
+    and score_psi, appending each chunk's results to `writer`; neither the whole input nor the whole results
+    are held in memory. Duplicate encounters are scored once within each chunk. progress_callback(done_rows)
+    is called per chunk. Returns the number of input rows.
+    """
+    columns = get_required_input_columns(psi_names, validate_timing, writer.carry_columns)
+    rows = 0
+    for df_raw in iter_input_chunks(input_source, columns, chunk_size):
+        df_raw.index = pd.RangeIndex(rows, rows + len(df_raw)) # File row numbers, for Row_<n> fallback EncounterIDs
+        df_normalized = normalize_input_schema(df_raw)
+        fingerprints = fingerprint_encounters(df_normalized)
+        _, dq_flags_df = build_data_quality_report(df_raw, df_normalized, fingerprints=fingerprints)
+        for psi in psi_names:
+            results_df = score_psi(df_normalized, psi, compiled_appendix, dq_rationales=dq_flags_df["DQ_Rationale"],
+                                   validate_timing=validate_timing, carry_columns=writer.carry_columns, fingerprints=fingerprints)
+            writer.write(results_df, df_normalized)
+        rows += len(df_raw)
+        if progress_callback:
+            progress_callback(rows)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score PSI inputs into a Parquet dataset partitioned by PSI, YEAR and DQTR")
+    parser.add_argument("--inputs", required=True, nargs="+", help="Input files, directories and/or glob patterns")
+    parser.add_argument("--appendix", required=True, help="PSI appendix (.xlsx or .json)")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--psis", default=",".join(ALL_PSIS), help="Comma-separated PSIs (default: all)")
+    parser.add_argument("--no-timing", action="store_true", help="Disable timing validation")
+    parser.add_argument("--carry-columns", default="", help="Comma-separated input columns copied onto every result (e.g. Facility)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_DATASET_CHUNK_SIZE)
+    parser.add_argument("--overwrite", action="store_true", help="Replace a results dataset already in --output-dir")
+    args = parser.parse_args()
+
+    psi_names = [p.strip() for p in args.psis.split(",") if p.strip()]
+    unknown = [p for p in psi_names if p not in ALL_PSIS]
+    if unknown:
+        parser.error(f"Unknown PSI(s): {', '.join(unknown)}")
+    from psi_batch import resolve_input_files
+    input_paths = resolve_input_files(args.inputs)
+    if not input_paths:
+        parser.error("No input files matched")
+
+    start = time.perf_counter()
+    compiled_appendix = compile_lazy_appendix(args.appendix, is_json=args.appendix.lower().endswith(".json"), psi_names=psi_names)
+    try:
+        writer = ResultsDatasetWriter(args.output_dir, [c.strip() for c in args.carry_columns.split(",") if c.strip()],
+                                      overwrite=args.overwrite, chunk_size=args.chunk_size)
+    except ValueError as e:
+        parser.error(str(e))
+    rows = 0
+    with writer:
+        for path in input_paths:
+            rows += write_input_dataset(path, psi_names, compiled_appendix, writer, validate_timing=not args.no_timing,
+                                        chunk_size=args.chunk_size,
+                                        progress_callback=lambda done: print(f"  {rows + done} rows scored ({time.perf_counter() - start:.1f}s)"))
+    print(f"Done in {time.perf_counter() - start:.1f}s: {rows} rows from {len(input_paths)} file(s) written to "
+          f"{len(writer.partition_rows)} partition(s) in {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2178 @@
+"""
+PSI 05-15 scoring engine.
+
+Shared by the Streamlit analyzer (Enhanced_PSI_05_15_Cleaned.py) and the HTTP scoring service
+(psi_service.py): appendix compilation, input normalization, data quality checks and the
+row-level PSI evaluation logic.
+"""
+import io
+import json
+import logging
+import re
+import threading
+from bisect import bisect_left
+from collections.abc import Mapping
+from datetime import timedelta
+from enum import Enum
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+ALL_PSIS = ["PSI_05", "PSI_06", "PSI_07", "PSI_08", "PSI_09", "PSI_10", "PSI_11", "PSI_12", "PSI_13", "PSI_14", "PSI_15"]
+
+# --- Input Loading ---
+EXCEL_INPUT_EXTENSIONS = [".xlsx"]
+ARROW_INPUT_EXTENSIONS = [".feather", ".arrow", ".ipc"] # Arrow IPC file/stream format (Feather v2)
+PARQUET_INPUT_EXTENSIONS = [".parquet"]
+INPUT_FILE_EXTENSIONS = EXCEL_INPUT_EXTENSIONS + ARROW_INPUT_EXTENSIONS + PARQUET_INPUT_EXTENSIONS
+
+TIMING_PSIS = ["PSI_09", "PSI_10", "PSI_11", "PSI_12", "PSI_13", "PSI_14"] # Read procedure dates only when timing validation is on
+ALWAYS_DATED_PSIS = ["PSI_15"] # Index procedure date and the 1-30 day window are part of the definition
+ADMISSION_DATE_PSIS = ["PSI_09", "PSI_10", "PSI_12", "PSI_13"] # Timing checks anchored on the admission date
+MDC_PSIS = ["PSI_11"]
+
+def get_required_input_columns(psi_names, validate_timing=True, extra_columns=None):
+    """
+    Returns every input column (canonical names and their aliases) the engine reads for the selected PSIs.
+    Codes, POAs and the result record fields are always needed; procedure dates/times only by PSI_15 and, with
+    timing validation on, PSI_09-PSI_14; the admission date only by the admission-anchored timing checks and
+    MDC only by PSI_11. The data quality report only checks the procedure dates that are loaded.
+    """
+    columns = ["EncounterID", "Encounter_ID", "Age", "SEX", "DQTR", "YEAR", "ATYPE", "MS-DRG", "DRG",
+               "length_of_stay", "Length_of_stay", "DX1", "Pdx", "POA1"]
+    for i in range(1, DX_COLUMN_COUNT):
+        columns += [f"DX{i+1}", f"POA{i+1}", f"Sdx{i}", f"POA_Sdx{i}"]
+    columns += [f"Proc{i}" for i in range(1, PROC_COLUMN_COUNT + 1)]
+
+    if any(p in ALWAYS_DATED_PSIS for p in psi_names) or (validate_timing and any(p in TIMING_PSIS for p in psi_names)):
+        for i in range(1, PROC_COLUMN_COUNT + 1):
+            columns += [f"Proc{i}_Date", f"Proc{i}_Time"]
+    if validate_timing and any(p in ADMISSION_DATE_PSIS for p in psi_names):
+        columns += ["admission_date", "Admission_Date"]
+    if any(p in MDC_PSIS for p in psi_names):
+        columns.append("MDC")
+    return columns + [c for c in (extra_columns or []) if c and c not in columns]
+
+def get_input_extension(input_source):
+    """Lower-cased file extension of a path or an uploaded file object (via its .name)."""
+    name = input_source if isinstance(input_source, str) else getattr(input_source, "name", "")
+    return ("." + name.rsplit(".", 1)[-1].lower()) if "." in str(name) else ""
+
+def read_arrow_table(input_source, columns=None, parquet=False):
+    """
+    Reads an Arrow IPC (Feather) or Parquet input as a pyarrow Table without copying unused columns.
+    Paths are memory-mapped; uploaded files are wrapped as zero-copy buffers. Only `columns` present in
+    the file's schema are read.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Arrow/Feather and Parquet inputs require pyarrow (pip install pyarrow)")
+
+    if isinstance(input_source, str):
+        source = pa.memory_map(input_source, "r")
+    else:
+        source = pa.BufferReader(input_source.getvalue() if hasattr(input_source, "getvalue") else input_source.read())
+
+    if parquet:
+        available = pq.read_schema(source).names
+        selected = [c for c in columns if c in available] if columns is not None else None
+        source.seek(0)
+        return pq.read_table(source, columns=selected, memory_map=isinstance(input_source, str))
+
+    try:
+        table = feather.read_table(source, memory_map=isinstance(input_source, str))
+    except pa.ArrowInvalid: # Arrow IPC stream format rather than file format
+        source.seek(0)
+        table = pa.ipc.open_stream(source).read_all()
+    if columns is not None:
+        table = table.select([c for c in columns if c in table.column_names]) # Zero-copy projection
+    return table
+
+def iter_sheet_cells(workbook, kept_columns):
+    """
+    Yields (row number, {column number: value}, has data) for each row of the workbook's first sheet; "has data"
+    is True if any cell of the row, kept or not, holds a value. Once the caller fills the `kept_columns` set
+    (after the header row), only those cells are parsed and the XML of every other cell is dropped unparsed.
+    This uses openpyxl's private worksheet parser (openpyxl is pinned in requirements.txt); if that API is
+    missing or has changed, the public read-only iter_rows is used instead, which parses every cell.
+    """
+    from openpyxl.utils import get_column_letter
+
+    sheet = workbook.worksheets[0]
+    try:
+        from openpyxl.worksheet._reader import WorkSheetParser
+
+        class PrunedSheetParser(WorkSheetParser):
+            kept_letters = None # Column letters to parse; None parses every cell (header row)
+            last_data_row = 0 # Last row with a value in any column, kept or not (pandas trims after it)
+
+            def parse_row(self, row):
+                has_data = any(len(c) for c in row) # <v>, <is> or <f> child
+                if self.kept_letters is not None and all(c.get("r") for c in row):
+                    for cell in [c for c in row if c.get("r").rstrip("0123456789") not in self.kept_letters]:
+                        row.remove(cell)
+                parsed = super().parse_row(row)
+                if has_data:
+                    self.last_data_row = parsed[0]
+                return parsed
+
+        source = sheet._get_source()
+        parser = PrunedSheetParser(source, sheet._shared_strings, data_only=True, epoch=workbook.epoch,
+                                   date_formats=workbook._date_formats, timedelta_formats=workbook._timedelta_formats)
+    except (ImportError, AttributeError, TypeError):
+        for row_number, row in enumerate(sheet.iter_rows(values_only=True), start=1):
+            yield (row_number, {column: value for column, value in enumerate(row, start=1) if value is not None},
+                   any(value is not None for value in row))
+        return
+
+    with source:
+        for row_number, cells in parser.parse():
+            yield row_number, {cell["column"]: cell["value"] for cell in cells}, parser.last_data_row == row_number
+            if kept_columns and parser.kept_letters is None: # Filled in by the caller after the header row
+                parser.kept_letters = {get_column_letter(column) for column in kept_columns}
+
+def iter_excel_rows(input_source, columns, header_only=False):
+    """
+    Streams the first sheet of an xlsx workbook read-only and only parses the cells of `columns` (matched against
+    the header row; see iter_sheet_cells). Yields the header values of the present columns, then one list of
+    values per data row, converted exactly as pd.read_excel converts cells. Trailing empty rows are not yielded
+    (pandas trims them too); blank rows are held back until a later row has data, so only one row's worth of
+    cells is kept at a time otherwise. With header_only, yields just the header row's values (every column).
+    """
+    from openpyxl import load_workbook
+    from openpyxl.cell.cell import ERROR_CODES
+
+    def convert(value): # Mirrors pandas' openpyxl cell conversion
+        if value is None:
+            return ""
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, str) and value in ERROR_CODES:
+            return float("nan")
+        return value
+
+    workbook = load_workbook(input_source, read_only=True, data_only=True, keep_links=False)
+    try:
+        wanted, kept_columns, pending, positions, next_row = set(columns), set(), [], None, None
+        for row_number, cells, has_data in iter_sheet_cells(workbook, kept_columns):
+            if positions is None: # Header row: map the wanted columns to their sheet positions
+                header = cells
+                if header_only:
+                    yield [header[column] for column in sorted(header) if header[column] is not None]
+                    return
+                positions = {column: i for i, column in enumerate(c for c in sorted(header) if header[c] in wanted)}
+                kept_columns.update(positions)
+                yield [header[column] for column in positions]
+                next_row = row_number + 1
+                continue
+            pending.extend([""] * len(positions) for _ in range(next_row, row_number)) # Rows missing from the XML
+            next_row = row_number + 1
+            values = [""] * len(positions)
+            for column, value in cells.items():
+                if column in positions:
+                    values[positions[column]] = convert(value)
+            pending.append(values)
+            if has_data: # Rows up to here are not trailing empty rows
+                yield from pending
+                pending.clear()
+    finally:
+        workbook.close()
+
+def read_excel_columns(input_source, columns, header_only=False):
+    """
+    Reads the `columns` of the first sheet of an xlsx workbook (see iter_excel_rows). Types are inferred exactly
+    as pd.read_excel does, so the result equals pd.read_excel(input_source)[present columns].
+    With header_only, returns just the header row's values.
+    """
+    rows = iter_excel_rows(input_source, columns, header_only=header_only)
+    if header_only:
+        return next(rows, [])
+    data = list(rows)
+    if not data:
+        return pd.DataFrame()
+    return pd.io.parsers.TextParser(data, header=0, skip_blank_lines=False).read()
+
+def load_input_df(input_source, columns=None):
+    """
+    Loads a PSI input (Excel workbook, Arrow IPC/Feather or Parquet), from a path or an uploaded file object.
+    If `columns` is given (see get_required_input_columns), only those columns are read: xlsx workbooks are
+    streamed with a read-only reader, Arrow/Parquet columns are projected before materializing.
+    """
+    extension = get_input_extension(input_source)
+    if extension in ARROW_INPUT_EXTENSIONS or extension in PARQUET_INPUT_EXTENSIONS:
+        return read_arrow_table(input_source, columns, parquet=extension in PARQUET_INPUT_EXTENSIONS).to_pandas()
+    if columns is not None:
+        return read_excel_columns(input_source, columns)
+    return pd.read_excel(input_source)
+
+def iter_input_chunks(input_source, columns, chunk_size):
+    """
+    Streams a PSI input as DataFrames of at most `chunk_size` rows (each read like load_input_df, with types
+    inferred per chunk), so a whole input never has to be held in memory. xlsx rows are streamed from the sheet
+    XML, Parquet is read row batch by row batch and Arrow IPC files are memory-mapped and sliced.
+    """
+    extension = get_input_extension(input_source)
+    if extension in PARQUET_INPUT_EXTENSIONS:
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Arrow/Feather and Parquet inputs require pyarrow (pip install pyarrow)")
+        parquet_file = pq.ParquetFile(input_source if isinstance(input_source, str) else
+                                      io.BytesIO(input_source.getvalue() if hasattr(input_source, "getvalue") else input_source.read()))
+        selected = [c for c in columns if c in parquet_file.schema_arrow.names]
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=selected):
+            yield batch.to_pandas()
+    elif extension in ARROW_INPUT_EXTENSIONS:
+        table = read_arrow_table(input_source, columns) # Memory-mapped; only the slices are materialized
+        for offset in range(0, table.num_rows, chunk_size):
+            yield table.slice(offset, chunk_size).to_pandas()
+    else:
+        rows = iter_excel_rows(input_source, columns)
+        header = next(rows, None)
+        if header is None:
+            return
+        chunk = []
+        for values in rows:
+            chunk.append(values)
+            if len(chunk) == chunk_size:
+                yield pd.io.parsers.TextParser([header] + chunk, header=0, skip_blank_lines=False).read()
+                chunk = []
+        if chunk:
+            yield pd.io.parsers.TextParser([header] + chunk, header=0, skip_blank_lines=False).read()
+
+# --- Appendix Loading and Code Set Extraction (Enhanced to handle descriptive column names) ---
+def load_appendix_df(appendix_source, is_json=False):
+    """
+    Loads the PSI appendix from an Excel workbook or a JSON document with a 'data' list.
+    `appendix_source` can be a path or a file-like object. Raises ValueError for malformed JSON appendices.
+    """
+    if is_json:
+        # For JSON, load directly and convert 'data' key to DataFrame
+        if isinstance(appendix_source, str):
+            with open(appendix_source, "r", encoding="utf-8") as f:
+                json_data = json.load(f)
+        else:
+            json_data = json.load(appendix_source)
+        if 'data' in json_data and isinstance(json_data['data'], list):
+            return pd.DataFrame(json_data['data'])
+        raise ValueError("Invalid JSON appendix format. Expected a 'data' key containing a list of objects.")
+    return pd.read_excel(appendix_source)
+
+def get_code_set_name(column):
+    """Code set key for an appendix column, e.g. "Reclosure procedures (RECLOIP)" -> "RECLOIP_CODES"."""
+    col_clean = str(column).strip() # Ensure column name is string
+    # Use regex to extract the code reference from parentheses, e.g., (RECLOIP)
+    match = re.search(r'\(([^)]+)\)', col_clean)
+    if match:
+        # Use the extracted code reference as the key
+        return f"{match.group(1).upper()}_CODES"
+    # Fallback if no parentheses found (e.g., if appendix column is already clean)
+    return f"{col_clean.upper()}_CODES"
+
+def clean_code_set(series):
+    """Clean codes: remove periods and convert to uppercase."""
+    return series.dropna().astype(str).str.replace(".", "", regex=False).str.upper().tolist()
+
+def extract_code_sets(appendix_df):
+    """Builds the {<REFERENCE>_CODES: [codes]} dict from the appendix columns."""
+    code_sets = {}
+    for col in appendix_df.columns:
+        code_sets[get_code_set_name(col)] = clean_code_set(appendix_df[col])
+
+    # Add common codes that might not be explicitly listed in the appendix but are used
+    # (e.g., ORPROC from Appendix A, SURGI2R from Appendix E, MEDIC2R from Appendix C)
+    # Assuming these are provided with their full names in the appendix columns.
+    # If not, they would need to be manually added or derived.
+    return code_sets
+
+# --- Code Set Registry (which appendix code sets each PSI reads) ---
+PSI_CODE_SET_REFERENCES = {
+    "PSI_05": ["FOREIID_CODES", "SURGI2R_CODES", "MEDIC2R_CODES", "MDC14PRINDX_CODES", "MDC15PRINDX_CODES"],
+    "PSI_06": ["IATROID_CODES", "IATPTXD_CODES", "CTRAUMD_CODES", "PLEURAD_CODES", "THORAIP_CODES", "CARDSIP_CODES", "SURGI2R_CODES", "MEDIC2R_CODES", "MDC14PRINDX_CODES", "MDC15PRINDX_CODES"],
+    "PSI_07": ["IDTMC3D_CODES", "CANCEID_CODES", "IMMUNID_CODES", "IMMUNIP_CODES", "SURGI2R_CODES", "MEDIC2R_CODES", "MDC14PRINDX_CODES", "MDC15PRINDX_CODES"],
+    "PSI_08": ["FXID_CODES", "HIPFXID_CODES", "PROSFXID_CODES", "SURGI2R_CODES", "MEDIC2R_CODES", "MDC14PRINDX_CODES", "MDC15PRINDX_CODES"],
+    "PSI_09": ["POHMRI2D_CODES", "HEMOTH2P_CODES", "COAGDID_CODES", "MEDBLEEDD_CODES", "THROMBOLYTICP_CODES", "ORPROC_CODES", "SURGI2R_CODES", "MDC14PRINDX_CODES", "MDC15PRINDX_CODES"],
+    "PSI_10": ["PHYSIDB_CODES", "DIALYIP_CODES", "DIALY2P_CODES", "CARDIID_CODES", "CARDRID_CODES", "SHOCKID_CODES", "CRENLFD_CODES", "URINARYOBSID_CODES", "SOLKIDD_CODES", "PNEPHREP_CODES", "ORPROC_CODES", "SURGI2R_CODES", "MDC14PRINDX_CODES", "MDC15PRINDX_CODES"],
+    "PSI_11": ["ACURF2D_CODES", "ACURF3D_CODES", "PR9672P_CODES", "PR9671P_CODES", "PR9604P_CODES", "TRACHID_CODES", "TRACHIP_CODES", "MALHYPD_CODES", "NEUROMD_CODES", "DGNEUID_CODES", "NUCRANP_CODES", "PRESOPP_CODES", "LUNGCIP_CODES", "LUNGTRANSP_CODES", "ORPROC_CODES", "SURGI2R_CODES", "MDC14PRINDX_CODES", "MDC15PRINDX_CODES"],
+    "PSI_12": ["DEEPVIB_CODES", "PULMOID_CODES", "HITD_CODES", "NEURTRAD_CODES", "VENACIP_CODES", "THROMP_CODES", "ECMOP_CODES", "ORPROC_CODES", "SURGI2R_CODES", "MEDIC2R_CODES", "MDC14PRINDX_CODES", "MDC15PRINDX_CODES"],
+    "PSI_13": ["SEPTI2D_CODES", "INFECID_CODES", "ORPROC_CODES", "SURGI2R_CODES", "MDC14PRINDX_CODES", "MDC15PRINDX_CODES", "SEVEREIMMUNED_CODES", "MODERATEIMMUNED_CODES", "MALIGNANCY_CODES", "CHEMOTHERAPYP_CODES", "RADIATIONP_CODES"], # Added risk adjustment codes
+    "PSI_14": ["RECLOIP_CODES", "ABWALLCD_CODES", "ABDOMIPOPEN_CODES", "ABDOMIPOTHER_CODES", "MDC14PRINDX_CODES", "MDC15PRINDX_CODES"],
+    "PSI_15": ["ABDOMI15P_CODES", "SPLEEN15D_CODES", "SPLEEN15P_CODES", "ADRENAL15D_CODES", "ADRENAL15P_CODES", "VESSEL15D_CODES", "VESSEL15P_CODES", "DIAPHR15D_CODES", "DIAPHR15P_CODES", "GI15D_CODES", "GI15P_CODES", "GU15D_CODES", "GU15P_CODES", "SURGI2R_CODES", "MEDIC2R_CODES", "MDC14PRINDX_CODES", "MDC15PRINDX_CODES"]
+}
+
+def get_psi_code_set_names(psi_names):
+    """Unique code set names the given PSIs read, in registry order."""
+    return list(dict.fromkeys(name for psi in psi_names for name in PSI_CODE_SET_REFERENCES.get(psi, [])))
+
+class LazyCodeSets(Mapping):
+    """
+    Read-only {<REFERENCE>_CODES: [codes]} mapping over an appendix whose code set columns are only read
+    and cleaned on first use. Keys are known up front from the appendix header; `load_columns(labels)`
+    returns a DataFrame with the requested appendix columns. Any code set the registry misses is still
+    loaded on first access, so results never depend on the registry being complete.
+    `share_code_set(codes)`, if given, is applied to every loaded code set (e.g. to share identical sets
+    and code strings between appendix versions, see psi_registry). Loads are serialized, so one instance
+    can be shared between threads (see psi_cache).
+    """
+
+    def __init__(self, column_labels, load_columns, share_code_set=None):
+        self._labels = {}
+        for label in column_labels: # Later columns win, as in extract_code_sets
+            self._labels[get_code_set_name(label)] = label
+        self._load_columns = load_columns
+        self._share_code_set = share_code_set
+        self._code_sets = {}
+        self._load_lock = threading.Lock()
+
+    def preload(self, code_set_names):
+        """Materializes the given code sets (unknown names are ignored) with a single read of the appendix."""
+        with self._load_lock:
+            missing = [name for name in dict.fromkeys(code_set_names) if name in self._labels and name not in self._code_sets]
+            if missing:
+                columns_df = self._load_columns([self._labels[name] for name in missing])
+                for name in missing:
+                    codes = clean_code_set(columns_df[self._labels[name]])
+                    self._code_sets[name] = self._share_code_set(codes) if self._share_code_set else codes
+        return self
+
+    def loaded_names(self):
+        return list(self._code_sets)
+
+    def __getitem__(self, code_set_name):
+        if code_set_name not in self._code_sets:
+            if code_set_name not in self._labels:
+                raise KeyError(code_set_name)
+            logger.info("Loading code set %s on first use", code_set_name)
+            self.preload([code_set_name])
+        return self._code_sets[code_set_name]
+
+    def __contains__(self, code_set_name):
+        return code_set_name in self._labels
+
+    def __iter__(self):
+        return iter(self._labels)
+
+    def __len__(self):
+        return len(self._labels)
+
+def open_lazy_code_sets(appendix_source, is_json=False, share_code_set=None):
+    """
+    Opens an appendix (Excel or JSON, path or file-like) as LazyCodeSets. Only the header of an Excel
+    appendix is read here; code set columns are streamed on first use. JSON appendices are parsed once.
+    """
+    if is_json:
+        appendix_df = load_appendix_df(appendix_source, is_json=True)
+        return LazyCodeSets(appendix_df.columns, lambda labels: appendix_df[labels], share_code_set)
+
+    if not isinstance(appendix_source, str): # Uploaded file: keep the bytes for the later column reads
+        appendix_source = io.BytesIO(appendix_source.getvalue() if hasattr(appendix_source, "getvalue") else appendix_source.read())
+
+    def load_columns(labels):
+        if not isinstance(appendix_source, str):
+            appendix_source.seek(0)
+        return read_excel_columns(appendix_source, labels)
+
+    return LazyCodeSets(read_excel_columns(appendix_source, [], header_only=True), load_columns, share_code_set)
+
+def build_code_lookup(code_sets, code_set_names):
+    """The union of the named code sets as a unique pd.Index (missing sets count as empty)."""
+    codes = [code for code_set_name in code_set_names for code in code_sets.get(code_set_name, [])]
+    return pd.Index(codes, dtype="object").unique()
+
+def is_in_code_lookup(values, code_lookup):
+    """Column-wise membership of `values` in a build_code_lookup Index, as a boolean numpy array."""
+    return code_lookup.get_indexer(values) >= 0
+
+class CompiledAppendix(dict):
+    """
+    Compiled appendix dict whose PSI 15 organ maps are built on first access. Code lookups (see get_code_lookup)
+    are kept per combination of code sets, so bulk membership tests do not rebuild them per call.
+    """
+
+    def __missing__(self, key):
+        if key == "organ_systems":
+            self[key] = build_organ_system_mapping(self["code_sets"])
+        elif key == "organ_code_index":
+            self[key] = build_organ_code_index(self["organ_systems"])
+        elif key == "code_lookups":
+            self[key] = {}
+        else:
+            raise KeyError(key)
+        return self[key]
+
+
+def get_code_lookup(compiled_appendix, code_set_names):
+    """
+    build_code_lookup over the named code sets of a compiled appendix, built once per CompiledAppendix and
+    combination of code sets (a plain {"code_sets": ...} dict gets a fresh lookup every call).
+    """
+    code_set_names = tuple(code_set_names)
+    if not isinstance(compiled_appendix, CompiledAppendix):
+        return build_code_lookup(compiled_appendix["code_sets"], code_set_names)
+    code_lookup = compiled_appendix["code_lookups"].get(code_set_names)
+    if code_lookup is None:
+        code_lookup = compiled_appendix["code_lookups"][code_set_names] = build_code_lookup(compiled_appendix["code_sets"], code_set_names)
+    return code_lookup
+
+def compile_appendix(appendix_df, share_code_set=None):
+    """
+    Compiles everything the engine needs from an appendix DataFrame once, so it can be reused
+    across many evaluations: code sets, the PSI 15 organ system mapping and its code->organ index.
+    `share_code_set` is applied to every code set as in LazyCodeSets.
+    """
+    code_sets = extract_code_sets(appendix_df)
+    if share_code_set:
+        code_sets = {name: share_code_set(codes) for name, codes in code_sets.items()}
+    compiled_appendix = CompiledAppendix(code_sets=code_sets)
+    compiled_appendix["organ_code_index"] # Builds organ_systems too
+    return compiled_appendix
+
+def compile_lazy_appendix(appendix_source, is_json=False, psi_names=None, share_code_set=None):
+    """
+    Compiles an appendix for the given PSIs only: their registry code sets are read in one pass and every
+    other code set (and the PSI 15 organ maps) is only materialized if something asks for it.
+    Suited to interactive runs of a few PSIs; use compile_appendix for long-lived services and batches.
+    """
+    code_sets = open_lazy_code_sets(appendix_source, is_json=is_json, share_code_set=share_code_set)
+    code_sets.preload(get_psi_code_set_names(psi_names or ALL_PSIS))
+    return CompiledAppendix(code_sets=code_sets)
+
+def get_organ_maps(compiled_appendix, psi_name):
+    """(organ_systems, organ_code_index) for PSI 15; other PSIs never read them, so nothing is built for them."""
+    if psi_name != "PSI_15":
+        return None, None
+    return compiled_appendix["organ_systems"], compiled_appendix["organ_code_index"]
+
+# --- Input Schema Normalization (runs once, column-wise, before scoring) ---
+DX_COLUMN_COUNT = 30 # DX1 (principal) through DX30
+PROC_COLUMN_COUNT = 20 # Proc1 through Proc20
+VALID_POA_VALUES = ["Y", "N", "U", "W"]
+
+def get_column_or_empty(df, column_name):
+    """Returns df[column_name], or an all-missing column aligned to df if the column is absent."""
+    if column_name in df.columns:
+        return df[column_name]
+    return pd.Series(None, index=df.index, dtype="object")
+
+def clean_code_series(series):
+    """Removes periods, uppercases and strips codes column-wise. Blank or missing codes become NaN."""
+    cleaned = series.astype(str).str.replace(".", "", regex=False).str.upper().str.strip()
+    return cleaned.where(series.notna() & (series.astype(str).str.strip() != ""))
+
+def clean_poa_series(series):
+    """Normalizes POA indicators column-wise. Missing or invalid values become "" (unknown/not applicable)."""
+    cleaned = series.astype(str).str.strip().str.upper()
+    return cleaned.where(series.notna() & cleaned.isin(VALID_POA_VALUES), "")
+
+def coalesce_columns(df, *column_names):
+    """Returns the first non-blank value across the given alias columns, row by row."""
+    result = get_column_or_empty(df, column_names[0])
+    for alias in column_names[1:]:
+        is_blank = result.isna() | (result.astype(str).str.strip() == "")
+        result = result.where(~is_blank, get_column_or_empty(df, alias))
+    return result
+
+def null_unparseable_procedure_datetimes(dates, times):
+    """
+    Returns (dates, times) with what parse_procedure_datetime cannot parse set to None, so the engine sees an
+    undated procedure instead of NaT: a date that does not parse (blank text included), or a time that makes an
+    otherwise parseable date unparseable (the date is kept). The distinct date/time pairs are parsed column-wise
+    once, and the ones that fail are confirmed with parse_procedure_datetime.
+    """
+    has_date = dates.notna().to_numpy()
+    pairs = list(zip(dates[has_date].tolist(), times[has_date].tolist()))
+    distinct_pairs = list(dict.fromkeys(pairs))
+    texts = [format_procedure_datetime(date, time) for date, time in distinct_pairs]
+    try:
+        parsed = pd.to_datetime(pd.Series([date if text is None else text for (date, _), text in zip(distinct_pairs, texts)],
+                                          dtype="object"), errors="coerce", format="mixed")
+        candidates = [pair for pair, is_nat in zip(distinct_pairs, parsed.isna()) if is_nat]
+    except (ValueError, TypeError, OverflowError): # Mixed time zones or out-of-range values: check every pair
+        candidates = distinct_pairs
+    bad_date, bad_time = {}, {}
+    for date, time in candidates:
+        if parse_procedure_datetime(date, time) is pd.NaT:
+            date_only = parse_procedure_datetime(date, None) if pd.notna(time) and str(time).strip() else pd.NaT
+            bad_date[(date, time)], bad_time[(date, time)] = date_only is pd.NaT, date_only is not pd.NaT
+    if not bad_date:
+        return dates, times
+    is_bad_date, is_bad_time = pd.Series(False, index=dates.index), pd.Series(False, index=dates.index)
+    is_bad_date[has_date] = [bad_date.get(pair, False) for pair in pairs]
+    is_bad_time[has_date] = [bad_time.get(pair, False) for pair in pairs]
+    return dates.astype(object).mask(is_bad_date, None), times.astype(object).mask(is_bad_time, None)
+
+def normalize_input_schema(df):
+    """
+    Converts the uploaded input into the one canonical schema read by the scoring engine:
+    - EncounterID (falls back to Encounter_ID, then Row_<index>)
+    - DX1..DX30 / POA1..POA30 (falls back to Pdx and Sdx1..Sdx29 / POA_Sdx1..POA_Sdx29), codes cleaned, POA validated
+    - Proc1..Proc20 codes cleaned, Proc{i}_Date / Proc{i}_Time kept as-is unless unparseable (then None)
+    - MS-DRG as a clean string, DRG as a number (falls back to MS-DRG)
+    - Age, ATYPE, MDC and length_of_stay as numbers, admission_date/discharge_date as datetimes
+    All alias columns are coalesced and dropped; every other column is passed through unchanged.
+    """
+    normalized = df.copy()
+    alias_columns = ["Encounter_ID", "Pdx", "Admission_Date", "Discharge_Date", "Length_of_stay"]
+
+    encounter_id = coalesce_columns(df, "EncounterID", "Encounter_ID")
+    row_labels = pd.Series([f"Row_{idx}" for idx in df.index], index=df.index)
+    normalized["EncounterID"] = encounter_id.where(encounter_id.notna(), row_labels)
+
+    # Principal diagnosis: DX1, then Pdx (POA1 applies to either)
+    normalized["DX1"] = clean_code_series(get_column_or_empty(df, "DX1")).fillna(
+        clean_code_series(get_column_or_empty(df, "Pdx")))
+    normalized["POA1"] = clean_poa_series(get_column_or_empty(df, "POA1"))
+
+    # Secondary diagnoses: DX{i+1}/POA{i+1}, then Sdx{i}/POA_Sdx{i} (Sdx1 maps to DX2)
+    for i in range(1, DX_COLUMN_COUNT):
+        dx_standard = clean_code_series(get_column_or_empty(df, f"DX{i+1}"))
+        use_alt = dx_standard.isna()
+        normalized[f"DX{i+1}"] = dx_standard.where(~use_alt, clean_code_series(get_column_or_empty(df, f"Sdx{i}")))
+        normalized[f"POA{i+1}"] = clean_poa_series(get_column_or_empty(df, f"POA{i+1}")).where(
+            ~use_alt, clean_poa_series(get_column_or_empty(df, f"POA_Sdx{i}")))
+        alias_columns.extend([f"Sdx{i}", f"POA_Sdx{i}"])
+
+    for i in range(1, PROC_COLUMN_COUNT + 1):
+        normalized[f"Proc{i}"] = clean_code_series(get_column_or_empty(df, f"Proc{i}"))
+        if f"Proc{i}_Date" in df.columns:
+            dates, times = null_unparseable_procedure_datetimes(df[f"Proc{i}_Date"], get_column_or_empty(df, f"Proc{i}_Time"))
+            normalized[f"Proc{i}_Date"] = dates
+            if f"Proc{i}_Time" in df.columns:
+                normalized[f"Proc{i}_Time"] = times
+
+    # DRG: MS-DRG kept as text for code set lookups, DRG numeric for data quality checks
+    ms_drg = get_column_or_empty(df, "MS-DRG")
+    ms_drg_numeric = pd.to_numeric(ms_drg, errors="coerce")
+    is_integral = ms_drg_numeric.notna() & (ms_drg_numeric == ms_drg_numeric.round())
+    ms_drg_text = ms_drg.astype(str).str.strip().where(ms_drg.notna(), "")
+    ms_drg_text[is_integral] = ms_drg_numeric[is_integral].astype("int64").astype(str)
+    normalized["MS-DRG"] = ms_drg_text
+    normalized["DRG"] = pd.to_numeric(coalesce_columns(df, "DRG", "MS-DRG"), errors="coerce")
+
+    for col in ["Age", "ATYPE", "MDC"]:
+        normalized[col] = pd.to_numeric(get_column_or_empty(df, col), errors="coerce")
+    normalized["length_of_stay"] = pd.to_numeric(coalesce_columns(df, "length_of_stay", "Length_of_stay"), errors="coerce")
+    normalized["admission_date"] = pd.to_datetime(coalesce_columns(df, "admission_date", "Admission_Date"), errors="coerce", format="mixed")
+    normalized["discharge_date"] = pd.to_datetime(coalesce_columns(df, "discharge_date", "Discharge_Date"), errors="coerce", format="mixed")
+
+    return normalized.drop(columns=[c for c in alias_columns if c in normalized.columns])
+
+# --- Rule Parameters (the defaults are the standard definitions; see psi_scenarios for what-if runs) ---
+DEFAULT_PSI_PARAMETERS = {
+    "psi13_or_cutoff_day": 10, # PSI_13: first OR procedure on/after this day of the admission is excluded
+    "psi15_related_proc_window": (1, 30), # PSI_15: related procedure this many days (inclusive) after the index procedure
+    "min_length_of_stay": 2, # PSI_07 / PSI_14: shorter stays are excluded
+}
+PSI_PARAMETER_NAMES = { # Parameters each PSI's rule logic reads (validate_timing: see TIMING_PSIS)
+    "PSI_07": ["min_length_of_stay"],
+    "PSI_13": ["psi13_or_cutoff_day"],
+    "PSI_14": ["min_length_of_stay"],
+    "PSI_15": ["psi15_related_proc_window"],
+}
+
+def format_ordinal(number):
+    """1 -> "1st", 2 -> "2nd", 10 -> "10th", 22 -> "22nd"."""
+    suffix = "th" if 10 <= number % 100 <= 20 else {1: "st", 2: "nd", 3: "rd"}.get(number % 10, "th")
+    return f"{number}{suffix}"
+
+# --- Duplicate Encounter Fingerprints (identical clinical content is scored once) ---
+FINGERPRINT_FIELD_COLUMNS = ["Age", "SEX", "DQTR", "YEAR", "ATYPE", "MS-DRG", "DRG", "MDC",
+                             "admission_date", "discharge_date", "length_of_stay"]
+FINGERPRINT_COLUMN_PATTERN = re.compile(r"(DX|POA)\d+|Proc\d+(_Date|_Time)?")
+
+def get_fingerprint_columns(df_normalized):
+    """
+    The normalized columns evaluate_psi_comprehensive and build_result_record read, apart from EncounterID:
+    rows that agree on all of them get the same status, rationale and details for every PSI.
+    """
+    return [c for c in df_normalized.columns
+            if c in FINGERPRINT_FIELD_COLUMNS or FINGERPRINT_COLUMN_PATTERN.fullmatch(str(c))]
+
+def fingerprint_encounters(df_normalized):
+    """Returns a 64-bit hash of each row's clinically relevant fields (see get_fingerprint_columns)."""
+    fingerprint_columns = get_fingerprint_columns(df_normalized)
+    if not fingerprint_columns:
+        return pd.Series(0, index=df_normalized.index, dtype="uint64")
+    return pd.util.hash_pandas_object(df_normalized[fingerprint_columns], index=False)
+
+# --- Bulk Data Quality Stage (runs once over the whole input, before scoring) ---
+REQUIRED_FIELD_COLUMNS = {"SEX": "SEX", "AGE": "Age", "DQTR": "DQTR", "YEAR": "YEAR", "DX1": "DX1"}
+
+def is_blank_series(series):
+    """Column-wise equivalent of `pd.isna(v) or str(v).strip() == ""`."""
+    return series.isna() | (series.astype(str).str.strip() == "")
+
+def build_data_quality_report(df_raw, df_normalized, fingerprints=None):
+    """
+    Runs the data quality checks over the whole input at once.
+    Returns (summary_df, flags_df):
+    - summary_df: one row per issue type and column with the number of affected rows
+    - flags_df: one row per encounter with a boolean flag per issue, plus DQ_Rationale, the
+      "Data Quality: ..." exclusion every PSI would report for the row (None if the row can be scored)
+    DRG 999 and missing required fields exclude a row from scoring for every PSI; invalid POA values,
+    unparseable procedure dates/times and duplicate encounters are reported only (the engine treats the first
+    two as unknown/undated; duplicates are scored once and the result reused, see score_psi).
+    Pass `fingerprints` (fingerprint_encounters) to avoid hashing the input again.
+    """
+    summary_records = []
+    flags_df = pd.DataFrame({"EncounterID": df_normalized["EncounterID"]}, index=df_normalized.index)
+
+    flags_df["DRG_999"] = df_normalized["DRG"] == 999
+    summary_records.append({"Issue": "Ungroupable DRG (999)", "Column": "DRG", "Count": int(flags_df["DRG_999"].sum())})
+
+    missing_flags = []
+    for field_name, column_name in REQUIRED_FIELD_COLUMNS.items():
+        flag_col = f"Missing_{field_name}"
+        flags_df[flag_col] = is_blank_series(get_column_or_empty(df_normalized, column_name))
+        missing_flags.append(flag_col)
+        summary_records.append({"Issue": "Missing required field", "Column": field_name, "Count": int(flags_df[flag_col].sum())})
+
+    invalid_poa = pd.Series(False, index=df_raw.index)
+    poa_columns = [c for c in df_raw.columns if re.fullmatch(r"POA\d+|POA_Sdx\d+", str(c))]
+    for col in poa_columns:
+        poa = df_raw[col].astype(str).str.strip().str.upper()
+        is_invalid = df_raw[col].notna() & (poa != "") & ~poa.isin(VALID_POA_VALUES)
+        invalid_poa |= is_invalid
+        if is_invalid.any():
+            summary_records.append({"Issue": "Invalid POA value", "Column": col, "Count": int(is_invalid.sum())})
+    flags_df["Invalid_POA"] = invalid_poa.values
+
+    # normalize_input_schema sets unparseable procedure dates and times to None
+    bad_proc_date = pd.Series(False, index=df_normalized.index)
+    for i in range(1, PROC_COLUMN_COUNT + 1):
+        for col, issue in [(f"Proc{i}_Date", "Unparseable procedure date"), (f"Proc{i}_Time", "Unparseable procedure time")]:
+            if col not in df_raw.columns or col not in df_normalized.columns:
+                continue
+            is_unparseable = (df_normalized[f"Proc{i}"].notna() & ~is_blank_series(df_raw[col])
+                              & df_normalized[col].isna())
+            bad_proc_date |= is_unparseable
+            if is_unparseable.any():
+                summary_records.append({"Issue": issue, "Column": col, "Count": int(is_unparseable.sum())})
+    flags_df["Unparseable_Proc_Date"] = bad_proc_date
+
+    # Same clinical content as an earlier row (resubmitted claim, repeated test case); the EncounterID may differ
+    fingerprints = fingerprint_encounters(df_normalized) if fingerprints is None else fingerprints
+    flags_df["Duplicate_Encounter"] = fingerprints.duplicated().to_numpy()
+    summary_records.append({"Issue": "Duplicate encounter (scored once)", "Column": "", "Count": int(flags_df["Duplicate_Encounter"].sum())})
+
+    # Same precedence and wording as the row-level checks in evaluate_psi_comprehensive
+    missing_names = pd.Series("", index=flags_df.index, dtype="object")
+    for name, flag_col in zip(REQUIRED_FIELD_COLUMNS, missing_flags):
+        missing_names = missing_names + flags_df[flag_col].map({True: f"{name}, ", False: ""}).astype("object")
+    missing_names = missing_names.str.removesuffix(", ")
+    rationale = pd.Series(None, index=flags_df.index, dtype="object")
+    has_missing = flags_df[missing_flags].any(axis=1)
+    rationale[has_missing] = "Data Quality: Missing required fields (" + missing_names[has_missing] + ")"
+    rationale[flags_df["DRG_999"]] = "Data Quality: Ungroupable DRG (999)"
+    flags_df["DQ_Rationale"] = rationale
+    flags_df["Excluded_From_Scoring"] = rationale.notna()
+
+    summary_records.append({"Issue": "Rows excluded from scoring", "Column": "", "Count": int(flags_df["Excluded_From_Scoring"].sum())})
+    return pd.DataFrame(summary_records), flags_df
+
+# --- Vectorized Denominator Prefilter (common exclusions + per-PSI population criteria) ---
+# Column-wise versions of the first checks in evaluate_psi_comprehensive. Rationale text must stay identical.
+SURGICAL_MEDICAL_DRG_SETS = ["SURGI2R_CODES", "MEDIC2R_CODES"]
+PSI_POPULATION_CRITERIA = {
+    # drg_code_sets: MS-DRG in any of the sets; procedure_code_sets: any procedure in any of the sets;
+    # elective_only: ATYPE == 3. Age >= 18 and the MDC 14/15 exclusions are common to every PSI.
+    "PSI_05": {"drg_code_sets": SURGICAL_MEDICAL_DRG_SETS,
+               "rationale": "Population Exclusion: Not surgical/medical DRG (>=18) or obstetric case (any age)"},
+    "PSI_06": {"drg_code_sets": SURGICAL_MEDICAL_DRG_SETS,
+               "rationale": "Population Exclusion: Not surgical/medical DRG or age < 18"},
+    "PSI_07": {"drg_code_sets": SURGICAL_MEDICAL_DRG_SETS,
+               "rationale": "Population Exclusion: Not surgical/medical DRG (>=18) or obstetric case (any age)"},
+    "PSI_08": {"drg_code_sets": SURGICAL_MEDICAL_DRG_SETS,
+               "rationale": "Population Exclusion: Not surgical/medical DRG or age < 18"},
+    "PSI_09": {"drg_code_sets": ["SURGI2R_CODES"], "procedure_code_sets": ["ORPROC_CODES"],
+               "rationale": "Population Exclusion: Not surgical DRG (>=18) or no OR procedure"},
+    "PSI_10": {"drg_code_sets": ["SURGI2R_CODES"], "procedure_code_sets": ["ORPROC_CODES"], "elective_only": True,
+               "rationale": "Population Exclusion: Not elective surgical DRG (>=18) or no OR procedure"},
+    "PSI_11": {"drg_code_sets": ["SURGI2R_CODES"], "procedure_code_sets": ["ORPROC_CODES"], "elective_only": True,
+               "rationale": "Population Exclusion: Not elective surgical DRG (>=18) or no OR procedure"},
+    "PSI_12": {"drg_code_sets": ["SURGI2R_CODES"], "procedure_code_sets": ["ORPROC_CODES"],
+               "rationale": "Population Exclusion: Not surgical DRG (>=18) or no OR procedure"},
+    "PSI_13": {"drg_code_sets": ["SURGI2R_CODES"], "procedure_code_sets": ["ORPROC_CODES"], "elective_only": True,
+               "rationale": "Population Exclusion: Not elective surgical DRG (>=18) or no OR procedure"},
+    "PSI_14": {"procedure_code_sets": ["ABDOMIPOPEN_CODES", "ABDOMIPOTHER_CODES"],
+               "rationale": "Population Exclusion: Not age >= 18 or no abdominopelvic surgery"},
+    "PSI_15": {"drg_code_sets": SURGICAL_MEDICAL_DRG_SETS, "procedure_code_sets": ["ABDOMI15P_CODES"],
+               "rationale": "Population Exclusion: Not surgical/medical DRG (>=18) or no abdominopelvic procedure"},
+}
+
+def has_any_procedure_column_wise(df_normalized, code_lookup):
+    """Column-wise has_any_procedure: True for rows with any Proc1..Proc20 code in `code_lookup` (see build_code_lookup)."""
+    proc_columns = [f"Proc{i}" for i in range(1, PROC_COLUMN_COUNT + 1) if f"Proc{i}" in df_normalized.columns]
+    if not proc_columns:
+        return pd.Series(False, index=df_normalized.index)
+    proc_codes = df_normalized[proc_columns].stack() # Long (row, column) -> code, missing procedures dropped
+    matching_rows = proc_codes.index.get_level_values(0)[is_in_code_lookup(proc_codes, code_lookup)]
+    return pd.Series(df_normalized.index.isin(matching_rows), index=df_normalized.index)
+
+def build_prefilter_rationales(df_normalized, psi_name, compiled_appendix, dq_rationales=None):
+    """
+    Applies the data quality exclusions, the common exclusions (MDC 14/15 principal diagnosis, age < 18)
+    and the PSI's population criteria to the whole input at once. The code set lookups are the compiled
+    appendix's cached ones (see get_code_lookup), so the cost follows the number of rows.
+    Returns a Series aligned to df_normalized: the single rationale entry evaluate_psi_comprehensive would
+    return for out-of-population rows, NaN for candidates that need the detailed rule logic.
+    """
+    rationales = pd.Series(None, index=df_normalized.index, dtype="object")
+    criteria = PSI_POPULATION_CRITERIA.get(psi_name)
+    if criteria is None: # Unknown PSI: leave every row to the row-level engine
+        return rationales if dq_rationales is None else dq_rationales.copy()
+
+    # Assigned from lowest to highest precedence so the first failing check in engine order wins
+    in_population = pd.Series(True, index=df_normalized.index)
+    if criteria.get("drg_code_sets"):
+        in_population &= is_in_code_lookup(df_normalized["MS-DRG"], get_code_lookup(compiled_appendix, criteria["drg_code_sets"]))
+    if criteria.get("elective_only"):
+        in_population &= df_normalized["ATYPE"] == 3
+    if criteria.get("procedure_code_sets"):
+        in_population &= has_any_procedure_column_wise(df_normalized, get_code_lookup(compiled_appendix, criteria["procedure_code_sets"]))
+    rationales[~in_population] = criteria["rationale"]
+
+    age = df_normalized["Age"]
+    is_minor = age < 18
+    rationales[is_minor] = "Age Exclusion: Patient age " + age[is_minor].astype(str) + " < 18 years"
+    rationales[is_in_code_lookup(df_normalized["DX1"], get_code_lookup(compiled_appendix, ["MDC15PRINDX_CODES"]))] = "Population Exclusion: Principal diagnosis in MDC 15 (Neonatal)"
+    rationales[is_in_code_lookup(df_normalized["DX1"], get_code_lookup(compiled_appendix, ["MDC14PRINDX_CODES"]))] = "Population Exclusion: Principal diagnosis in MDC 14 (Obstetric)"
+
+    if dq_rationales is not None:
+        rationales = dq_rationales.where(dq_rationales.notna(), rationales)
+    return rationales
+
+# --- Enum for PSI 15 Organ Systems ---
+class OrganSystem(Enum):
+    SPLEEN = "spleen"
+    ADRENAL = "adrenal"  
+    VESSEL = "vessel"
+    DIAPHRAGM = "diaphragm"
+    GASTROINTESTINAL = "gastrointestinal"
+    GENITOURINARY = "genitourinary"
+
+def build_organ_system_mapping(code_sets):
+    """
+    Builds a mapping of organ systems to their respective injury and procedure codes for PSI 15.
+    This is crucial for the organ-matching logic.
+    """
+    return {
+        OrganSystem.SPLEEN: {
+            'injury_codes': code_sets.get('SPLEEN15D_CODES', []),
+            'procedure_codes': code_sets.get('SPLEEN15P_CODES', [])
+        },
+        OrganSystem.ADRENAL: {
+            'injury_codes': code_sets.get('ADRENAL15D_CODES', []),
+            'procedure_codes': code_sets.get('ADRENAL15P_CODES', [])
+        },
+        OrganSystem.VESSEL: {
+            'injury_codes': code_sets.get('VESSEL15D_CODES', []),
+            'procedure_codes': code_sets.get('VESSEL15P_CODES', [])
+        },
+        OrganSystem.DIAPHRAGM: {
+            'injury_codes': code_sets.get('DIAPHR15D_CODES', []),
+            'procedure_codes': code_sets.get('DIAPHR15P_CODES', [])
+        },
+        OrganSystem.GASTROINTESTINAL: {
+            'injury_codes': code_sets.get('GI15D_CODES', []),
+            'procedure_codes': code_sets.get('GI15P_CODES', [])
+        },
+        OrganSystem.GENITOURINARY: {
+            'injury_codes': code_sets.get('GU15D_CODES', []),
+            'procedure_codes': code_sets.get('GU15P_CODES', [])
+        }
+    }
+
+def build_organ_code_index(organ_systems):
+    """
+    Builds reverse maps from each PSI 15 injury/procedure code to the organ systems it belongs to.
+    Lets the PSI 15 organ analysis resolve every diagnosis and procedure with a single lookup.
+    """
+    injury_index = {}
+    procedure_index = {}
+    for organ_system_enum in OrganSystem: # Enum order keeps organ lists in the same order as the mapping
+        organ_info = organ_systems[organ_system_enum]
+        for code in organ_info['injury_codes']:
+            organs = injury_index.setdefault(code, [])
+            if organ_system_enum not in organs:
+                organs.append(organ_system_enum)
+        for code in organ_info['procedure_codes']:
+            organs = procedure_index.setdefault(code, [])
+            if organ_system_enum not in organs:
+                organs.append(organ_system_enum)
+    return {'injury_codes': injury_index, 'procedure_codes': procedure_index}
+
+# --- Enhanced Data Extraction Functions ---
+def extract_dx_codes_enhanced(row):
+    """
+    Extracts all diagnosis codes and their POA indicators from a normalized row.
+    Returns a list of tuples: (dx_code, poa_status, position, sequence_number).
+    Reads the canonical DX1..DX30 / POA1..POA30 columns produced by normalize_input_schema.
+    """
+    dx_list = []
+    for i in range(1, DX_COLUMN_COUNT + 1):
+        dx_val = row.get(f"DX{i}")
+        if pd.notna(dx_val):
+            poa_val = row.get(f"POA{i}")
+            dx_list.append((dx_val, poa_val if pd.notna(poa_val) else "", "PRINCIPAL" if i == 1 else "SECONDARY", i))
+    return dx_list
+
+def extract_proc_info_enhanced(row, debug_mode=False):
+    """
+    Extracts all procedure codes and their dates from a normalized row.
+    Returns a list of tuples: (proc_code, proc_datetime, sequence_number).
+    Handles up to Proc20.
+    """
+    proc_list = []
+    for i in range(1, PROC_COLUMN_COUNT + 1):  # Support up to 20 procedures
+        code = row.get(f"Proc{i}")
+        date = row.get(f"Proc{i}_Date")
+        time = row.get(f"Proc{i}_Time") # Assuming time might be in a separate column
+        if pd.notna(code):
+            proc_list.append((code, parse_procedure_datetime(date, time, debug_mode=debug_mode, label=f"Proc{i}"), i))
+    return proc_list
+
+def format_procedure_datetime(date, time):
+    """The "<date> <time>" text parse_procedure_datetime parses, or None if there is no time."""
+    if pd.notna(time) and str(time).strip():
+        # Handle time as HH:MM:SS or HHMMSS
+        time_str = str(time).strip()
+        if ':' not in time_str and len(time_str) == 6: # Assume HHMMSS format
+            time_str = f"{time_str[:2]}:{time_str[2:4]}:{time_str[4:]}"
+        elif ':' not in time_str and len(time_str) == 4: # Assume HHMM format
+            time_str = f"{time_str[:2]}:{time_str[2:]}:00"
+        return f"{date} {time_str}"
+    return None
+
+def parse_procedure_datetime(date, time, debug_mode=False, label="procedure"):
+    """
+    Parses a procedure date and optional time. Returns None without a date, NaT if it cannot be parsed
+    (NaT is kept in proc_list, unlike None) and None if parsing raises.
+    """
+    if pd.isna(date):
+        return None
+    try:
+        # Attempt to parse date and time together
+        dt_str = format_procedure_datetime(date, time)
+        if dt_str is not None:
+            return pd.to_datetime(dt_str, errors='coerce')
+        return pd.to_datetime(date, errors='coerce')
+    except Exception as e:
+        # Log error if debug mode is on, but continue gracefully
+        if debug_mode:
+            logger.warning(f"Error parsing procedure date/time for {label}: {e}")
+        return None # Set to None if parsing fails
+
+def parse_date_safe(date_input):
+    """Safely parse various date formats, returning None on failure."""
+    if pd.isna(date_input) or date_input == '':
+        return None
+    try:
+        # Try common formats, coerce errors to NaT (Not a Time)
+        return pd.to_datetime(date_input, errors='coerce')
+    except:
+        return None # Fallback for unexpected errors
+
+def is_code_in_dx_list(dx_list, codes_to_check, position=None, poa=None):
+    """
+    Helper to check if any diagnosis code from `codes_to_check` exists in `dx_list`
+    with optional `position` (PRINCIPAL/SECONDARY) and `poa` (Y/N/U/W).
+    """
+    for dx_code, dx_poa, dx_pos, _ in dx_list:
+        if dx_code in codes_to_check:
+            if position and dx_pos != position:
+                continue
+            if poa and dx_poa != poa:
+                continue
+            return True
+    return False
+
+def get_matching_dx_info(dx_list, codes_to_check, position=None, poa=None):
+    """
+    Helper to retrieve matching diagnosis info.
+    Returns a list of (dx_code, poa_status, position, sequence_number) tuples.
+    """
+    matches = []
+    for dx_code, dx_poa, dx_pos, dx_seq in dx_list:
+        if dx_code in codes_to_check:
+            if position and dx_pos != position:
+                continue
+            if poa and dx_poa != poa:
+                continue
+            matches.append((dx_code, dx_poa, dx_pos, dx_seq))
+    return matches
+
+def get_first_procedure_date(proc_list, target_codes):
+    """Returns the earliest date of any procedure in target_codes from proc_list."""
+    valid_procs = [dt for code, dt, _ in proc_list if code in target_codes and dt is not None]
+    return min(valid_procs) if valid_procs else None
+
+def get_last_procedure_date(proc_list, target_codes):
+    """Returns the latest date of any procedure in target_codes from proc_list."""
+    valid_procs = [dt for code, dt, _ in proc_list if code in target_codes and dt is not None]
+    return max(valid_procs) if valid_procs else None
+
+def has_any_procedure(proc_list, target_codes):
+    """Checks if any procedure in target_codes exists in proc_list."""
+    return any(code in target_codes for code, _, _ in proc_list)
+
+def count_procedures_of_type(proc_list, target_codes):
+    """Counts occurrences of procedures from target_codes in proc_list."""
+    return sum(1 for code, _, _ in proc_list if code in target_codes)
+
+def build_procedure_date_index(proc_list):
+    """
+    Builds a date-sorted index of the dated procedures in proc_list.
+    Returns a tuple (dates, codes) of parallel lists ordered by procedure datetime.
+    """
+    dated_procs = sorted(
+        ((dt, code) for code, dt, _ in proc_list if dt is not None and pd.notna(dt)),
+        key=lambda item: item[0]
+    )
+    return [dt for dt, _ in dated_procs], [code for _, code in dated_procs]
+
+def get_procedures_in_window(proc_date_index, start, end):
+    """Returns (proc_code, proc_datetime) pairs from a date index with start <= datetime < end."""
+    dates, codes = proc_date_index
+    lo = bisect_left(dates, start)
+    hi = bisect_left(dates, end, lo)
+    return list(zip(codes[lo:hi], dates[lo:hi]))
+
+# --- Procedure Feature Table (code set first/last dates and counts per encounter) ---
+PSI_PROCEDURE_FEATURE_CODE_SETS = { # Procedure code sets whose dates, counts or presence each PSI's rule logic reads
+    "PSI_09": ["ORPROC_CODES", "HEMOTH2P_CODES", "THROMBOLYTICP_CODES"],
+    "PSI_10": ["ORPROC_CODES", "DIALYIP_CODES", "DIALY2P_CODES"],
+    "PSI_11": ["ORPROC_CODES", "TRACHIP_CODES", "PR9672P_CODES", "PR9671P_CODES", "PR9604P_CODES"],
+    "PSI_12": ["ORPROC_CODES", "VENACIP_CODES", "THROMP_CODES"],
+    "PSI_13": ["ORPROC_CODES"],
+    "PSI_14": ["ABDOMIPOPEN_CODES", "ABDOMIPOTHER_CODES", "RECLOIP_CODES"],
+    "PSI_15": ["ABDOMI15P_CODES"],
+}
+
+def is_plain_datetime(value):
+    """True for NaT and tz-naive Timestamps that fit a datetime64[ns] column."""
+    return value is pd.NaT or (isinstance(value, pd.Timestamp) and value.tz is None
+                               and pd.Timestamp.min <= value <= pd.Timestamp.max)
+
+def build_procedure_long_table(df_normalized, debug_mode=False):
+    """
+    Long table of every Proc1..Proc20 code: row (position in df_normalized), sequence, code, dated (a date
+    value is present) and date, in row then sequence order. Dates are parsed by parse_procedure_datetime
+    once per distinct date/time pair; "plain" is False for parsed values that are not NaT or tz-naive.
+    """
+    frames = []
+    for i in range(1, PROC_COLUMN_COUNT + 1):
+        if f"Proc{i}" not in df_normalized.columns:
+            continue
+        codes = df_normalized[f"Proc{i}"]
+        has_code = codes.notna().to_numpy()
+        frames.append(pd.DataFrame({
+            "row": pd.RangeIndex(len(df_normalized))[has_code],
+            "sequence": i,
+            "code": codes[has_code].tolist(),
+            "raw_date": get_column_or_empty(df_normalized, f"Proc{i}_Date")[has_code].tolist(), # Same objects as row.get
+            "raw_time": get_column_or_empty(df_normalized, f"Proc{i}_Time")[has_code].tolist(),
+        }))
+    if not frames:
+        return pd.DataFrame({"row": pd.Series(dtype="int64"), "sequence": pd.Series(dtype="int64"), "code": pd.Series(dtype="object"),
+                             "dated": pd.Series(dtype="bool"), "plain": pd.Series(dtype="bool"), "date": pd.Series(dtype="datetime64[ns]")})
+    long_df = pd.concat(frames, ignore_index=True).sort_values(["row", "sequence"], kind="stable", ignore_index=True)
+
+    pairs = list(zip(long_df["raw_date"], long_df["raw_time"]))
+    parsed_dates = {pair: parse_procedure_datetime(*pair, debug_mode=debug_mode) for pair in dict.fromkeys(pairs)}
+    parsed = [parsed_dates[pair] for pair in pairs]
+    long_df["dated"] = pd.Series([dt is not None for dt in parsed], index=long_df.index, dtype="bool")
+    long_df["plain"] = pd.Series([dt is None or is_plain_datetime(dt) for dt in parsed], index=long_df.index, dtype="bool")
+    long_df["date"] = pd.to_datetime(pd.Series([dt if dt is not None and is_plain_datetime(dt) else pd.NaT for dt in parsed],
+                                               dtype="object"), errors="coerce").astype("datetime64[ns]")
+    return long_df.drop(columns=["raw_date", "raw_time"])
+
+def build_procedure_features(df_normalized, code_sets, code_set_names, debug_mode=False):
+    """
+    Per-encounter procedure feature table, computed with one group-by over the long procedure table: for each
+    code set, {name}_first / {name}_last (earliest / latest dated procedure), {name}_count (procedures, dated
+    or not) and {name}_first_day (days from admission to {name}_first).
+    Values match what get_first_procedure_date / get_last_procedure_date / count_procedures_of_type return on
+    the row's proc_list: None without dated procedures, and NaT when the first dated procedure of the set has
+    an unparseable date (NaT never compares smaller or larger, so min()/max() keep a leading NaT).
+    Rows with tz-aware or out-of-range dates are left out; callers fall back to scanning proc_list for them.
+    Returns a DataFrame indexed like df_normalized, with object columns holding the same values.
+    """
+    code_set_names = list(dict.fromkeys(code_set_names))
+    long_df = build_procedure_long_table(df_normalized, debug_mode=debug_mode)
+    code_map = pd.DataFrame([(code, name) for name in code_set_names for code in dict.fromkeys(code_sets.get(name, []))],
+                            columns=["code", "code_set"])
+    matches = long_df.merge(code_map, on="code") # Inner join keeps row/sequence order
+
+    keys = ["row", "code_set"]
+    counts = matches.groupby(keys).size()
+    dated = matches[matches["dated"]]
+    first_dated = dated.drop_duplicates(keys).set_index(keys)["date"] # Leading dated procedure of each set
+    bounds = dated[dated["date"].notna()].groupby(keys)["date"].agg(["min", "max"])
+    group_df = pd.DataFrame({"count": counts}).join(bounds).join(first_dated.isna().rename("leading_nat"))
+
+    admit_raw = get_column_or_empty(df_normalized, "admission_date").tolist()
+    parsed_admits = {value: parse_date_safe(value) for value in dict.fromkeys(admit_raw)}
+    admit_dates = [parsed_admits[value] for value in admit_raw]
+    admit_series = pd.to_datetime(pd.Series([a if a is not None and is_plain_datetime(a) else pd.NaT for a in admit_dates],
+                                            dtype="object"), errors="coerce").astype("datetime64[ns]")
+
+    row_count = len(df_normalized)
+    features = {}
+    for name in code_set_names:
+        group = group_df.xs(name, level="code_set") if name in group_df.index.get_level_values("code_set") else group_df.iloc[0:0].droplevel("code_set")
+        group = group.reindex(pd.RangeIndex(row_count))
+        has_dated = group["leading_nat"].notna().to_numpy()
+        leading_nat = group["leading_nat"].fillna(False).astype(bool).to_numpy()
+        for bound, suffix in (("min", "first"), ("max", "last")):
+            values = pd.Series(group[bound].astype("datetime64[ns]").astype("object").to_numpy(), dtype="object")
+            values[leading_nat] = pd.NaT
+            values[~has_dated] = None
+            features[f"{name}_{suffix}"] = values
+        features[f"{name}_count"] = pd.Series(group["count"].fillna(0).astype(int).to_numpy(), dtype="object")
+        first_day = (pd.to_datetime(features[f"{name}_first"].where(has_dated & ~leading_nat), errors="coerce").astype("datetime64[ns]")
+                     - admit_series).dt.days
+        features[f"{name}_first_day"] = pd.Series([int(d) if pd.notna(d) else float("nan") for d in first_day], dtype="object")
+
+    feature_df = pd.DataFrame(features, index=pd.RangeIndex(row_count))
+    exact_rows = pd.Series(True, index=feature_df.index)
+    exact_rows[long_df.loc[~long_df["plain"], "row"].unique()] = False
+    exact_rows &= pd.Series([a is None or is_plain_datetime(a) for a in admit_dates])
+    return feature_df[exact_rows.to_numpy()].set_axis(df_normalized.index[exact_rows.to_numpy()])
+
+def build_procedure_feature_records(df_normalized, psi_name, code_sets, debug_mode=False):
+    """
+    One build_procedure_features record (dict) per row of df_normalized, in row order, for the code sets
+    psi_name reads; None for rows left to the proc_list scan and for PSIs without procedure features.
+    """
+    records = [None] * len(df_normalized)
+    code_set_names = PSI_PROCEDURE_FEATURE_CODE_SETS.get(psi_name)
+    if code_set_names and len(df_normalized):
+        feature_df = build_procedure_features(df_normalized.reset_index(drop=True), code_sets, code_set_names, debug_mode=debug_mode)
+        for position, record in zip(feature_df.index, feature_df.to_dict("records")):
+            records[position] = record
+    return records
+
+class RowProcedureFeatures:
+    """
+    Procedure code set features of one row for evaluate_psi_comprehensive: read from the row's record of
+    build_procedure_features when the caller has one, otherwise scanned from proc_list.
+    """
+    __slots__ = ("proc_list", "code_sets", "admit_date", "record")
+
+    def __init__(self, proc_list, code_sets, admit_date, record=None):
+        self.proc_list = proc_list
+        self.code_sets = code_sets
+        self.admit_date = admit_date
+        self.record = record
+
+    def first(self, code_set_name):
+        if self.record is not None:
+            return self.record[f"{code_set_name}_first"]
+        return get_first_procedure_date(self.proc_list, self.code_sets.get(code_set_name, []))
+
+    def last(self, code_set_name):
+        if self.record is not None:
+            return self.record[f"{code_set_name}_last"]
+        return get_last_procedure_date(self.proc_list, self.code_sets.get(code_set_name, []))
+
+    def count(self, code_set_name):
+        if self.record is not None:
+            return self.record[f"{code_set_name}_count"]
+        return count_procedures_of_type(self.proc_list, self.code_sets.get(code_set_name, []))
+
+    def has(self, code_set_name):
+        if self.record is not None:
+            return self.record[f"{code_set_name}_count"] > 0
+        return has_any_procedure(self.proc_list, self.code_sets.get(code_set_name, []))
+
+    def first_day(self, code_set_name):
+        """Days from admission to the first procedure of the set (call only when both dates are set)."""
+        if self.record is not None:
+            return self.record[f"{code_set_name}_first_day"]
+        return (self.first(code_set_name) - self.admit_date).days
+
+# --- Risk Adjustment / Stratification Logic (Simplified for demonstration) ---
+# Note: Actual AHRQ risk adjustment requires specific parameter estimates
+# and potentially more granular code lists not provided in the JSON.
+# This implementation focuses on the categorization as described.
+
+def classify_immune_compromise(dx_list, proc_list, code_sets):
+    """
+    Classifies a patient's immune compromise level for PSI 13 risk adjustment.
+    This is a simplified example based on common conditions.
+    """
+    # Placeholder codes for demonstration (these would come from a comprehensive appendix)
+    SEVERE_IMMUNE_DX = code_sets.get('SEVEREIMMUNED_CODES', []) # e.g., HIV/AIDS, severe combined immunodeficiency
+    MODERATE_IMMUNE_DX = code_sets.get('MODERATEIMMUNED_CODES', []) # e.g., chronic steroid use, organ transplant
+    MALIGNANCY_DX = code_sets.get('MALIGNANCY_CODES', []) # e.g., leukemia, lymphoma, active cancer
+    CHEMO_PROC = code_sets.get('CHEMOTHERAPYP_CODES', []) # e.g., chemotherapy administration
+    RADIATION_PROC = code_sets.get('RADIATIONP_CODES', []) # e.g., radiation therapy
+
+    # Check for severe immune compromise
+    if is_code_in_dx_list(dx_list, SEVERE_IMMUNE_DX, poa="Y") or \
+       is_code_in_dx_list(dx_list, SEVERE_IMMUNE_DX, poa="N"): # Check both POA statuses for risk
+        return "severe_immune_compromise"
+
+    # Check for moderate immune compromise
+    if is_code_in_dx_list(dx_list, MODERATE_IMMUNE_DX, poa="Y") or \
+       is_code_in_dx_list(dx_list, MODERATE_IMMUNE_DX, poa="N"):
+        return "moderate_immune_compromise"
+
+    # Check for malignancy with treatment
+    has_malignancy_dx = is_code_in_dx_list(dx_list, MALIGNANCY_DX)
+    has_chemo_proc = has_any_procedure(proc_list, CHEMO_PROC)
+    has_radiation_proc = has_any_procedure(proc_list, RADIATION_PROC)
+
+    if has_malignancy_dx and (has_chemo_proc or has_radiation_proc):
+        return "malignancy_with_treatment"
+
+    return "baseline_risk"
+
+def classify_procedure_complexity_psi15(proc_list, code_sets, index_procedure_date):
+    """
+    Classifies procedure complexity for PSI 15 risk adjustment based on procedures
+    performed on the index abdominopelvic procedure date.
+    This is a highly simplified example as 'PClassR' definitions are not provided.
+    """
+    # Placeholder: In a real scenario, PClassR codes would be mapped to complexity levels.
+    # For this example, we'll just count total procedures on index date.
+
+    procs_on_index_date = [code for code, dt, _ in proc_list 
+                           if dt and index_procedure_date and dt.date() == index_procedure_date.date()]
+
+    num_procs_on_index_date = len(procs_on_index_date)
+
+    if num_procs_on_index_date >= 5: # Arbitrary threshold for high complexity
+        return "high_complexity"
+    elif num_procs_on_index_date >= 2: # Arbitrary threshold for moderate complexity
+        return "moderate_complexity"
+    else:
+        return "low_complexity"
+
+# --- Main PSI Evaluation Function ---
+def evaluate_psi_comprehensive(row, psi_name, code_sets, organ_systems, debug_mode=False, validate_timing=True, organ_code_index=None,
+                               parameters=None, parsed_codes=None, procedure_features=None):
+    """
+    Comprehensive PSI evaluation with detailed logic for all PSIs (05-15).
+    This function implements the inclusion, exclusion, numerator, and denominator logic
+    as specified in the compiled_psi_data.json.
+    Expects a row normalized by normalize_input_schema. Pass the precompiled organ_code_index
+    (see compile_appendix) to avoid rebuilding the PSI 15 code->organ maps on every call.
+    `parameters` overrides DEFAULT_PSI_PARAMETERS (what-if scenarios); `parsed_codes` is the row's
+    (dx_list, proc_list) when the caller has already extracted them (e.g. to evaluate several scenarios);
+    `procedure_features` is the row's record of build_procedure_features, read instead of rescanning proc_list
+    for the code set dates and counts of the timing logic.
+    """
+    if organ_code_index is None and psi_name == "PSI_15":
+        organ_code_index = build_organ_code_index(organ_systems)
+    parameters = DEFAULT_PSI_PARAMETERS if parameters is None else {**DEFAULT_PSI_PARAMETERS, **parameters}
+    enc_id = row.get("EncounterID")
+    age = row.get("Age")
+    ms_drg = row.get("MS-DRG", "")
+    principal_dx = row.get("DX1") # Principal diagnosis (DX1 or Pdx, coalesced during normalization)
+    atype = row.get("ATYPE")
+    mdc = row.get("MDC")
+    # DRG column (already falls back to MS-DRG and numeric after normalization)
+    drg_value = row.get("DRG")
+    drg_value = int(drg_value) if pd.notna(drg_value) else None
+
+    # Date fields
+    admit_date = parse_date_safe(row.get("admission_date"))
+    discharge_date = parse_date_safe(row.get("discharge_date"))
+    length_of_stay = row.get("length_of_stay")
+
+    if parsed_codes is None:
+        dx_list = extract_dx_codes_enhanced(row)
+        proc_list = extract_proc_info_enhanced(row, debug_mode=debug_mode)
+    else:
+        dx_list, proc_list = parsed_codes
+    features = RowProcedureFeatures(proc_list, code_sets, admit_date, procedure_features)
+
+    psi_status = "Exclusion"
+    rationale = []
+    detailed_info = {}
+
+    # --- Common Exclusions (Apply to most PSIs) ---
+    # Data Quality Exclusions
+    if drg_value == 999:
+        rationale.append("Data Quality: Ungroupable DRG (999)")
+        return psi_status, rationale, detailed_info
+
+    required_fields = {
+        "SEX": row.get("SEX"), "AGE": age, "DQTR": row.get("DQTR"), 
+        "YEAR": row.get("YEAR"), "DX1": principal_dx
+    }
+    if any(pd.isna(v) or str(v).strip() == "" for k, v in required_fields.items()):
+        missing_fields = [k for k, v in required_fields.items() if pd.isna(v) or str(v).strip() == ""]
+        rationale.append(f"Data Quality: Missing required fields ({', '.join(missing_fields)})")
+        return psi_status, rationale, detailed_info
+
+    # MDC 14 & 15 Principal Diagnosis Exclusions (Obstetric & Neonatal)
+    # These are generally principal diagnosis exclusions
+    if is_code_in_dx_list(dx_list, code_sets.get("MDC14PRINDX_CODES", []), position="PRINCIPAL"):
+        rationale.append("Population Exclusion: Principal diagnosis in MDC 14 (Obstetric)")
+        return psi_status, rationale, detailed_info
+
+    if is_code_in_dx_list(dx_list, code_sets.get("MDC15PRINDX_CODES", []), position="PRINCIPAL"):
+        rationale.append("Population Exclusion: Principal diagnosis in MDC 15 (Neonatal)")
+        return psi_status, rationale, detailed_info
+
+    # Age Exclusion (General, specific PSIs might override)
+    if age < 18:
+        rationale.append(f"Age Exclusion: Patient age {age} < 18 years")
+        return psi_status, rationale, detailed_info
+
+    # --- PSI-Specific Logic ---
+
+    # PSI 05 - Retained Surgical Item or Unretrieved Device Fragment Count
+    if psi_name == "PSI_05":
+        # Denominator/Population Inclusion
+        is_surgical_drg = ms_drg in code_sets.get("SURGI2R_CODES", [])
+        is_medical_drg = ms_drg in code_sets.get("MEDIC2R_CODES", [])
+        is_obstetric_case = is_code_in_dx_list(dx_list, code_sets.get("MDC14PRINDX_CODES", []), position="PRINCIPAL")
+
+        if not ((age >= 18 and (is_surgical_drg or is_medical_drg)) or is_obstetric_case):
+            rationale.append("Population Exclusion: Not surgical/medical DRG (>=18) or obstetric case (any age)")
+            return psi_status, rationale, detailed_info
+
+        # Exclusions
+        foreiid_codes = code_sets.get("FOREIID_CODES", [])
+
+        # Principal diagnosis of retained surgical item
+        if is_code_in_dx_list(dx_list, foreiid_codes, position="PRINCIPAL"):
+            rationale.append("Exclusion: Principal diagnosis of retained surgical item")
+            return psi_status, rationale, detailed_info
+
+        # Secondary diagnosis of retained surgical item present on admission
+        if is_code_in_dx_list(dx_list, foreiid_codes, position="SECONDARY", poa="Y"):
+            rationale.append("Exclusion: Secondary diagnosis of retained surgical item Present on Admission (POA=Y)")
+            return psi_status, rationale, detailed_info
+
+        # Numerator: Secondary diagnosis of retained surgical item (not POA)
+        numerator_matches = get_matching_dx_info(dx_list, foreiid_codes, position="SECONDARY", poa="N")
+        if numerator_matches:
+            psi_status = "Inclusion"
+            rationale.append(f"Numerator: Retained surgical item found (DX: {numerator_matches[0][0]}, POA: N)")
+            detailed_info["retained_surgical_item_matches"] = [m[0] for m in numerator_matches]
+        else:
+            rationale.append("No qualifying retained surgical item diagnosis found for numerator")
+
+    # PSI 06 - Iatrogenic Pneumothorax Rate
+    elif psi_name == "PSI_06":
+        # Denominator Inclusion
+        is_surgical_or_medical = ms_drg in code_sets.get("SURGI2R_CODES", []) or ms_drg in code_sets.get("MEDIC2R_CODES", [])
+        if not (age >= 18 and is_surgical_or_medical):
+            rationale.append("Population Exclusion: Not surgical/medical DRG or age < 18")
+            return psi_status, rationale, detailed_info
+
+        # Exclusions
+        iatptxd_codes = code_sets.get("IATPTXD_CODES", []) # Non-traumatic pneumothorax
+        ctraumd_codes = code_sets.get("CTRAUMD_CODES", []) # Chest trauma
+        pleurad_codes = code_sets.get("PLEURAD_CODES", []) # Pleural conditions
+        thoraip_codes = code_sets.get("THORAIP_CODES", []) # Thoracic surgery procedures
+        cardsip_codes = code_sets.get("CARDSIP_CODES", []) # Potentially trans-pleural cardiac procedure
+
+        # Principal diagnosis of non-traumatic pneumothorax
+        if is_code_in_dx_list(dx_list, iatptxd_codes, position="PRINCIPAL"):
+            rationale.append("Exclusion: Principal diagnosis of non-traumatic pneumothorax")
+            return psi_status, rationale, detailed_info
+
+        # Secondary diagnosis of non-traumatic pneumothorax present on admission
+        if is_code_in_dx_list(dx_list, iatptxd_codes, position="SECONDARY", poa="Y"):
+            rationale.append("Exclusion: Secondary diagnosis of non-traumatic pneumothorax POA=Y")
+            return psi_status, rationale, detailed_info
+
+        # Any diagnosis of specified chest trauma
+        if is_code_in_dx_list(dx_list, ctraumd_codes):
+            rationale.append("Exclusion: Any diagnosis of specified chest trauma")
+            return psi_status, rationale, detailed_info
+
+        # Any diagnosis of pleural effusion
+        if is_code_in_dx_list(dx_list, pleurad_codes):
+            rationale.append("Exclusion: Any diagnosis of pleural effusion")
+            return psi_status, rationale, detailed_info
+
+        # Thoracic surgery or potentially trans-pleural cardiac procedure
+        if has_any_procedure(proc_list, thoraip_codes) or has_any_procedure(proc_list, cardsip_codes):
+            rationale.append("Exclusion: Thoracic surgery or trans-pleural cardiac procedure")
+            return psi_status, rationale, detailed_info
+
+        # Numerator: Secondary diagnosis of iatrogenic pneumothorax (not POA)
+        # Note: JSON uses IATROID* for numerator, IATPTXD* for exclusions.
+        iatroid_codes = code_sets.get("IATROID_CODES", [])
+        numerator_matches = get_matching_dx_info(dx_list, iatroid_codes, position="SECONDARY", poa="N")
+
+        if numerator_matches:
+            psi_status = "Inclusion"
+            rationale.append(f"Numerator: Iatrogenic pneumothorax found (DX: {numerator_matches[0][0]}, POA: N)")
+            detailed_info["iatrogenic_pneumothorax_matches"] = [m[0] for m in numerator_matches]
+        else:
+            rationale.append("No qualifying iatrogenic pneumothorax diagnosis found for numerator")
+
+    # PSI 07 - Central Venous Catheter-Related Bloodstream Infection Rate
+    elif psi_name == "PSI_07":
+        # Denominator Inclusion
+        is_surgical_or_medical = ms_drg in code_sets.get("SURGI2R_CODES", []) or ms_drg in code_sets.get("MEDIC2R_CODES", [])
+        is_obstetric_case = is_code_in_dx_list(dx_list, code_sets.get("MDC14PRINDX_CODES", []), position="PRINCIPAL")
+
+        if not ((age >= 18 and is_surgical_or_medical) or is_obstetric_case):
+            rationale.append("Population Exclusion: Not surgical/medical DRG (>=18) or obstetric case (any age)")
+            return psi_status, rationale, detailed_info
+
+        # Exclusions
+        idtmc3d_codes = code_sets.get("IDTMC3D_CODES", []) # CVC-related BSI
+        canceid_codes = code_sets.get("CANCEID_CODES", []) # Cancer
+        immunid_codes = code_sets.get("IMMUNID_CODES", []) # Immunocompromised state diagnosis
+        immunip_codes = code_sets.get("IMMUNIP_CODES", []) # Immunocompromised state procedure
+
+        # Principal diagnosis of CVC-related BSI
+        if is_code_in_dx_list(dx_list, idtmc3d_codes, position="PRINCIPAL"):
+            rationale.append("Exclusion: Principal diagnosis of CVC-related BSI")
+            return psi_status, rationale, detailed_info
+
+        # Secondary diagnosis of CVC-related BSI present on admission
+        if is_code_in_dx_list(dx_list, idtmc3d_codes, position="SECONDARY", poa="Y"):
+            rationale.append("Exclusion: Secondary diagnosis of CVC-related BSI POA=Y")
+            return psi_status, rationale, detailed_info
+
+        # Length of stay less than 2 days
+        min_length_of_stay = parameters["min_length_of_stay"]
+        if pd.notna(length_of_stay) and length_of_stay < min_length_of_stay:
+            rationale.append(f"Exclusion: Length of stay < {min_length_of_stay} days ({length_of_stay} days)")
+            return psi_status, rationale, detailed_info
+
+        # Any diagnosis of cancer
+        if is_code_in_dx_list(dx_list, canceid_codes):
+            rationale.append("Exclusion: Any diagnosis of cancer")
+            return psi_status, rationale, detailed_info
+
+        # Any diagnosis of immunocompromised state OR any procedure for immunocompromised state
+        if is_code_in_dx_list(dx_list, immunid_codes) or has_any_procedure(proc_list, immunip_codes):
+            rationale.append("Exclusion: Any diagnosis/procedure for immunocompromised state")
+            return psi_status, rationale, detailed_info
+
+        # Numerator: Secondary diagnosis of CVC-related BSI (not POA)
+        numerator_matches = get_matching_dx_info(dx_list, idtmc3d_codes, position="SECONDARY", poa="N")
+
+        if numerator_matches:
+            psi_status = "Inclusion"
+            rationale.append(f"Numerator: CVC-related BSI found (DX: {numerator_matches[0][0]}, POA: N)")
+            detailed_info["cvc_bsi_matches"] = [m[0] for m in numerator_matches]
+        else:
+            rationale.append("No qualifying CVC-related BSI diagnosis found for numerator")
+
+    # PSI 08 - In-Hospital Fall-Associated Fracture Rate
+    elif psi_name == "PSI_08":
+        # Denominator Inclusion: Surgical or medical discharges for patients ages 18 years and older
+        is_surgical_or_medical = ms_drg in code_sets.get("SURGI2R_CODES", []) or ms_drg in code_sets.get("MEDIC2R_CODES", [])
+        if not (age >= 18 and is_surgical_or_medical):
+            rationale.append("Population Exclusion: Not surgical/medical DRG or age < 18")
+            return psi_status, rationale, detailed_info
+
+        # Exclusions
+        fxid_codes = code_sets.get("FXID_CODES", []) # Any fracture
+        prosfxd_codes = code_sets.get("PROSFXID_CODES", []) # Joint prosthesis-associated fracture
+
+        # Principal diagnosis of fracture
+        if is_code_in_dx_list(dx_list, fxid_codes, position="PRINCIPAL"):
+            rationale.append("Exclusion: Principal diagnosis of fracture")
+            return psi_status, rationale, detailed_info
+
+        # Secondary diagnosis of fracture present on admission
+        if is_code_in_dx_list(dx_list, fxid_codes, position="SECONDARY", poa="Y"):
+            rationale.append("Exclusion: Secondary diagnosis of fracture POA=Y")
+            return psi_status, rationale, detailed_info
+
+        # Any diagnosis of joint prosthesis-associated fracture
+        if is_code_in_dx_list(dx_list, prosfxd_codes):
+            rationale.append("Exclusion: Any diagnosis of joint prosthesis-associated fracture")
+            return psi_status, rationale, detailed_info
+
+        # Numerator: Hierarchical Logic
+        hip_fx_codes = code_sets.get("HIPFXID_CODES", []) # Hip fracture
+
+        # Check for Hip Fracture (priority)
+        hip_fx_matches = get_matching_dx_info(dx_list, hip_fx_codes, position="SECONDARY", poa="N")
+
+        if hip_fx_matches:
+            psi_status = "Inclusion"
+            rationale.append(f"Numerator: Hip fracture found (DX: {hip_fx_matches[0][0]}, POA: N)")
+            detailed_info["fracture_type"] = "hip_fracture"
+            detailed_info["hip_fracture_matches"] = [m[0] for m in hip_fx_matches]
+        else:
+            # Check for Other Fracture (if no hip fracture)
+            other_fx_matches = get_matching_dx_info(dx_list, fxid_codes, position="SECONDARY", poa="N")
+            # Ensure it's not a hip fracture
+            other_fx_matches = [m for m in other_fx_matches if m[0] not in hip_fx_codes]
+
+            if other_fx_matches:
+                psi_status = "Inclusion"
+                rationale.append(f"Numerator: Other fracture found (DX: {other_fx_matches[0][0]}, POA: N)")
+                detailed_info["fracture_type"] = "other_fracture"
+                detailed_info["other_fracture_matches"] = [m[0] for m in other_fx_matches]
+            else:
+                rationale.append("No qualifying in-hospital fracture found for numerator")
+
+        if psi_status == "Inclusion":
+            detailed_info["overall_fracture"] = True # For overall component
+
+    # PSI 09 - Postoperative Hemorrhage or Hematoma Rate
+    elif psi_name == "PSI_09":
+        # Denominator Inclusion: Surgical discharges (>=18) with OR procedures
+        is_surgical_drg = ms_drg in code_sets.get("SURGI2R_CODES", [])
+        has_or_procedure = features.has("ORPROC_CODES")
+
+        if not (age >= 18 and is_surgical_drg and has_or_procedure):
+            rationale.append("Population Exclusion: Not surgical DRG (>=18) or no OR procedure")
+            return psi_status, rationale, detailed_info
+
+        # Exclusions
+        pohmri2d_codes = code_sets.get("POHMRI2D_CODES", []) # Postoperative hemorrhage/hematoma diagnosis
+        coagdid_codes = code_sets.get("COAGDID_CODES", []) # Coagulation disorder diagnosis
+        medbleedd_codes = code_sets.get("MEDBLEEDD_CODES", []) # Medication-related coagulopathy diagnosis
+
+        # Principal diagnosis of postoperative hemorrhage or hematoma
+        if is_code_in_dx_list(dx_list, pohmri2d_codes, position="PRINCIPAL"):
+            rationale.append("Exclusion: Principal diagnosis of postoperative hemorrhage/hematoma")
+            return psi_status, rationale, detailed_info
+
+        # Secondary diagnosis of postoperative hemorrhage or hematoma present on admission
+        if is_code_in_dx_list(dx_list, pohmri2d_codes, position="SECONDARY", poa="Y"):
+            rationale.append("Exclusion: Secondary diagnosis of postoperative hemorrhage/hematoma POA=Y")
+            return psi_status, rationale, detailed_info
+
+        # Any diagnosis of coagulation disorder
+        if is_code_in_dx_list(dx_list, coagdid_codes):
+            rationale.append("Exclusion: Any diagnosis of coagulation disorder")
+            return psi_status, rationale, detailed_info
+
+        # Principal diagnosis of medication-related coagulopathy
+        if is_code_in_dx_list(dx_list, medbleedd_codes, position="PRINCIPAL"):
+            rationale.append("Exclusion: Principal diagnosis of medication-related coagulopathy")
+            return psi_status, rationale, detailed_info
+
+        # Secondary diagnosis of medication-related coagulopathy present on admission
+        if is_code_in_dx_list(dx_list, medbleedd_codes, position="SECONDARY", poa="Y"):
+            rationale.append("Exclusion: Secondary diagnosis of medication-related coagulopathy POA=Y")
+            return psi_status, rationale, detailed_info
+
+        # Timing-based exclusions (if dates are available)
+        if validate_timing and admit_date:
+            first_or_date = features.first("ORPROC_CODES")
+            first_hemoth2p_date = features.first("HEMOTH2P_CODES")
+            first_thrombolyticp_date = features.first("THROMBOLYTICP_CODES")
+
+            # Only operating room procedure is for treatment of hemorrhage/hematoma
+            if features.count("ORPROC_CODES") == 1 and \
+               features.has("HEMOTH2P_CODES"):
+                rationale.append("Exclusion: Only OR procedure is for hemorrhage/hematoma treatment")
+                return psi_status, rationale, detailed_info
+
+            # Treatment of hemorrhage/hematoma occurs before first operating room procedure
+            if first_hemoth2p_date and first_or_date and first_hemoth2p_date < first_or_date:
+                rationale.append("Exclusion: Hemorrhage treatment before first OR procedure")
+                return psi_status, rationale, detailed_info
+
+            # Thrombolytic medication before or same day as first hemorrhage treatment
+            if first_thrombolyticp_date and first_hemoth2p_date and \
+               first_thrombolyticp_date.date() <= first_hemoth2p_date.date():
+                rationale.append("Exclusion: Thrombolytic therapy before/same day as hemorrhage treatment")
+                return psi_status, rationale, detailed_info
+
+        # Numerator: Secondary diagnosis of postoperative hemorrhage/hematoma (not POA) AND treatment procedure
+        numerator_dx_matches = get_matching_dx_info(dx_list, pohmri2d_codes, position="SECONDARY", poa="N")
+        has_treatment_procedure = features.has("HEMOTH2P_CODES")
+
+        if numerator_dx_matches and has_treatment_procedure:
+            # Additional timing check for numerator: treatment must be AFTER primary procedure
+            # If dates are available, ensure treatment is after first OR procedure
+            if validate_timing and first_or_date and first_hemoth2p_date:
+                if first_hemoth2p_date > first_or_date:
+                    psi_status = "Inclusion"
+                    rationale.append(f"Numerator: Postop hemorrhage/hematoma with treatment (DX: {numerator_dx_matches[0][0]})")
+                    detailed_info["hemorrhage_dx_matches"] = [m[0] for m in numerator_dx_matches]
+                    detailed_info["has_treatment_procedure"] = True
+                else:
+                    rationale.append("Numerator: Hemorrhage treatment procedure occurred before or same day as first OR procedure (timing mismatch)")
+            elif not validate_timing: # If timing validation is off, include if dx and proc exist
+                psi_status = "Inclusion"
+                rationale.append(f"Numerator: Postop hemorrhage/hematoma with treatment (DX: {numerator_dx_matches[0][0]}) (Timing validation off)")
+                detailed_info["hemorrhage_dx_matches"] = [m[0] for m in numerator_dx_matches]
+                detailed_info["has_treatment_procedure"] = True
+            else:
+                rationale.append("Numerator: Missing procedure dates for timing validation")
+        elif numerator_dx_matches:
+            rationale.append("Numerator: Postop hemorrhage/hematoma diagnosis found, but no qualifying treatment procedure")
+        elif has_treatment_procedure:
+            rationale.append("Numerator: Treatment procedure found, but no qualifying postop hemorrhage/hematoma diagnosis")
+        else:
+            rationale.append("No qualifying postop hemorrhage/hematoma diagnosis or treatment procedure found for numerator")
+
+    # PSI 10 - Postoperative Acute Kidney Injury Requiring Dialysis Rate
+    elif psi_name == "PSI_10":
+        # Denominator Inclusion: Elective surgical discharges (>=18)
+        is_elective_surgical_drg = ms_drg in code_sets.get("SURGI2R_CODES", []) and atype == 3
+        has_or_procedure = features.has("ORPROC_CODES")
+
+        if not (age >= 18 and is_elective_surgical_drg and has_or_procedure):
+            rationale.append("Population Exclusion: Not elective surgical DRG (>=18) or no OR procedure")
+            return psi_status, rationale, detailed_info
+
+        # Exclusions
+        physidb_codes = code_sets.get("PHYSIDB_CODES", []) # Acute kidney failure diagnosis
+        cardiid_codes = code_sets.get("CARDIID_CODES", []) # Cardiac arrest diagnosis
+        cardrid_codes = code_sets.get("CARDRID_CODES", []) # Severe cardiac dysrhythmia diagnosis
+        shockid_codes = code_sets.get("SHOCKID_CODES", []) # Shock diagnosis
+        crenlfd_codes = code_sets.get("CRENLFD_CODES", []) # CKD stage 5 or ESRD diagnosis
+        urinaryobsid_codes = code_sets.get("URINARYOBSID_CODES", []) # Urinary tract obstruction diagnosis
+        solkidd_codes = code_sets.get("SOLKIDD_CODES", []) # Solitary kidney diagnosis
+        pneumphrep_codes = code_sets.get("PNEPHREP_CODES", []) # Partial/total nephrectomy procedure
+
+        # Principal diagnosis of acute kidney failure
+        if is_code_in_dx_list(dx_list, physidb_codes, position="PRINCIPAL"):
+            rationale.append("Exclusion: Principal diagnosis of acute kidney failure")
+            return psi_status, rationale, detailed_info
+
+        # Secondary diagnosis of acute kidney failure present on admission
+        if is_code_in_dx_list(dx_list, physidb_codes, position="SECONDARY", poa="Y"):
+            rationale.append("Exclusion: Secondary diagnosis of acute kidney failure POA=Y")
+            return psi_status, rationale, detailed_info
+
+        # Timing-based dialysis exclusions (if dates are available)
+        if validate_timing and admit_date:
+            first_or_date = features.first("ORPROC_CODES")
+            first_dialy_date = features.first("DIALYIP_CODES")
+            first_dialy2_date = features.first("DIALY2P_CODES")
+
+            if first_dialy_date and first_or_date and first_dialy_date.date() <= first_or_date.date():
+                rationale.append("Exclusion: Dialysis procedure before or same day as first OR procedure")
+                return psi_status, rationale, detailed_info
+            if first_dialy2_date and first_or_date and first_dialy2_date.date() <= first_or_date.date():
+                rationale.append("Exclusion: Dialysis access procedure before or same day as first OR procedure")
+                return psi_status, rationale, detailed_info
+
+        # Cardiac/Shock exclusions (principal or secondary POA)
+        cardiac_shock_dx_codes = cardiid_codes + cardrid_codes + shockid_codes
+        if is_code_in_dx_list(dx_list, cardiac_shock_dx_codes, position="PRINCIPAL") or \
+           is_code_in_dx_list(dx_list, cardiac_shock_dx_codes, position="SECONDARY", poa="Y"):
+            rationale.append("Exclusion: Principal/POA diagnosis of cardiac arrest, dysrhythmia, or shock")
+            return psi_status, rationale, detailed_info
+
+        # Chronic kidney disease stage 5 or ESRD (principal or secondary POA)
+        if is_code_in_dx_list(dx_list, crenlfd_codes, position="PRINCIPAL") or \
+           is_code_in_dx_list(dx_list, crenlfd_codes, position="SECONDARY", poa="Y"):
+            rationale.append("Exclusion: Principal/POA diagnosis of CKD stage 5 or ESRD")
+            return psi_status, rationale, detailed_info
+
+        # Principal diagnosis of urinary tract obstruction
+        if is_code_in_dx_list(dx_list, urinaryobsid_codes, position="PRINCIPAL"):
+            rationale.append("Exclusion: Principal diagnosis of urinary tract obstruction")
+            return psi_status, rationale, detailed_info
+
+        # Solitary kidney (POA) with partial or total nephrectomy procedure
+        has_sol_kidney_poa = is_code_in_dx_list(dx_list, solkidd_codes, poa="Y")
+        has_nephrectomy_proc = has_any_procedure(proc_list, pneumphrep_codes)
+        if has_sol_kidney_poa and has_nephrectomy_proc:
+            rationale.append("Exclusion: Solitary kidney (POA) with partial/total nephrectomy")
+            return psi_status, rationale, detailed_info
+
+        # Numerator: Postoperative acute kidney failure (secondary, not POA) AND dialysis procedure
+        numerator_dx_matches = get_matching_dx_info(dx_list, physidb_codes, position="SECONDARY", poa="N")
+        has_dialysis_procedure = features.has("DIALYIP_CODES")
+
+        if numerator_dx_matches and has_dialysis_procedure:
+            # Additional timing check for numerator: dialysis must be AFTER primary OR procedure
+            if validate_timing and first_or_date and first_dialy_date:
+                if first_dialy_date > first_or_date:
+                    psi_status = "Inclusion"
+                    rationale.append(f"Numerator: Postop AKI requiring dialysis (DX: {numerator_dx_matches[0][0]})")
+                    detailed_info["aki_dx_matches"] = [m[0] for m in numerator_dx_matches]
+                    detailed_info["has_dialysis_procedure"] = True
+                else:
+                    rationale.append("Numerator: Dialysis procedure occurred before or same day as first OR procedure (timing mismatch)")
+            elif not validate_timing:
+                psi_status = "Inclusion"
+                rationale.append(f"Numerator: Postop AKI requiring dialysis (DX: {numerator_dx_matches[0][0]}) (Timing validation off)")
+                detailed_info["aki_dx_matches"] = [m[0] for m in numerator_dx_matches]
+                detailed_info["has_dialysis_procedure"] = True
+            else:
+                rationale.append("Numerator: Missing procedure dates for timing validation")
+        elif numerator_dx_matches:
+            rationale.append("Numerator: AKI diagnosis found, but no qualifying dialysis procedure")
+        elif has_dialysis_procedure:
+            rationale.append("Numerator: Dialysis procedure found, but no qualifying AKI diagnosis")
+        else:
+            rationale.append("No qualifying postop AKI diagnosis or dialysis procedure found for numerator")
+
+    # PSI 11 - Postoperative Respiratory Failure Rate
+    elif psi_name == "PSI_11":
+        # Denominator Inclusion: Elective surgical discharges (>=18) with OR procedures
+        is_elective_surgical_drg = ms_drg in code_sets.get("SURGI2R_CODES", []) and atype == 3
+        has_or_procedure = features.has("ORPROC_CODES")
+
+        if not (age >= 18 and is_elective_surgical_drg and has_or_procedure):
+            rationale.append("Population Exclusion: Not elective surgical DRG (>=18) or no OR procedure")
+            return psi_status, rationale, detailed_info
+
+        # Exclusions
+        acurf3d_codes = code_sets.get("ACURF3D_CODES", []) # Acute respiratory failure diagnosis (general)
+        trachid_codes = code_sets.get("TRACHID_CODES", []) # Tracheostomy diagnosis
+        malhypd_codes = code_sets.get("MALHYPD_CODES", []) # Malignant hyperthermia diagnosis
+        neuromd_codes = code_sets.get("NEUROMD_CODES", []) # Neuromuscular disorder diagnosis
+        dgneuid_codes = code_sets.get("DGNEUID_CODES", []) # Degenerative neurological disorder diagnosis
+        nucranp_codes = code_sets.get("NUCRANP_CODES", []) # Head/neck surgery with airway risk
+        presopp_codes = code_sets.get("PRESOPP_CODES", []) # Esophageal surgery
+        lungcip_codes = code_sets.get("LUNGCIP_CODES", []) # Lung cancer procedure
+        lungtransp_codes = code_sets.get("LUNGTRANSP_CODES", []) # Lung or heart transplant
+
+        # Principal diagnosis of acute respiratory failure
+        if is_code_in_dx_list(dx_list, acurf3d_codes, position="PRINCIPAL"):
+            rationale.append("Exclusion: Principal diagnosis of acute respiratory failure")
+            return psi_status, rationale, detailed_info
+
+        # Secondary diagnosis of acute respiratory failure present on admission
+        if is_code_in_dx_list(dx_list, acurf3d_codes, position="SECONDARY", poa="Y"):
+            rationale.append("Exclusion: Secondary diagnosis of acute respiratory failure POA=Y")
+            return psi_status, rationale, detailed_info
+
+        # Any diagnosis of tracheostomy present on admission
+        if is_code_in_dx_list(dx_list, trachid_codes, poa="Y"):
+            rationale.append("Exclusion: Any diagnosis of tracheostomy POA=Y")
+            return psi_status, rationale, detailed_info
+
+        # Only operating room procedure is tracheostomy
+        if features.count("ORPROC_CODES") == 1 and \
+           features.has("TRACHIP_CODES"):
+            rationale.append("Exclusion: Only OR procedure is tracheostomy")
+            return psi_status, rationale, detailed_info
+
+        # Tracheostomy occurs before first operating room procedure
+        if validate_timing:
+            first_or_date = features.first("ORPROC_CODES")
+            first_trachip_date = features.first("TRACHIP_CODES")
+            if first_trachip_date and first_or_date and first_trachip_date < first_or_date:
+                rationale.append("Exclusion: Tracheostomy procedure before first OR procedure")
+                return psi_status, rationale, detailed_info
+
+        # Any diagnosis of malignant hyperthermia
+        if is_code_in_dx_list(dx_list, malhypd_codes):
+            rationale.append("Exclusion: Any diagnosis of malignant hyperthermia")
+            return psi_status, rationale, detailed_info
+
+        # Any diagnosis of neuromuscular disorder present on admission
+        if is_code_in_dx_list(dx_list, neuromd_codes, poa="Y"):
+            rationale.append("Exclusion: Any diagnosis of neuromuscular disorder POA=Y")
+            return psi_status, rationale, detailed_info
+
+        # Any diagnosis of degenerative neurological disorder present on admission
+        if is_code_in_dx_list(dx_list, dgneuid_codes, poa="Y"):
+            rationale.append("Exclusion: Any diagnosis of degenerative neurological disorder POA=Y")
+            return psi_status, rationale, detailed_info
+
+        # High-risk surgeries
+        high_risk_surgery_codes = nucranp_codes + presopp_codes + lungcip_codes + lungtransp_codes
+        if has_any_procedure(proc_list, high_risk_surgery_codes):
+            rationale.append("Exclusion: Patient underwent high-risk surgery (e.g., head/neck, esophageal, lung transplant)")
+            return psi_status, rationale, detailed_info
+
+        # MDC 4 - Diseases & Disorders of the Respiratory System
+        if mdc == 4:
+            rationale.append("Exclusion: MDC 4 (Respiratory System Disorders)")
+            return psi_status, rationale, detailed_info
+
+        # Numerator: ANY of the four criteria
+        acurf2d_codes = code_sets.get("ACURF2D_CODES", []) # Acute postprocedural respiratory failure
+
+        first_or_date = features.first("ORPROC_CODES")
+
+        # 1. Acute postprocedural respiratory failure (secondary, not POA)
+        crit1_met = is_code_in_dx_list(dx_list, acurf2d_codes, position="SECONDARY", poa="N")
+
+        # 2. Prolonged mechanical ventilation > 96 consecutive hours (on/after first major OR procedure)
+        crit2_met = False
+        if validate_timing and first_or_date:
+            last_pr9672p_date = features.last("PR9672P_CODES")
+            if last_pr9672p_date and last_pr9672p_date >= first_or_date:
+                crit2_met = True
+        elif not validate_timing and features.has("PR9672P_CODES"):
+            crit2_met = True # Conservative if timing validation off
+
+        # 3. Mechanical ventilation 24-96 consecutive hours (2+ days after first major OR procedure)
+        crit3_met = False
+        if validate_timing and first_or_date:
+            last_pr9671p_date = features.last("PR9671P_CODES")
+            if last_pr9671p_date and last_pr9671p_date >= (first_or_date + timedelta(days=2)):
+                crit3_met = True
+        elif not validate_timing and features.has("PR9671P_CODES"):
+            crit3_met = True # Conservative if timing validation off
+
+        # 4. Postoperative intubation (1+ days after first major OR procedure)
+        crit4_met = False
+        if validate_timing and first_or_date:
+            last_pr9604p_date = features.last("PR9604P_CODES")
+            if last_pr9604p_date and last_pr9604p_date >= (first_or_date + timedelta(days=1)):
+                crit4_met = True
+        elif not validate_timing and features.has("PR9604P_CODES"):
+            crit4_met = True # Conservative if timing validation off
+
+        if crit1_met or crit2_met or crit3_met or crit4_met:
+            psi_status = "Inclusion"
+            rationale.append("Numerator: Patient meets at least one postoperative respiratory complication criterion.")
+            detailed_info["crit1_met"] = crit1_met
+            detailed_info["crit2_met"] = crit2_met
+            detailed_info["crit3_met"] = crit3_met
+            detailed_info["crit4_met"] = crit4_met
+        else:
+            rationale.append("No qualifying postoperative respiratory failure criteria met for numerator.")
+
+    # PSI 12 - Perioperative Pulmonary Embolism or Deep Vein Thrombosis Rate
+    elif psi_name == "PSI_12":
+        # Denominator Inclusion: Surgical discharges (>=18) with OR procedures
+        is_surgical_drg = ms_drg in code_sets.get("SURGI2R_CODES", [])
+        or_proc_codes = code_sets.get("ORPROC_CODES", [])
+        has_or_procedure = features.has("ORPROC_CODES")
+
+        if not (age >= 18 and is_surgical_drg and has_or_procedure):
+            rationale.append("Population Exclusion: Not surgical DRG (>=18) or no OR procedure")
+            return psi_status, rationale, detailed_info
+
+        # Exclusions
+        deepvib_codes = code_sets.get("DEEPVIB_CODES", []) # Proximal DVT diagnosis
+        pulmoid_codes = code_sets.get("PULMOID_CODES", []) # Pulmonary embolism diagnosis
+        hitd_codes = code_sets.get("HITD_CODES", []) # Heparin-induced thrombocytopenia diagnosis
+        neurtrad_codes = code_sets.get("NEURTRAD_CODES", []) # Acute brain or spinal injury diagnosis
+        venacip_codes = code_sets.get("VENACIP_CODES", []) # Interruption of vena cava procedure
+        thromp_codes = code_sets.get("THROMP_CODES", []) # Pulmonary arterial/dialysis access thrombectomy procedure
+        ecmop_codes = code_sets.get("ECMOP_CODES", []) # ECMO procedure
+
+        # Principal diagnosis of proximal DVT or PE
+        if is_code_in_dx_list(dx_list, deepvib_codes, position="PRINCIPAL") or \
+           is_code_in_dx_list(dx_list, pulmoid_codes, position="PRINCIPAL"):
+            rationale.append("Exclusion: Principal diagnosis of DVT or PE")
+            return psi_status, rationale, detailed_info
+
+        # Secondary diagnosis of proximal DVT or PE present on admission
+        if is_code_in_dx_list(dx_list, deepvib_codes, position="SECONDARY", poa="Y") or \
+           is_code_in_dx_list(dx_list, pulmoid_codes, position="SECONDARY", poa="Y"):
+            rationale.append("Exclusion: Secondary diagnosis of DVT or PE POA=Y")
+            return psi_status, rationale, detailed_info
+
+        # Any secondary diagnosis of heparin-induced thrombocytopenia
+        if is_code_in_dx_list(dx_list, hitd_codes, position="SECONDARY"):
+            rationale.append("Exclusion: Secondary diagnosis of heparin-induced thrombocytopenia")
+            return psi_status, rationale, detailed_info
+
+        # Any diagnosis of acute brain or spinal injury present on admission
+        if is_code_in_dx_list(dx_list, neurtrad_codes, poa="Y"):
+            rationale.append("Exclusion: Any diagnosis of acute brain or spinal injury POA=Y")
+            return psi_status, rationale, detailed_info
+
+        # Any procedure for extracorporeal membrane oxygenation (ECMO)
+        if has_any_procedure(proc_list, ecmop_codes):
+            rationale.append("Exclusion: Patient underwent ECMO procedure")
+            return psi_status, rationale, detailed_info
+
+        # Timing-based exclusions (if dates are available)
+        if validate_timing and admit_date:
+            first_or_date = features.first("ORPROC_CODES")
+            first_venacip_date = features.first("VENACIP_CODES")
+            first_thromp_date = features.first("THROMP_CODES")
+
+            # Interruption of vena cava before or same day as first OR procedure
+            if first_venacip_date and first_or_date and first_venacip_date.date() <= first_or_date.date():
+                rationale.append("Exclusion: Vena cava interruption before/same day as first OR procedure")
+                return psi_status, rationale, detailed_info
+
+            # Pulmonary arterial/dialysis access thrombectomy before or same day as first OR procedure
+            if first_thromp_date and first_or_date and first_thromp_date.date() <= first_or_date.date():
+                rationale.append("Exclusion: Thrombectomy before/same day as first OR procedure")
+                return psi_status, rationale, detailed_info
+
+            # Only OR procedure is vena cava interruption and/or thrombectomy
+            all_or_procs = [code for code, _, _ in proc_list if code in or_proc_codes]
+            if all(p in (venacip_codes + thromp_codes) for p in all_or_procs) and len(all_or_procs) > 0:
+                rationale.append("Exclusion: Only OR procedures are vena cava interruption/thrombectomy")
+                return psi_status, rationale, detailed_info
+
+            # First OR procedure occurs after or on 10th day following admission
+            if first_or_date and features.first_day("ORPROC_CODES") >= 10:
+                rationale.append(f"Exclusion: First OR procedure on/after 10th day of admission (Day {features.first_day('ORPROC_CODES')})")
+                return psi_status, rationale, detailed_info
+
+        # Numerator: Secondary diagnosis of perioperative DVT OR PE (not POA)
+        dvt_pe_numerator_codes = deepvib_codes + pulmoid_codes
+        numerator_matches = get_matching_dx_info(dx_list, dvt_pe_numerator_codes, position="SECONDARY", poa="N")
+
+        if numerator_matches:
+            psi_status = "Inclusion"
+            rationale.append(f"Numerator: Perioperative DVT/PE found (DX: {numerator_matches[0][0]}, POA: N)")
+            detailed_info["dvt_pe_matches"] = [m[0] for m in numerator_matches]
+        else:
+            rationale.append("No qualifying perioperative DVT/PE diagnosis found for numerator")
+
+    # PSI 13 - Postoperative Sepsis Rate
+    elif psi_name == "PSI_13":
+        # Denominator Inclusion: Elective surgical discharges (>=18) with OR procedures
+        is_elective_surgical_drg = ms_drg in code_sets.get("SURGI2R_CODES", []) and atype == 3
+        has_or_procedure = features.has("ORPROC_CODES")
+
+        if not (age >= 18 and is_elective_surgical_drg and has_or_procedure):
+            rationale.append("Population Exclusion: Not elective surgical DRG (>=18) or no OR procedure")
+            return psi_status, rationale, detailed_info
+
+        # Exclusions
+        sepsi2d_codes = code_sets.get("SEPTI2D_CODES", []) # Sepsis diagnosis
+        infecid_codes = code_sets.get("INFECID_CODES", []) # General infection diagnosis
+
+        # Principal diagnosis of sepsis
+        if is_code_in_dx_list(dx_list, sepsi2d_codes, position="PRINCIPAL"):
+            rationale.append("Exclusion: Principal diagnosis of sepsis")
+            return psi_status, rationale, detailed_info
+
+        # Secondary diagnosis of sepsis present on admission
+        if is_code_in_dx_list(dx_list, sepsi2d_codes, position="SECONDARY", poa="Y"):
+            rationale.append("Exclusion: Secondary diagnosis of sepsis POA=Y")
+            return psi_status, rationale, detailed_info
+
+        # Principal diagnosis of infection
+        if is_code_in_dx_list(dx_list, infecid_codes, position="PRINCIPAL"):
+            rationale.append("Exclusion: Principal diagnosis of general infection")
+            return psi_status, rationale, detailed_info
+
+        # Secondary diagnosis of infection present on admission
+        if is_code_in_dx_list(dx_list, infecid_codes, position="SECONDARY", poa="Y"):
+            rationale.append("Exclusion: Secondary diagnosis of general infection POA=Y")
+            return psi_status, rationale, detailed_info
+
+        # First OR procedure occurs after or on 10th day following admission
+        if validate_timing and admit_date:
+            first_or_date = features.first("ORPROC_CODES")
+            or_cutoff_day = parameters["psi13_or_cutoff_day"]
+            if first_or_date and features.first_day("ORPROC_CODES") >= or_cutoff_day:
+                rationale.append(f"Exclusion: First OR procedure on/after {format_ordinal(or_cutoff_day)} day of admission (Day {features.first_day('ORPROC_CODES')})")
+                return psi_status, rationale, detailed_info
+
+        # Numerator: Secondary diagnosis of postoperative sepsis (not POA)
+        numerator_matches = get_matching_dx_info(dx_list, sepsi2d_codes, position="SECONDARY", poa="N")
+
+        if numerator_matches:
+            psi_status = "Inclusion"
+            rationale.append(f"Numerator: Postoperative sepsis found (DX: {numerator_matches[0][0]}, POA: N)")
+            detailed_info["sepsis_matches"] = [m[0] for m in numerator_matches]
+        else:
+            rationale.append("No qualifying postoperative sepsis diagnosis found for numerator")
+
+        # Risk Adjustment for PSI 13 (Categorization only)
+        detailed_info["risk_category"] = classify_immune_compromise(dx_list, proc_list, code_sets)
+        rationale.append(f"Risk Category: {detailed_info['risk_category']}")
+
+    # PSI 14 - Postoperative Wound Dehiscence Rate
+    elif psi_name == "PSI_14":
+        # Denominator Inclusion: Abdominopelvic surgery (open or non-open) for patients >=18
+
+        has_open_abdominal = features.has("ABDOMIPOPEN_CODES")
+        has_other_abdominal = features.has("ABDOMIPOTHER_CODES")
+
+        if not (age >= 18 and (has_open_abdominal or has_other_abdominal)):
+            rationale.append("Population Exclusion: Not age >= 18 or no abdominopelvic surgery")
+            return psi_status, rationale, detailed_info
+
+        # Exclusions
+        abwallcd_codes = code_sets.get("ABWALLCD_CODES", []) # Disruption of internal surgical wound diagnosis
+
+        # Principal diagnosis of disruption of internal surgical wound
+        if is_code_in_dx_list(dx_list, abwallcd_codes, position="PRINCIPAL"):
+            rationale.append("Exclusion: Principal diagnosis of wound disruption")
+            return psi_status, rationale, detailed_info
+
+        # Secondary diagnosis of disruption of internal surgical wound present on admission
+        if is_code_in_dx_list(dx_list, abwallcd_codes, position="SECONDARY", poa="Y"):
+            rationale.append("Exclusion: Secondary diagnosis of wound disruption POA=Y")
+            return psi_status, rationale, detailed_info
+
+        # Length of stay less than 2 days
+        min_length_of_stay = parameters["min_length_of_stay"]
+        if pd.notna(length_of_stay) and length_of_stay < min_length_of_stay:
+            rationale.append(f"Exclusion: Length of stay < {min_length_of_stay} days ({length_of_stay})")
+            return psi_status, rationale, detailed_info
+
+        # Timing-based exclusions (reclosure before/same day as initial surgery)
+        if validate_timing:
+            first_open_abdom_date = features.first("ABDOMIPOPEN_CODES")
+            first_other_abdom_date = features.first("ABDOMIPOTHER_CODES")
+            last_recloip_date = features.last("RECLOIP_CODES")
+
+            if last_recloip_date:
+                if first_open_abdom_date and last_recloip_date.date() <= first_open_abdom_date.date():
+                    rationale.append("Exclusion: Reclosure before/same day as first open abdominopelvic surgery")
+                    return psi_status, rationale, detailed_info
+                if first_other_abdom_date and last_recloip_date.date() <= first_other_abdom_date.date():
+                    rationale.append("Exclusion: Reclosure before/same day as first non-open abdominopelvic surgery")
+                    return psi_status, rationale, detailed_info
+
+        # Numerator: Has reclosure procedure AND wound disruption diagnosis (not POA)
+        has_reclosure_procedure = features.has("RECLOIP_CODES")
+        wound_disruption_dx_matches = get_matching_dx_info(dx_list, abwallcd_codes, poa="N") # Any position, not POA
+
+        if has_reclosure_procedure and wound_disruption_dx_matches:
+            psi_status = "Inclusion"
+            rationale.append(f"Numerator: Postoperative wound dehiscence (DX: {wound_disruption_dx_matches[0][0]}) with reclosure procedure")
+            detailed_info["has_reclosure_procedure"] = True
+            detailed_info["wound_disruption_dx_matches"] = [m[0] for m in wound_disruption_dx_matches]
+
+            # Stratification for PSI 14
+            # Priority: Open approach if any open abdominopelvic surgery exists
+            if has_open_abdominal:
+                detailed_info["stratum"] = "open_approach"
+            else:
+                detailed_info["stratum"] = "non_open_approach"
+            rationale.append(f"Stratum: {detailed_info['stratum']}")
+
+        elif has_reclosure_procedure:
+            rationale.append("Numerator: Reclosure procedure found, but no qualifying wound disruption diagnosis")
+        elif wound_disruption_dx_matches:
+            rationale.append("Numerator: Wound disruption diagnosis found, but no reclosure procedure")
+        else:
+            rationale.append("No qualifying wound dehiscence criteria met for numerator")
+
+    # PSI 15 - Abdominopelvic Accidental Puncture or Laceration Rate
+    elif psi_name == "PSI_15":
+        # Denominator Inclusion: Surgical or medical discharges (>=18) with abdominopelvic procedures
+        is_surgical_or_medical = ms_drg in code_sets.get("SURGI2R_CODES", []) or ms_drg in code_sets.get("MEDIC2R_CODES", [])
+
+        has_abdominopelvic_procedure = features.has("ABDOMI15P_CODES")
+
+        if not (age >= 18 and is_surgical_or_medical and has_abdominopelvic_procedure):
+            rationale.append("Population Exclusion: Not surgical/medical DRG (>=18) or no abdominopelvic procedure")
+            return psi_status, rationale, detailed_info
+
+        # Establish index procedure date (first qualifying abdominopelvic procedure)
+        index_procedure_date = features.first("ABDOMI15P_CODES")
+        if not index_procedure_date:
+            rationale.append("Exclusion: Missing index abdominopelvic procedure date")
+            return psi_status, rationale, detailed_info
+
+        # Exclusions (General, then organ-specific POA)
+        # Principal diagnosis of accidental puncture/laceration for any organ
+        injury_index = organ_code_index['injury_codes']
+        if any(dx_pos == "PRINCIPAL" and dx_code in injury_index for dx_code, _, dx_pos, _ in dx_list):
+            rationale.append("Exclusion: Principal diagnosis of accidental puncture/laceration for any organ")
+            return psi_status, rationale, detailed_info
+
+        # Numerator: Triple AND logic (Injury DX + Related PROC + Organ Match + Timing)
+        qualifying_organs_for_numerator = []
+        detailed_info["organ_analysis_results"] = {}
+
+        # 1. Organ-specific injury diagnoses (secondary), split by POA in a single pass over dx_list
+        injury_dx_matches = {organ_system_enum: [] for organ_system_enum in OrganSystem} # POA=N
+        poa_injury_matches = {organ_system_enum: [] for organ_system_enum in OrganSystem} # POA=Y
+        for dx_code, dx_poa, dx_pos, dx_seq in dx_list:
+            if dx_pos != "SECONDARY" or dx_poa not in ("N", "Y"):
+                continue
+            target = injury_dx_matches if dx_poa == "N" else poa_injury_matches
+            for organ_system_enum in injury_index.get(dx_code, ()):
+                target[organ_system_enum].append((dx_code, dx_poa, dx_pos, dx_seq))
+
+        # 2. Related evaluation/treatment procedures within 1-30 days after index procedure
+        # (days difference 1..30 is equivalent to index + 1 day <= date < index + 31 days)
+        procedure_index = organ_code_index['procedure_codes']
+        organs_with_related_proc = set()
+        window_first_day, window_last_day = parameters["psi15_related_proc_window"]
+        window_procs = get_procedures_in_window(
+            build_procedure_date_index(proc_list),
+            index_procedure_date + timedelta(days=window_first_day),
+            index_procedure_date + timedelta(days=window_last_day + 1)
+        )
+        for proc_code, _ in window_procs:
+            organs_with_related_proc.update(procedure_index.get(proc_code, ()))
+
+        for organ_system_enum in OrganSystem:
+            organ_name = organ_system_enum.value
+            has_injury_dx = len(injury_dx_matches[organ_system_enum]) > 0
+            has_related_proc = organ_system_enum in organs_with_related_proc
+
+            # 3. Organ matching: injury diagnosis and related procedure must be for the same organ system
+            # This is implicitly handled by indexing diagnoses and procedures per organ system.
+
+            # Organ-specific POA exclusion check (before numerator inclusion)
+            # Secondary diagnosis of accidental puncture/laceration present on admission with matching related procedure
+            is_excluded_by_poa = False
+            if poa_injury_matches[organ_system_enum] and has_related_proc:
+                rationale.append(f"Exclusion: POA injury ({poa_injury_matches[organ_system_enum][0][0]}) with matching related procedure for {organ_name}")
+                is_excluded_by_poa = True
+
+            detailed_info["organ_analysis_results"][organ_name] = {
+                "has_injury_dx": has_injury_dx,
+                "has_related_proc_in_window": has_related_proc,
+                "is_poa_excluded": is_excluded_by_poa
+            }
+
+            if has_injury_dx and has_related_proc and not is_excluded_by_poa:
+                qualifying_organs_for_numerator.append(organ_name)
+
+        if qualifying_organs_for_numerator:
+            psi_status = "Inclusion"
+            rationale.append(f"Numerator: Accidental puncture/laceration found for organs: {', '.join(qualifying_organs_for_numerator)}")
+            detailed_info["qualifying_organs"] = qualifying_organs_for_numerator
+        else:
+            rationale.append("No qualifying accidental puncture/laceration (injury + procedure + timing + organ match) found for numerator")
+
+        # Risk Adjustment for PSI 15 (Categorization only)
+        detailed_info["risk_category"] = classify_procedure_complexity_psi15(proc_list, code_sets, index_procedure_date)
+        rationale.append(f"Risk Category: {detailed_info['risk_category']}")
+
+    else:
+        rationale.append(f"PSI {psi_name} logic not yet fully implemented or recognized.")
+
+    return psi_status, rationale, detailed_info
+
+# --- Shared Scoring Helpers (used by the app and the scoring service) ---
+def score_row(row, psi_name, compiled_appendix, prefilter_rationale=None, debug_mode=False, validate_timing=True):
+    """
+    Scores one normalized row for one PSI against a compiled appendix.
+    Rows already labelled by the data quality stage or the denominator prefilter (prefilter_rationale set)
+    are returned as exclusions without evaluation.
+    """
+    if prefilter_rationale is not None and pd.notna(prefilter_rationale):
+        # Out of population for this PSI: same single-entry exclusion the engine would return
+        return "Exclusion", [prefilter_rationale], {}
+    organ_systems, organ_code_index = get_organ_maps(compiled_appendix, psi_name)
+    return evaluate_psi_comprehensive(
+        row, psi_name, compiled_appendix["code_sets"], organ_systems,
+        debug_mode=debug_mode, validate_timing=validate_timing, organ_code_index=organ_code_index
+    )
+
+def build_result_record(row, psi_name, status, rationale, detailed_info):
+    """Builds the flat result record (one row of the results table) for a scored encounter."""
+    result_record = {
+        "EncounterID": row.get("EncounterID"),
+        "PSI": psi_name, # Add PSI name to the record
+        "Status": status,
+        "Rationale": "; ".join(rationale),
+        "Age": row.get("Age", ""),
+        "MS_DRG": row.get("MS-DRG", ""),
+        "PrincipalDX": row.get("DX1", ""),
+        "ATYPE": row.get("ATYPE", ""),
+        "Length_of_Stay": row.get("length_of_stay", "")
+    }
+
+    # Add PSI-specific details
+    if detailed_info:
+        for key, value in detailed_info.items():
+            # Convert complex objects to string for display
+            if isinstance(value, (list, dict, Enum)):
+                result_record[f"Detail_{key}"] = str(value)
+            else:
+                result_record[f"Detail_{key}"] = value
+    return result_record
+
+def get_rationale_category(rationale_entry):
+    """
+    Returns the reason code of a rationale entry: the text before the first colon
+    (e.g. "Data Quality", "Population Exclusion", "Exclusion", "Numerator", "Risk Category"),
+    or "Other" for free-text entries.
+    """
+    if ":" in rationale_entry:
+        return rationale_entry.split(":", 1)[0].strip()
+    return "Other"
+
+
+RESULT_BASE_COLUMNS = ["EncounterID", "PSI", "Status", "Rationale", "Age", "MS_DRG", "PrincipalDX", "ATYPE", "Length_of_Stay"]
+
+def score_psi(df_normalized, psi_name, compiled_appendix, dq_rationales=None, debug_mode=False, validate_timing=True,
+              carry_columns=None, progress_callback=None, fingerprints=None):
+    """
+    Scores every row of a normalized input for one PSI and returns the results DataFrame in input order.
+    The denominator prefilter labels out-of-population rows in bulk; only the remaining candidates go
+    through evaluate_psi_comprehensive, once per distinct fingerprint (see fingerprint_encounters; pass
+    them in when scoring several PSIs), reading their code set dates and counts from one procedure feature
+    table (see build_procedure_features). Duplicates reuse that result with their own EncounterID and
+    carry columns. progress_callback(done, total) is called as distinct candidates are scored.
+    """
+    carry_columns = [c for c in (carry_columns or []) if c in df_normalized.columns]
+    prefilter_rationales = build_prefilter_rationales(df_normalized, psi_name, compiled_appendix, dq_rationales)
+    is_candidate = prefilter_rationales.isna()
+
+    # Out-of-population rows: records built column-wise (same fields as build_result_record)
+    excluded = df_normalized[~is_candidate]
+    excluded_df = pd.DataFrame({
+        "EncounterID": excluded["EncounterID"],
+        "PSI": psi_name,
+        "Status": "Exclusion",
+        "Rationale": prefilter_rationales[~is_candidate],
+        "Age": get_column_or_empty(excluded, "Age"),
+        "MS_DRG": get_column_or_empty(excluded, "MS-DRG"),
+        "PrincipalDX": get_column_or_empty(excluded, "DX1"),
+        "ATYPE": get_column_or_empty(excluded, "ATYPE"),
+        "Length_of_Stay": get_column_or_empty(excluded, "length_of_stay"),
+    }, index=excluded.index)
+    for col in carry_columns:
+        excluded_df[col] = excluded[col]
+
+    candidates = df_normalized[is_candidate]
+    fingerprints = fingerprint_encounters(df_normalized) if fingerprints is None else fingerprints
+    candidate_fingerprints = fingerprints[is_candidate]
+    distinct_candidates = candidates[~candidate_fingerprints.duplicated().to_numpy()]
+    organ_systems, organ_code_index = get_organ_maps(compiled_appendix, psi_name)
+    feature_records = build_procedure_feature_records(distinct_candidates, psi_name, compiled_appendix["code_sets"], debug_mode=debug_mode)
+    candidate_records = []
+    total_candidates = len(distinct_candidates)
+    for done, ((idx, row), procedure_features) in enumerate(zip(distinct_candidates.iterrows(), feature_records), start=1):
+        status, rationale, detailed_info = evaluate_psi_comprehensive(
+            row, psi_name, compiled_appendix["code_sets"], organ_systems,
+            debug_mode=debug_mode, validate_timing=validate_timing, organ_code_index=organ_code_index,
+            procedure_features=procedure_features
+        )
+        candidate_records.append(build_result_record(row, psi_name, status, rationale, detailed_info))
+        if progress_callback and (done % 100 == 0 or done == total_candidates):
+            progress_callback(done, total_candidates)
+
+    # Fan each distinct result out to every candidate with the same fingerprint
+    distinct_df = pd.DataFrame(candidate_records)
+    if len(distinct_df):
+        positions = pd.Index(candidate_fingerprints[distinct_candidates.index]).get_indexer(candidate_fingerprints)
+        candidate_df = distinct_df.take(positions).set_axis(candidates.index)
+        candidate_df["EncounterID"] = candidates["EncounterID"]
+    else:
+        candidate_df = distinct_df
+    for col in carry_columns:
+        candidate_df[col] = candidates[col]
+
+    results_df = pd.concat([excluded_df, candidate_df]).reindex(df_normalized.index) if len(candidate_df) else excluded_df
+    detail_columns = [c for c in results_df.columns if c not in RESULT_BASE_COLUMNS and c not in carry_columns]
+    return results_df[RESULT_BASE_COLUMNS + detail_columns + carry_columns].reset_index(drop=True)
+
+def score_dataframe(df_raw, psi_names, compiled_appendix, debug_mode=False, validate_timing=True, carry_columns=None):
+    """
+    Normalizes, data-quality checks and scores a whole input DataFrame for the given PSIs.
+    Returns (results_df, dq_summary_df); results_df has one build_result_record row per encounter and PSI,
+    plus any `carry_columns` of the input (e.g. a facility identifier) copied onto each record.
+    """
+    df_normalized = normalize_input_schema(df_raw)
+    fingerprints = fingerprint_encounters(df_normalized)
+    dq_summary_df, dq_flags_df = build_data_quality_report(df_raw, df_normalized, fingerprints=fingerprints)
+    results_frames = [
+        score_psi(df_normalized, psi, compiled_appendix, dq_rationales=dq_flags_df["DQ_Rationale"],
+                  debug_mode=debug_mode, validate_timing=validate_timing, carry_columns=carry_columns,
+                  fingerprints=fingerprints)
+        for psi in psi_names
+    ]
+    return (pd.concat(results_frames, ignore_index=True) if results_frames else pd.DataFrame(columns=RESULT_BASE_COLUMNS)), dq_summary_df
+
+def summarize_results(results_df, group_columns=None):
+    """
+    Summarizes a results DataFrame into Total Cases / Inclusions / Exclusions / Rate per 1000,
+    per PSI and per any extra `group_columns` (e.g. ["Facility"]).
+    """
+    group_columns = list(group_columns or []) + ["PSI"]
+    summary_df = results_df.assign(_inclusion=results_df["Status"] == "Inclusion").groupby(group_columns, sort=True).agg(
+        **{"Total Cases": ("Status", "size"), "Inclusions": ("_inclusion", "sum")}
+    ).reset_index()
+    summary_df["Exclusions"] = summary_df["Total Cases"] - summary_df["Inclusions"]
+    summary_df["Rate per 1000"] = (summary_df["Inclusions"] / summary_df["Total Cases"] * 1000).round(2)
+    return summary_df
@@ -0,0 +1,360 @@
+"""
+Differential equivalence harness for PSI 05-15: reference engine vs optimized engines, side by side.
+
+The reference is the plain row-by-row engine: evaluate_psi_comprehensive on every normalized row, with no
+prefilter, data quality stage or duplicate collapsing. Every optimized engine (score_psi with its bulk
+prefilter and duplicate fan-out, the one-pass scenario scorer, or any engine passed as module:function with
+score_psi's signature) scores the same rows. Every encounter where the engines differ in status, rationale
+categories or rationale text is reported with both traces, and per-PSI wall times give the speedups.
+Datasets are the bundled sample workbooks, fixed regression cases and generated encounters drawn from the
+appendix code sets.
+
+Usage:
+    python psi_equivalence.py --appendix Unified_PSI_Appendix_05_14.xlsx --output-dir equivalence
+    python psi_equivalence.py --appendix Unified_PSI_Appendix_05_14.xlsx --output-dir equivalence \
+        --engine my_fast_engine:score_psi --generated-rows 20000 --reference-module releases/psi_engine_2025_06.py
+
+Outputs (in --output-dir):
+    equivalence_summary.csv    Rows, rows the reference raises on, discordant encounters, reference/engine seconds and
+                               speedup per dataset, engine and PSI
+    discordant_encounters.csv  Every discordant encounter: both statuses, rationale categories and traces
+The exit status is 1 if any engine disagrees with the reference or the reference raises on one of the
+regression cases (encounters that once crashed the engine), so the harness can gate a CI job.
+"""
+import argparse
+import importlib
+import importlib.util
+import json
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+import psi_engine
+from psi_engine import (
+    ALL_PSIS,
+    DEFAULT_PSI_PARAMETERS,
+    build_data_quality_report,
+    compile_appendix,
+    fingerprint_encounters,
+    get_rationale_category,
+    load_appendix_df,
+    load_input_df,
+    normalize_input_schema,
+    score_psi,
+)
+from psi_scenarios import score_scenarios
+
+BUNDLED_SAMPLE_INPUTS = ["Unified_PSI_08_Input_Final_Sdx1_From_DX1.xlsx", "Unified_PSI_Input_Template_Enhanced.xlsx"]
+DEFAULT_GENERATED_ROWS = 2000
+REGRESSION_DATASET = "regression cases"
+DIFFERENCE_LEVELS = ["Status", "Rationale categories", "Rationale text"] # Most to least severe
+SUMMARY_COLUMNS = ["Dataset", "Engine", "PSI", "Rows", "Reference Errors", "Discordant", "Status Differences", "Category Differences",
+                   "Reference Seconds", "Engine Seconds", "Speedup"]
+DISCORDANT_COLUMNS = ["Dataset", "Engine", "PSI", "Row", "EncounterID", "Difference", "Reference Status", "Engine Status",
+                      "Reference Categories", "Engine Categories", "Reference Trace", "Engine Trace"]
+
+
+# --- Engines ---
+def score_psi_reference(df_normalized, psi_name, code_sets, engine_module=psi_engine, validate_timing=True):
+    """
+    The reference: engine_module.evaluate_psi_comprehensive on every row, in input order.
+    Returns (Status, Rationale, Trace) per row; Trace is the rationale plus the detailed info as JSON.
+    A row the engine raises on gets Status "Error" and the exception as its rationale.
+    """
+    organ_systems = engine_module.build_organ_system_mapping(code_sets)
+    records = []
+    for _, row in df_normalized.iterrows():
+        try:
+            status, rationale, detailed_info = engine_module.evaluate_psi_comprehensive(
+                row, psi_name, code_sets, organ_systems, validate_timing=validate_timing
+            )
+        except Exception as e:
+            status, rationale, detailed_info = "Error", [f"{type(e).__name__}: {e}"], {}
+        records.append((status, "; ".join(rationale), format_trace(rationale, detailed_info)))
+    return pd.DataFrame(records, columns=["Status", "Rationale", "Trace"], index=df_normalized.index)
+
+
+def score_psi_optimized(df_normalized, psi_name, compiled_appendix, dq_rationales, fingerprints, validate_timing=True):
+    """score_psi as the app, batch and service run it: bulk prefilter, duplicate fan-out."""
+    return score_psi(df_normalized, psi_name, compiled_appendix, dq_rationales=dq_rationales,
+                     validate_timing=validate_timing, fingerprints=fingerprints)
+
+
+def score_psi_scenario_baseline(df_normalized, psi_name, compiled_appendix, dq_rationales, fingerprints, validate_timing=True):
+    """The one-pass what-if scorer (psi_scenarios) with the standard parameters as its only scenario."""
+    scenario = {"name": "Standard", "validate_timing": validate_timing, "parameters": dict(DEFAULT_PSI_PARAMETERS)}
+    results_df = score_scenarios(df_normalized, [psi_name], compiled_appendix, [scenario],
+                                 dq_rationales=dq_rationales, fingerprints=fingerprints)
+    return results_df.rename(columns={"Status: Standard": "Status", "Rationale: Standard": "Rationale"})
+
+
+CANDIDATE_ENGINES = {
+    "score_psi": score_psi_optimized,
+    "scenarios": score_psi_scenario_baseline,
+}
+
+
+def load_engine_function(spec):
+    """Imports `module:function` (e.g. my_fast_engine:score_psi); the function takes score_psi_optimized's arguments."""
+    module_name, _, function_name = spec.partition(":")
+    if not function_name:
+        raise ValueError(f"Engine '{spec}' must be given as module:function")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def load_engine_module(path):
+    """Loads a reference engine from a psi_engine.py file (e.g. a copy of the released version)."""
+    spec = importlib.util.spec_from_file_location("psi_engine_reference", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# --- Traces and Comparison ---
+def format_trace(rationale, detailed_info):
+    """Rationale entries plus the detailed info, as one JSON string."""
+    return json.dumps({"rationale": list(rationale), "details": detailed_info}, default=str, sort_keys=True)
+
+
+def format_result_trace(result_row):
+    """Trace of a results-table row: its rationale entries plus its Detail_* columns."""
+    details = {k[len("Detail_"):]: v for k, v in result_row.items() if str(k).startswith("Detail_") and pd.notna(v)}
+    rationale = str(result_row["Rationale"]).split("; ") if result_row["Rationale"] else []
+    return json.dumps({"rationale": rationale, "details": details}, default=str, sort_keys=True)
+
+
+def get_rationale_categories(rationale_text):
+    """Reason code of every rationale entry, in order (see get_rationale_category)."""
+    return [get_rationale_category(entry) for entry in rationale_text.split("; ")] if rationale_text else []
+
+
+def classify_difference(reference_status, reference_rationale, engine_status, engine_rationale):
+    """The most severe way two results differ (see DIFFERENCE_LEVELS), or None if they are identical."""
+    if reference_status != engine_status:
+        return "Status"
+    if get_rationale_categories(reference_rationale) != get_rationale_categories(engine_rationale):
+        return "Rationale categories"
+    if reference_rationale != engine_rationale:
+        return "Rationale text"
+    return None
+
+
+def compare_results(reference_df, engine_df, encounter_ids):
+    """
+    One discordant record per row whose engine result differs from the reference. `engine_df` holds the results
+    of the rows of `reference_df` (same order); Row is the position in the dataset.
+    """
+    discordant = []
+    engine_df = engine_df.reset_index(drop=True)
+    for row, reference, (_, engine) in zip(reference_df.index, reference_df.itertuples(index=False), engine_df.iterrows()):
+        engine_rationale = engine["Rationale"] if pd.notna(engine["Rationale"]) else ""
+        difference = classify_difference(reference.Status, reference.Rationale, engine["Status"], engine_rationale)
+        if difference:
+            discordant.append({
+                "Row": row, "EncounterID": encounter_ids.iat[row], "Difference": difference,
+                "Reference Status": reference.Status, "Engine Status": engine["Status"],
+                "Reference Categories": ", ".join(get_rationale_categories(reference.Rationale)),
+                "Engine Categories": ", ".join(get_rationale_categories(engine_rationale)),
+                "Reference Trace": reference.Trace, "Engine Trace": format_result_trace(engine),
+            })
+    if len(engine_df) != len(reference_df):
+        discordant.append({"Row": None, "EncounterID": None, "Difference": "Status",
+                           "Reference Trace": f"{len(reference_df)} rows", "Engine Trace": f"{len(engine_df)} rows"})
+    return discordant
+
+
+# --- Datasets ---
+def generate_encounters(code_sets, row_count=DEFAULT_GENERATED_ROWS, seed=0):
+    """
+    Random encounters built from the appendix code sets so that every PSI's population, exclusion and numerator
+    branches are reached: DRGs from the surgical/medical DRG sets (and some out-of-population and ungroupable ones),
+    diagnoses and procedures drawn from the *D/*P code sets with random POA flags, procedure dates around the
+    admission (some unparseable), ages on both sides of 18, a few missing required fields and repeated encounters.
+    """
+    rnd = random.Random(seed)
+    drg_pool = [code for name in ("SURGI2R_CODES", "MEDIC2R_CODES") for code in list(code_sets.get(name, []))[:40]] or ["1"]
+    dx_pool, proc_pool = [], []
+    for name in code_sets:
+        codes = list(code_sets[name])[:25]
+        if name in ("SURGI2R_CODES", "MEDIC2R_CODES"):
+            continue
+        (proc_pool if name.endswith("P_CODES") else dx_pool).extend(codes)
+    dx_pool = dx_pool + ["I10", "E119", "Z0000"] # Common codes in no set
+    proc_pool = proc_pool or ["0DTJ4ZZ"]
+
+    records = []
+    for i in range(row_count):
+        if records and rnd.random() < 0.03: # Resubmitted claim: same clinical content, new EncounterID
+            records.append({**rnd.choice(records), "EncounterID": f"G{i}"})
+            continue
+        admission = pd.Timestamp("2024-10-01") + pd.Timedelta(days=rnd.randint(0, 360))
+        length_of_stay = rnd.choice([0, 1, 2, 3, 5, 10, 30])
+        record = {
+            "EncounterID": f"G{i}",
+            "Age": rnd.choice([0, 10, 17, 18, 45, 70, 90]) if rnd.random() > 0.02 else None,
+            "SEX": rnd.choice(["M", "F"]) if rnd.random() > 0.02 else "",
+            "MS-DRG": rnd.choice(drg_pool) if rnd.random() > 0.15 else rnd.choice(["999", "795", "774"]),
+            "MDC": rnd.choice([1, 4, 5, 6, 8, 11, 14, 15]),
+            "DQTR": rnd.randint(1, 4), "YEAR": rnd.choice([2024, 2025]), "ATYPE": rnd.choice([1, 2, 3, 3]),
+            "admission_date": admission.strftime("%Y-%m-%d"),
+            "discharge_date": (admission + pd.Timedelta(days=length_of_stay)).strftime("%Y-%m-%d"),
+            "length_of_stay": length_of_stay,
+            "DX1": rnd.choice(dx_pool), "POA1": rnd.choice(["Y", "N"]),
+        }
+        for j in range(2, rnd.randint(2, 16)):
+            record[f"DX{j}"] = rnd.choice(dx_pool)
+            record[f"POA{j}"] = rnd.choice(["Y", "N", "N", "U", "W", "X", ""])
+        for j in range(1, rnd.randint(1, 9)):
+            record[f"Proc{j}"] = rnd.choice(proc_pool)
+            if rnd.random() < 0.9:
+                proc_date = admission + pd.Timedelta(days=rnd.randint(-1, length_of_stay + 2))
+                record[f"Proc{j}_Date"] = proc_date.strftime("%Y-%m-%d") if rnd.random() > 0.02 else "not a date"
+                if rnd.random() < 0.3:
+                    record[f"Proc{j}_Time"] = rnd.choice(["0730", "14:05:00", "2359"])
+        records.append(record)
+    return pd.DataFrame(records)
+
+
+def regression_encounters(code_sets):
+    """
+    Encounters that once made the reference raise; REGRESSION_DATASET must score without Reference Errors.
+    - An elective surgical case with an OR procedure and a dialysis procedure whose date (or time) does not parse
+      (PSI_10 compared the resulting NaT with the OR procedure date)
+    """
+    first_code = lambda name, default: next(iter(code_sets.get(name, [])), default)
+    case = {
+        "Age": 50, "SEX": "M", "MS-DRG": first_code("SURGI2R_CODES", "1"), "MDC": 5, "DQTR": 1, "YEAR": 2025, "ATYPE": 3,
+        "admission_date": "2025-01-01", "discharge_date": "2025-01-05", "length_of_stay": 4, "DX1": "I10", "POA1": "Y",
+        "Proc1": first_code("ORPROC_CODES", "0DTJ4ZZ"), "Proc1_Date": "2025-01-01",
+        "Proc2": first_code("DIALYIP_CODES", "5A1D70Z"), "Proc2_Date": "not a date",
+    }
+    return pd.DataFrame([
+        {**case, "EncounterID": "R1"},
+        {**case, "EncounterID": "R2", "Proc1_Date": "2025-01-02"},
+        {**case, "EncounterID": "R3", "Proc2_Date": "2025-01-03", "Proc2_Time": "9999"},
+        {**case, "EncounterID": "R4", "Proc2_Date": " "},
+    ])
+
+
+def load_datasets(input_paths, code_sets, generated_rows, seed=0):
+    """
+    {name: raw DataFrame} for the given input files, the regression encounters and `generated_rows` generated
+    encounters.
+    """
+    datasets = {os.path.basename(path): load_input_df(path) for path in input_paths}
+    datasets[REGRESSION_DATASET] = regression_encounters(code_sets)
+    if generated_rows:
+        datasets[f"generated ({generated_rows} rows, seed {seed})"] = generate_encounters(code_sets, generated_rows, seed)
+    return datasets
+
+
+# --- Harness ---
+def run_equivalence(datasets, compiled_appendix, psi_names, engines, validate_timing=True, reference_module=psi_engine,
+                    progress_callback=None):
+    """
+    Scores every dataset with the reference and with each engine in `engines` ({name: function}).
+    Returns (summary_df, discordant_df). Rows the reference itself raises on are counted as Reference Errors; an
+    engine that raises on a PSI is run again without those rows (whole-frame engines cannot skip one row), and
+    if it still raises, one discordant record carries the exception. progress_callback(dataset, psi) is called
+    before each PSI.
+    """
+    summary_records, discordant_records = [], []
+    code_sets = dict(compiled_appendix["code_sets"].items())
+    for dataset_name, df_raw in datasets.items():
+        df_normalized = normalize_input_schema(df_raw)
+        reference_input = reference_module.normalize_input_schema(df_raw) if reference_module is not psi_engine else df_normalized
+        start = time.perf_counter()
+        fingerprints = fingerprint_encounters(df_normalized)
+        _, dq_flags_df = build_data_quality_report(df_raw, df_normalized, fingerprints=fingerprints)
+        shared_seconds = time.perf_counter() - start # Data quality + fingerprints, once for all PSIs
+
+        for psi in psi_names:
+            if progress_callback:
+                progress_callback(dataset_name, psi)
+            start = time.perf_counter()
+            reference_df = score_psi_reference(reference_input, psi, code_sets, reference_module, validate_timing)
+            reference_seconds = time.perf_counter() - start
+            reference_errors = (reference_df["Status"] == "Error").to_numpy()
+            for engine_name, engine in engines.items():
+                discordant = None
+                for rows in ([slice(None), ~reference_errors] if reference_errors.any() else [slice(None)]):
+                    start = time.perf_counter()
+                    try:
+                        engine_df = engine(df_normalized[rows], psi, compiled_appendix, dq_flags_df["DQ_Rationale"][rows],
+                                           fingerprints[rows], validate_timing=validate_timing)
+                    except Exception as e:
+                        discordant = [{"Row": None, "EncounterID": None, "Difference": "Status",
+                                       "Engine Trace": f"Engine raised {type(e).__name__}: {e}"}]
+                        continue
+                    discordant = compare_results(reference_df[rows], engine_df, df_normalized["EncounterID"])
+                    break
+                engine_seconds = time.perf_counter() - start + shared_seconds / len(psi_names)
+                discordant_records.extend({"Dataset": dataset_name, "Engine": engine_name, "PSI": psi, **d} for d in discordant)
+                summary_records.append({
+                    "Dataset": dataset_name, "Engine": engine_name, "PSI": psi, "Rows": len(df_normalized),
+                    "Reference Errors": int(reference_errors.sum()), "Discordant": len(discordant),
+                    "Status Differences": sum(d["Difference"] == "Status" for d in discordant),
+                    "Category Differences": sum(d["Difference"] == "Rationale categories" for d in discordant),
+                    "Reference Seconds": round(reference_seconds, 3), "Engine Seconds": round(engine_seconds, 3),
+                    "Speedup": round(reference_seconds / engine_seconds, 2) if engine_seconds > 0 else None,
+                })
+    return pd.DataFrame(summary_records, columns=SUMMARY_COLUMNS), pd.DataFrame(discordant_records, columns=DISCORDANT_COLUMNS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check optimized PSI engines against the row-by-row reference engine")
+    parser.add_argument("--appendix", required=True, help="PSI appendix (.xlsx or .json)")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--inputs", nargs="*", default=None,
+                        help="Input files to compare on (default: the bundled sample workbooks found next to this script)")
+    parser.add_argument("--generated-rows", type=int, default=DEFAULT_GENERATED_ROWS, help="Generated encounters (0 for none)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--psis", default=",".join(ALL_PSIS), help="Comma-separated PSIs (default: all)")
+    parser.add_argument("--no-timing", action="store_true", help="Disable timing validation")
+    parser.add_argument("--engine", action="append", default=None, metavar="NAME|MODULE:FUNCTION",
+                        help=f"Engine to check; repeat for several (default: {', '.join(CANDIDATE_ENGINES)})")
+    parser.add_argument("--reference-module", default=None, help="psi_engine.py file to use as the reference (default: this one)")
+    args = parser.parse_args()
+
+    psi_names = [p.strip() for p in args.psis.split(",") if p.strip()]
+    unknown = [p for p in psi_names if p not in ALL_PSIS]
+    if unknown:
+        parser.error(f"Unknown PSI(s): {', '.join(unknown)}")
+    try:
+        engines = {spec: CANDIDATE_ENGINES[spec] if spec in CANDIDATE_ENGINES else load_engine_function(spec)
+                   for spec in (args.engine or CANDIDATE_ENGINES)}
+    except (ValueError, ImportError, AttributeError) as e:
+        parser.error(f"Cannot load engine: {e}")
+    if args.inputs is None:
+        here = os.path.dirname(os.path.abspath(__file__))
+        input_paths = [p for p in (os.path.join(here, name) for name in BUNDLED_SAMPLE_INPUTS) if os.path.exists(p)]
+    else:
+        input_paths = args.inputs
+
+    compiled_appendix = compile_appendix(load_appendix_df(args.appendix, is_json=args.appendix.lower().endswith(".json")))
+    reference_module = load_engine_module(args.reference_module) if args.reference_module else psi_engine
+    datasets = load_datasets(input_paths, compiled_appendix["code_sets"], args.generated_rows, args.seed)
+    summary_df, discordant_df = run_equivalence(
+        datasets, compiled_appendix, psi_names, engines, validate_timing=not args.no_timing, reference_module=reference_module,
+        progress_callback=lambda dataset, psi: print(f"  {dataset}: {psi}")
+    )
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    summary_df.to_csv(os.path.join(args.output_dir, "equivalence_summary.csv"), index=False)
+    discordant_df.to_csv(os.path.join(args.output_dir, "discordant_encounters.csv"), index=False)
+    totals_df = summary_df.groupby("Engine", sort=False)[["Rows", "Reference Errors", "Discordant", "Reference Seconds", "Engine Seconds"]].sum()
+    totals_df["Speedup"] = (totals_df["Reference Seconds"] / totals_df["Engine Seconds"]).round(2)
+    totals_df = totals_df.rename(columns={"Rows": "Results"}) # Encounter-PSI results across all datasets
+    print(totals_df.to_string())
+    print(f"{len(discordant_df)} discordant encounter result(s); written to {args.output_dir}")
+    regression_errors = int(summary_df.loc[summary_df["Dataset"] == REGRESSION_DATASET, "Reference Errors"].sum())
+    if regression_errors:
+        print(f"The reference raised on {regression_errors} {REGRESSION_DATASET} result(s)")
+    sys.exit(1 if len(discordant_df) or regression_errors else 0)
+
+
+if __name__ == "__main__":
+    main()
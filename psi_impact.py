@@ -0,0 +1,150 @@
+"""
+Appendix-diff impact analysis for PSI 05-15.
+
+Given an input file and an old and a new appendix version, diffs the code sets, finds (through the
+code -> encounter inverted index) only the encounters that contain an added or removed code, re-scores
+just those under both versions and reports the status transitions. Encounters that touch no changed code
+cannot change status, because the engine only consults the appendix through code set membership.
+
+Usage:
+    python psi_impact.py --input Unified_PSI_Input_Template_Enhanced.xlsx \
+        --old-appendix Unified_PSI_Appendix_05_14.xlsx --new-appendix Unified_PSI_Appendix_2026.xlsx --output-dir impact
+
+Outputs (in --output-dir):
+    code_set_diff.csv       Added/removed code counts per code set
+    impact_transitions.csv  Every re-scored encounter/PSI with old and new status and rationale
+    impact_summary.csv      Per-PSI counts of re-scored encounters and status transitions
+"""
+import argparse
+import os
+import time
+
+import pandas as pd
+
+from psi_engine import (
+    ALL_PSIS,
+    build_data_quality_report,
+    load_input_df,
+    normalize_input_schema,
+    score_row,
+)
+from psi_index import build_code_index, code_index_columns, find_rows_with_codes
+from psi_ingest import ConcurrentLoader, load_compiled_appendix
+
+
+def diff_code_sets(old_code_sets, new_code_sets):
+    """
+    Diffs two code set dicts.
+    Returns (diff_df, changed_codes): one row per code set with added/removed counts, and the set of all
+    codes that were added to or removed from any code set.
+    """
+    records = []
+    changed_codes = set()
+    for code_set_name in sorted(set(old_code_sets) | set(new_code_sets)):
+        old_codes = set(old_code_sets.get(code_set_name, []))
+        new_codes = set(new_code_sets.get(code_set_name, []))
+        added, removed = new_codes - old_codes, old_codes - new_codes
+        changed_codes |= added | removed
+        if added or removed:
+            records.append({
+                "CodeSet": code_set_name,
+                "Added": len(added),
+                "Removed": len(removed),
+                "SampleAdded": ", ".join(sorted(added)[:10]),
+                "SampleRemoved": ", ".join(sorted(removed)[:10]),
+            })
+    return pd.DataFrame(records, columns=["CodeSet", "Added", "Removed", "SampleAdded", "SampleRemoved"]), changed_codes
+
+
+def run_impact_analysis(df_raw, old_compiled_appendix, new_compiled_appendix, psi_names, validate_timing=True, code_index=None, df_normalized=None):
+    """
+    Re-scores only the encounters touching changed codes under both appendix versions.
+    Pass a prebuilt `df_normalized`/`code_index` to reuse them across several appendix comparisons.
+    Returns (transitions_df, summary_df, diff_df).
+    """
+    if df_normalized is None:
+        df_normalized = normalize_input_schema(df_raw)
+    if code_index is None:
+        code_index = build_code_index(df_normalized)
+    _, dq_flags_df = build_data_quality_report(df_raw, df_normalized)
+
+    diff_df, changed_codes = diff_code_sets(old_compiled_appendix["code_sets"], new_compiled_appendix["code_sets"])
+    affected_rows = find_rows_with_codes(code_index, changed_codes)
+    # Rows failing the data quality stage are excluded the same way under any appendix
+    affected_rows = [idx for idx in affected_rows if not dq_flags_df.at[idx, "Excluded_From_Scoring"]]
+
+    code_columns = code_index_columns(df_normalized)
+    records = []
+    for psi in psi_names:
+        for idx in affected_rows:
+            row = df_normalized.loc[idx]
+            old_status, old_rationale, _ = score_row(row, psi, old_compiled_appendix, validate_timing=validate_timing)
+            new_status, new_rationale, _ = score_row(row, psi, new_compiled_appendix, validate_timing=validate_timing)
+            records.append({
+                "EncounterID": row.get("EncounterID"),
+                "PSI": psi,
+                "OldStatus": old_status,
+                "NewStatus": new_status,
+                "Transition": f"{old_status} -> {new_status}" if old_status != new_status else "Unchanged",
+                "RationaleChanged": old_rationale != new_rationale,
+                "OldRationale": "; ".join(old_rationale),
+                "NewRationale": "; ".join(new_rationale),
+                "ChangedCodes": ", ".join(sorted({code for code in row[code_columns].dropna() if code in changed_codes})),
+            })
+    transitions_df = pd.DataFrame(records, columns=[
+        "EncounterID", "PSI", "OldStatus", "NewStatus", "Transition", "RationaleChanged", "OldRationale", "NewRationale", "ChangedCodes"
+    ])
+
+    summary_records = []
+    for psi in psi_names:
+        psi_df = transitions_df[transitions_df["PSI"] == psi]
+        summary_records.append({
+            "PSI": psi,
+            "Total Encounters": len(df_normalized),
+            "Re-scored Encounters": len(psi_df),
+            "Exclusion -> Inclusion": int((psi_df["Transition"] == "Exclusion -> Inclusion").sum()),
+            "Inclusion -> Exclusion": int((psi_df["Transition"] == "Inclusion -> Exclusion").sum()),
+            "Rationale Changed Only": int(((psi_df["Transition"] == "Unchanged") & psi_df["RationaleChanged"]).sum()),
+        })
+    return transitions_df, pd.DataFrame(summary_records), diff_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report which encounters change PSI status between two appendix versions")
+    parser.add_argument("--input", required=True, help="PSI input file")
+    parser.add_argument("--old-appendix", required=True, help="Current appendix (.xlsx or .json)")
+    parser.add_argument("--new-appendix", required=True, help="New appendix (.xlsx or .json)")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--psis", default=",".join(ALL_PSIS), help="Comma-separated PSIs (default: all)")
+    parser.add_argument("--no-timing", action="store_true", help="Disable timing validation")
+    args = parser.parse_args()
+
+    psi_names = [p.strip() for p in args.psis.split(",") if p.strip()]
+    unknown = [p for p in psi_names if p not in ALL_PSIS]
+    if unknown:
+        parser.error(f"Unknown PSI(s): {', '.join(unknown)}")
+
+    start = time.perf_counter()
+    with ConcurrentLoader() as loader: # The input and both appendices are parsed at the same time
+        loader.submit("Input load", load_input_df, args.input)
+        loader.submit("New appendix", load_compiled_appendix, args.new_appendix)
+        old_compiled = loader.run("Old appendix", load_compiled_appendix, args.old_appendix)
+    df_raw = loader.result("Input load")
+    new_compiled = loader.result("New appendix")
+
+    transitions_df, summary_df, diff_df = run_impact_analysis(
+        df_raw, old_compiled, new_compiled, psi_names, validate_timing=not args.no_timing
+    )
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    diff_df.to_csv(os.path.join(args.output_dir, "code_set_diff.csv"), index=False)
+    transitions_df.to_csv(os.path.join(args.output_dir, "impact_transitions.csv"), index=False)
+    summary_df.to_csv(os.path.join(args.output_dir, "impact_summary.csv"), index=False)
+
+    print(f"{len(diff_df)} code set(s) changed; re-scored {transitions_df['EncounterID'].nunique()} of {len(df_raw)} encounters "
+          f"in {time.perf_counter() - start:.1f}s")
+    print(summary_df.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Code -> encounter inverted indexes over a normalized PSI input.
+
+Built once at ingestion from the canonical DX1..DX30, Proc1..Proc20 and MS-DRG columns
+(see psi_engine.normalize_input_schema), so questions like "which encounters contain any of
+these codes" are answered with dictionary lookups instead of rescanning the input.
+
+CohortIndex adds the position and POA of every code occurrence and the encounter discharge dates,
+so cohort queries (a code or appendix code set, in a position, with a POA, discharged in a date range,
+with a PSI status) are answered from array slices in milliseconds, in the app and from psi_batch.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from psi_engine import DX_COLUMN_COUNT, PROC_COLUMN_COUNT, VALID_POA_VALUES, clean_code_series, get_column_or_empty
+
+
+def code_index_columns(df_normalized):
+    """The canonical code-bearing columns present in a normalized input."""
+    columns = [f"DX{i}" for i in range(1, DX_COLUMN_COUNT + 1)]
+    columns += [f"Proc{i}" for i in range(1, PROC_COLUMN_COUNT + 1)]
+    columns.append("MS-DRG") # SURGI2R/MEDIC2R code sets are matched against the MS-DRG text
+    return [c for c in columns if c in df_normalized.columns]
+
+
+def build_code_index(df_normalized):
+    """
+    Builds the inverted index {code: sorted numpy array of row index labels containing it}
+    over every DX, procedure and MS-DRG code of a normalized input.
+    """
+    codes = df_normalized[code_index_columns(df_normalized)].stack() # Long (row, column) -> code, NaN dropped
+    codes = codes[codes.astype(str) != ""]
+    if codes.empty:
+        return {}
+    rows = pd.Series(codes.index.get_level_values(0), index=codes.values)
+    return {code: np.unique(labels.to_numpy()) for code, labels in rows.groupby(level=0)}
+
+
+def find_rows_with_codes(code_index, codes):
+    """Returns the sorted row index labels of encounters that contain any of `codes`."""
+    matches = [code_index[code] for code in codes if code in code_index]
+    return np.unique(np.concatenate(matches)) if matches else np.array([], dtype=object)
+
+
+# --- Cohort Search ---
+COHORT_POSITIONS = ["Any", "Principal diagnosis", "Secondary diagnosis", "Any diagnosis", "Procedure", "MS-DRG"]
+COHORT_POA_VALUES = [""] + VALID_POA_VALUES # "" = blank / not applicable
+COHORT_COLUMNS = ["EncounterID", "Row", "Discharge Date", "Matched Codes"]
+COHORT_INPUT_COLUMNS = ["discharge_date", "Discharge_Date", "admission_date", "Admission_Date"] # Load with the input (dates)
+PROC_SLOT_OFFSET = 100 # Slots: DX{i} -> i, Proc{i} -> 100 + i, MS-DRG -> 200
+DRG_SLOT = 200
+
+
+def _slot_label(slot):
+    if slot == DRG_SLOT:
+        return "MS-DRG"
+    return f"Proc{slot - PROC_SLOT_OFFSET}" if slot > PROC_SLOT_OFFSET else f"DX{slot}"
+
+
+class CohortIndex:
+    """
+    Cohort search over a normalized input. Every code occurrence is one posting (row position, slot, POA),
+    grouped by code, so a code's postings are one array slice; a code set's postings are gathered once per
+    set and kept. `code_sets` (the compiled appendix's) resolves set names in queries.
+    Apart from that memo the index is read-only once built, so one index can serve several sessions.
+    """
+
+    def __init__(self, df_normalized, code_sets=None):
+        start = time.perf_counter()
+        self.code_sets = code_sets if code_sets is not None else {}
+        self.encounter_ids = df_normalized["EncounterID"].to_numpy()
+        discharge = pd.to_datetime(get_column_or_empty(df_normalized, "discharge_date"), errors="coerce")
+        admission = pd.to_datetime(get_column_or_empty(df_normalized, "admission_date"), errors="coerce")
+        self.discharge_dates = discharge.fillna(admission).dt.normalize().to_numpy(dtype="datetime64[ns]")
+
+        codes, rows, slots, poas = [], [], [], []
+        for column in code_index_columns(df_normalized):
+            values = df_normalized[column].to_numpy(dtype=object)
+            positions = np.flatnonzero(pd.notna(values) & (values != ""))
+            if column == "MS-DRG":
+                slot, poa = DRG_SLOT, None
+            elif column.startswith("Proc"):
+                slot, poa = PROC_SLOT_OFFSET + int(column[4:]), None
+            else:
+                slot, poa = int(column[2:]), get_column_or_empty(df_normalized, f"POA{column[2:]}")
+            codes.append(values[positions])
+            rows.append(positions)
+            slots.append(np.full(len(positions), slot, dtype=np.int16))
+            poa_codes = (pd.Categorical(poa.to_numpy()[positions], categories=COHORT_POA_VALUES).codes
+                         if poa is not None else np.full(len(positions), -1)) # -1: no POA (procedure, MS-DRG)
+            poas.append(poa_codes.astype(np.int8))
+
+        code_ids, self.codes = pd.factorize(np.concatenate(codes) if codes else np.array([], dtype=object))
+        order = np.argsort(code_ids, kind="stable")
+        self.posting_codes = code_ids[order].astype(np.int32) # Position in self.codes of each posting's code
+        self.rows = np.concatenate(rows)[order].astype(np.int64) if rows else np.array([], dtype=np.int64)
+        self.slots = np.concatenate(slots)[order] if slots else np.array([], dtype=np.int16)
+        self.poas = np.concatenate(poas)[order] if poas else np.array([], dtype=np.int8)
+        bounds = np.searchsorted(self.posting_codes, np.arange(len(self.codes) + 1))
+        self._code_postings = {code: (bounds[i], bounds[i + 1]) for i, code in enumerate(self.codes)}
+        self._set_postings = {} # code set name -> posting positions, filled on first use
+        self.build_seconds = time.perf_counter() - start
+
+    def __len__(self):
+        return len(self.encounter_ids)
+
+    def code_postings(self, codes):
+        """Posting positions of the given (cleaned) codes."""
+        slices = [self._code_postings[code] for code in codes if code in self._code_postings]
+        if not slices:
+            return np.array([], dtype=np.int64)
+        return np.concatenate([np.arange(start, stop) for start, stop in slices])
+
+    def set_postings(self, code_set_name):
+        """Posting positions of every code of an appendix code set (KeyError if the appendix has no such set)."""
+        postings = self._set_postings.get(code_set_name)
+        if postings is None:
+            postings = self._set_postings[code_set_name] = self.code_postings(self.code_sets[code_set_name])
+        return postings
+
+    def query(self, codes=None, code_sets=None, position="Any", poa=None, date_from=None, date_to=None,
+              statuses=None, psi=None, status=None):
+        """
+        Encounters with any of `codes` (cleaned like the input, e.g. "T81.506A" -> "T81506A") or any code of the
+        named `code_sets`, at `position` (one of COHORT_POSITIONS), with a POA in `poa` (diagnoses only; "" for
+        blank) and discharged (admitted, if no discharge date) between `date_from` and `date_to` inclusive.
+        `statuses` maps PSIs to their Status per input row; each becomes a column and `psi`/`status` filter on one.
+        Returns COHORT_COLUMNS plus one column per PSI, one row per encounter in input order; "Matched Codes"
+        lists each matching occurrence as CODE@POSITION (with /POA for diagnoses).
+        """
+        if position not in COHORT_POSITIONS:
+            raise ValueError(f"Unknown position '{position}' (expected one of {', '.join(COHORT_POSITIONS)})")
+        cleaned_codes = clean_code_series(pd.Series(list(codes or []), dtype="object")).dropna().tolist()
+        postings = [self.code_postings(cleaned_codes)] + [self.set_postings(name) for name in (code_sets or [])]
+        postings = np.unique(np.concatenate(postings))
+
+        slots = self.slots[postings]
+        is_match = {
+            "Any": np.ones(len(postings), dtype=bool),
+            "Principal diagnosis": slots == 1,
+            "Secondary diagnosis": (slots > 1) & (slots < PROC_SLOT_OFFSET),
+            "Any diagnosis": slots < PROC_SLOT_OFFSET,
+            "Procedure": (slots > PROC_SLOT_OFFSET) & (slots < DRG_SLOT),
+            "MS-DRG": slots == DRG_SLOT,
+        }[position]
+        if poa is not None:
+            is_match &= np.isin(self.poas[postings], [COHORT_POA_VALUES.index(value) for value in poa])
+        postings = postings[is_match]
+
+        rows = np.unique(self.rows[postings])
+        keep = np.ones(len(rows), dtype=bool)
+        dates = self.discharge_dates[rows]
+        if date_from is not None:
+            keep &= dates >= np.datetime64(pd.Timestamp(date_from).normalize(), "ns")
+        if date_to is not None:
+            keep &= dates <= np.datetime64(pd.Timestamp(date_to).normalize(), "ns")
+        statuses = statuses or {}
+        if psi is not None and status is not None:
+            keep &= np.asarray(statuses[psi])[rows] == status
+        rows = rows[keep]
+
+        postings = postings[np.isin(self.rows[postings], rows)]
+        postings = postings[np.lexsort((self.slots[postings], self.rows[postings]))] # By row, then DX1..DX30, Proc1..Proc20, MS-DRG
+        posting_rows = self.rows[postings]
+        occurrences = [
+            f"{code}@{_slot_label(slot)}" + (f"/{COHORT_POA_VALUES[poa_code]}" if poa_code > 0 else "")
+            for code, slot, poa_code in zip(self.codes[self.posting_codes[postings]], self.slots[postings], self.poas[postings])
+        ]
+        bounds = zip(np.searchsorted(posting_rows, rows, "left"), np.searchsorted(posting_rows, rows, "right"))
+
+        cohort_df = pd.DataFrame({
+            "EncounterID": self.encounter_ids[rows],
+            "Row": rows,
+            "Discharge Date": dates[keep],
+            "Matched Codes": ["; ".join(occurrences[start:stop]) for start, stop in bounds],
+        }, columns=COHORT_COLUMNS)
+        for psi_name, psi_statuses in statuses.items():
+            cohort_df[psi_name] = np.asarray(psi_statuses)[rows]
+        return cohort_df
+
+
+def statuses_by_psi(results_df, row_count):
+    """{PSI: Status per input row} from a results table holding each PSI's rows in input order (as score_dataframe)."""
+    statuses = {}
+    for psi_name, psi_results in results_df.groupby("PSI", sort=False):
+        if len(psi_results) != row_count:
+            raise ValueError(f"{psi_name} has {len(psi_results)} results for {row_count} input rows")
+        statuses[psi_name] = psi_results["Status"].to_numpy()
+    return statuses
@@ -0,0 +1,154 @@
+"""
+Concurrent ingestion for PSI 05-15: parse the input, the appendix and any sidecar files at the same time.
+
+Workbook parsing (openpyxl) and JSON decoding are CPU-bound pure Python and hold the GIL, so threads would
+not overlap them; the input and other files are parsed in worker processes while the appendix is read and
+compiled in this process (where its lazily loaded code sets stay usable). Only the parsed results travel
+back: the input as a DataFrame, appendices as compiled dicts. Each load's own time is recorded next to the
+wall time of the whole step (see PipelineTelemetry.add_overlapped).
+
+Usage:
+    with ConcurrentLoader(telemetry) as loader:
+        loader.submit("Input load", load_input_df, input_file, columns=columns)
+        compiled_appendix = loader.run("Appendix load + code sets", compile_lazy_appendix, appendix_file)
+    df_input = loader.result("Input load")
+"""
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from psi_engine import compile_appendix, compile_lazy_appendix, get_required_input_columns, load_appendix_df, load_input_df
+
+
+class NamedBytesIO(io.BytesIO):
+    """In-memory copy of an uploaded file that keeps its name (used for the format) when sent to a worker."""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+    def __reduce__(self):
+        return NamedBytesIO, (self.getvalue(), self.name)
+
+
+def as_picklable_source(source):
+    """Paths are passed through; uploaded file objects are copied into a NamedBytesIO."""
+    if isinstance(source, str):
+        return source
+    data = source.getvalue() if hasattr(source, "getvalue") else source.read()
+    return NamedBytesIO(data, getattr(source, "name", ""))
+
+
+def available_cpus():
+    """CPUs this process may run on (its affinity mask where the platform has one)."""
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+
+def _timed_call(function, args, kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def _count_rows(result):
+    return len(result) if hasattr(result, "columns") else None # DataFrames only
+
+
+class ConcurrentLoader:
+    """
+    Runs submitted loads in worker processes while `run` loads execute in this process; leaving the `with`
+    block waits for all of them. Per-load timings are added to `telemetry` as overlapped records and the
+    whole step as one stage named `stage_name`. A failed load raises its exception from result().
+    With a single available CPU nothing can overlap, so submitted loads run in this process right away
+    (parallel=None decides by available_cpus(); pass True/False to force it).
+    """
+
+    def __init__(self, telemetry=None, stage_name="Concurrent load", max_workers=None, parallel=None):
+        self.telemetry = telemetry
+        self.stage_name = stage_name
+        self.max_workers = max_workers
+        self.parallel = available_cpus() > 1 if parallel is None else parallel
+        self.timings = {} # name -> (seconds, rows)
+        self._futures = {}
+        self._results = {}
+        self._executor = None
+        self._stage = None
+
+    def __enter__(self):
+        if self.telemetry:
+            self._stage = self.telemetry.stage(self.stage_name)
+            self._stage.__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def submit(self, name, function, *args, **kwargs):
+        """Starts `function(*args, **kwargs)` in a worker process; file-like arguments are copied to memory first."""
+        if not self.parallel:
+            try:
+                self.run(name, function, *args, **kwargs)
+            except Exception as e: # Re-raised by result(name), as for a worker
+                self._results[name] = e
+            return
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        args = [as_picklable_source(a) if hasattr(a, "read") else a for a in args]
+        self._futures[name] = self._executor.submit(_timed_call, function, args, kwargs)
+
+    def run(self, name, function, *args, **kwargs):
+        """Runs `function(*args, **kwargs)` here (concurrently with the submitted loads) and returns its result."""
+        result, seconds = _timed_call(function, args, kwargs)
+        self._record(name, result, seconds)
+        return result
+
+    def result(self, name):
+        outcome = self._results[name]
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    def _record(self, name, result, seconds):
+        self._results[name] = result
+        self.timings[name] = (seconds, _count_rows(result))
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            for name, future in self._futures.items():
+                try:
+                    result, seconds = future.result()
+                except Exception as e: # Re-raised by result(name)
+                    self._results[name] = e
+                    continue
+                self._record(name, result, seconds)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=exc_type is None, cancel_futures=exc_type is not None)
+            if self._stage is not None:
+                self._stage.__exit__(exc_type, exc, tb)
+                for name, (seconds, rows) in self.timings.items(): # Listed under the enclosing stage
+                    self.telemetry.add_overlapped(f"  {name}", seconds, rows=rows)
+        self.wall_seconds = time.perf_counter() - self._start
+        return False
+
+
+def load_compiled_appendix(appendix_source, is_json=None):
+    """compile_appendix over a whole appendix file (a module-level function, so it can run in a worker)."""
+    if is_json is None:
+        is_json = str(getattr(appendix_source, "name", appendix_source)).lower().endswith(".json")
+    return compile_appendix(load_appendix_df(appendix_source, is_json=is_json))
+
+
+def load_input_and_appendix(input_source, appendix_source, psi_names, validate_timing=True, extra_columns=None,
+                            appendix_is_json=None, telemetry=None):
+    """
+    Loads the columns of the input the PSIs need (see get_required_input_columns) in a worker process while
+    the appendix is compiled for those PSIs here (compile_lazy_appendix). Returns (df_raw, compiled_appendix).
+    """
+    if appendix_is_json is None:
+        appendix_is_json = str(getattr(appendix_source, "name", appendix_source)).lower().endswith(".json")
+    with ConcurrentLoader(telemetry, stage_name="Load input + appendix") as loader:
+        loader.submit("Input load", load_input_df, input_source,
+                      columns=get_required_input_columns(psi_names, validate_timing, extra_columns))
+        compiled_appendix = loader.run("Appendix load + code sets", compile_lazy_appendix, appendix_source,
+                                       is_json=appendix_is_json, psi_names=psi_names)
+    return loader.result("Input load"), compiled_appendix
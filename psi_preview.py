@@ -0,0 +1,185 @@
+"""
+Stratified preview mode for PSI 05-15: quick inclusion and rate estimates from a random sample.
+
+Rows are put in a stratified random order (by MDC and discharge period by default), so every prefix of
+that order is a proportional stratified sample. The sample is scored in batches with the same engine as
+a full run (score_row -> evaluate_psi_comprehensive) and the estimates are refined after every batch.
+Scoring the whole input reproduces the full run's counts exactly.
+
+Usage:
+    python psi_preview.py --input Unified_PSI_Input_Template_Enhanced.xlsx --appendix Unified_PSI_Appendix_05_14.xlsx \
+        --psis PSI_13,PSI_15 --sample-size 5000
+"""
+import argparse
+import time
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from psi_engine import (
+    ALL_PSIS,
+    build_data_quality_report,
+    build_prefilter_rationales,
+    get_column_or_empty,
+    normalize_input_schema,
+    score_row,
+)
+from psi_ingest import load_input_and_appendix
+
+PREVIEW_STRATA_COLUMNS = ["MDC", "YEAR", "DQTR"] # MS-DRGs are nested in MDCs; pass ["MS-DRG", ...] for finer strata
+PREVIEW_COLUMNS = [
+    "PSI", "Sampled Rows", "Total Cases", "Sample Inclusions", "Estimated Inclusions", "Inclusions CI Low",
+    "Inclusions CI High", "Estimated Rate per 1000", "Rate CI Low", "Rate CI High",
+]
+
+
+def build_sampling_order(df_raw, strata_columns=None, random_state=0):
+    """
+    Returns (order, strata): a permutation of row positions whose every prefix is a proportional stratified
+    random sample, and the stratum number of every row. Within a stratum of N_h rows the k-th sampled row is
+    placed at (k + U) / N_h, so strata are interleaved in proportion to their size.
+    """
+    strata_columns = strata_columns or PREVIEW_STRATA_COLUMNS
+    keys = pd.DataFrame({col: get_column_or_empty(df_raw, col).to_numpy() for col in strata_columns})
+    strata = keys.groupby(strata_columns, sort=False, dropna=False).ngroup().to_numpy().astype(int) # Missing keys form their own strata
+
+    rng = np.random.default_rng(random_state)
+    shuffled = rng.permutation(len(df_raw))
+    rank_in_stratum = np.empty(len(df_raw))
+    rank_in_stratum[shuffled] = pd.Series(strata[shuffled]).groupby(strata[shuffled]).cumcount().to_numpy()
+    stratum_sizes = np.bincount(strata) if len(strata) else np.array([], dtype=int)
+    position_keys = (rank_in_stratum + rng.random(len(df_raw))) / stratum_sizes[strata]
+    return np.argsort(position_keys, kind="stable"), strata
+
+
+def wilson_interval(p, n, confidence=0.95):
+    """
+    Wilson score interval (low, high) of a proportion `p` observed on `n` trials (arrays or scalars). Unlike a
+    normal or percentile bootstrap interval, it does not collapse to a point when p is 0 or 1.
+    """
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p, n = np.asarray(p, dtype=float), np.asarray(n, dtype=float)
+    denominator = 1 + z ** 2 / n
+    center = (p + z ** 2 / (2 * n)) / denominator
+    half_width = z * np.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2)) / denominator
+    return np.maximum(center - half_width, 0.0), np.minimum(center + half_width, 1.0)
+
+
+def estimate_from_sample(sample_strata, sample_inclusions, stratum_sizes, confidence=0.95):
+    """
+    Stratified estimate of the inclusion count from a sample.
+    `sample_strata`: stratum of each sampled row; `sample_inclusions`: whether it scored as an inclusion;
+    `stratum_sizes`: rows per stratum in the whole input. Strata with fewer than 2 sampled rows (and
+    unsampled strata) are collapsed into one pooled stratum. The interval is a Wilson score interval on the
+    design-based effective sample size, so samples without inclusions still get a non-zero upper bound.
+    Returns (estimated_inclusions, ci_low, ci_high) in rows.
+    """
+    total = stratum_sizes.sum()
+    n_h = np.bincount(sample_strata, minlength=len(stratum_sizes)).astype(float)
+    y_h = np.bincount(sample_strata, weights=sample_inclusions.astype(float), minlength=len(stratum_sizes))
+    N_h = stratum_sizes.astype(float)
+
+    small = n_h < 2
+    if small.any():
+        if n_h[small].sum() < 2: # Too little to pool on its own: fall back to one stratum (simple random sample)
+            small[:] = True
+        kept = ~small
+        n_h = np.append(n_h[kept], n_h[small].sum())
+        y_h = np.append(y_h[kept], y_h[small].sum())
+        N_h = np.append(N_h[kept], N_h[small].sum())
+
+    sampled = n_h > 0
+    p_h = np.divide(y_h, n_h, out=np.zeros_like(y_h), where=sampled)
+    estimate = float((N_h * p_h).sum())
+    n = n_h.sum()
+    if n >= total: # Everything scored: the estimate is the exact count
+        return estimate, estimate, estimate
+
+    variance_terms = np.divide(N_h ** 2 * (1 - n_h / N_h) * p_h * (1 - p_h), n_h - 1, out=np.zeros_like(p_h), where=n_h > 1)
+    p = estimate / total
+    variance_p = variance_terms.sum() / total ** 2
+    n_effective = p * (1 - p) / variance_p if variance_p > 0 else n / (1 - n / total)
+
+    low, high = wilson_interval(p, n_effective, confidence)
+    return estimate, float(low) * total, float(high) * total
+
+
+def iter_preview_estimates(df_raw, psi_names, compiled_appendix, sample_size=None, batch_size=500, validate_timing=True,
+                           strata_columns=None, random_state=0, confidence=0.95):
+    """
+    Scores a stratified random sample of `df_raw` batch by batch and yields a PREVIEW_COLUMNS DataFrame
+    (one row per PSI) after every batch. Only the sampled rows are normalized and checked.
+    """
+    order, strata = build_sampling_order(df_raw, strata_columns, random_state)
+    stratum_sizes = np.bincount(strata)
+    sample_size = len(df_raw) if sample_size is None else min(sample_size, len(df_raw))
+    sample_positions = order[:sample_size]
+    sample_strata = strata[sample_positions]
+
+    df_sample_raw = df_raw.iloc[sample_positions]
+    df_sample = normalize_input_schema(df_sample_raw)
+    _, dq_flags_df = build_data_quality_report(df_sample_raw, df_sample)
+    prefilter_rationales = {
+        psi: build_prefilter_rationales(df_sample, psi, compiled_appendix, dq_flags_df["DQ_Rationale"]).to_numpy()
+        for psi in psi_names
+    }
+
+    # Rows outside every selected PSI's population are exclusions for all of them; only candidates are evaluated
+    is_candidate = np.array([pd.isna(prefilter_rationales[psi]) for psi in psi_names]).reshape(len(psi_names), sample_size)
+    inclusions = np.zeros((len(psi_names), sample_size), dtype=bool)
+    for start in range(0, sample_size, batch_size):
+        end = min(start + batch_size, sample_size)
+        positions = start + np.flatnonzero(is_candidate[:, start:end].any(axis=0))
+        for position, (_, row) in zip(positions, df_sample.iloc[positions].iterrows()):
+            for i, psi in enumerate(psi_names):
+                if is_candidate[i, position]:
+                    status, _, _ = score_row(row, psi, compiled_appendix, validate_timing=validate_timing)
+                    inclusions[i, position] = status == "Inclusion"
+
+        records = []
+        for i, psi in enumerate(psi_names):
+            estimate, low, high = estimate_from_sample(sample_strata[:end], inclusions[i, :end], stratum_sizes, confidence)
+            records.append({
+                "PSI": psi,
+                "Sampled Rows": end,
+                "Total Cases": len(df_raw),
+                "Sample Inclusions": int(inclusions[i, :end].sum()),
+                "Estimated Inclusions": round(estimate, 1),
+                "Inclusions CI Low": round(low, 1),
+                "Inclusions CI High": round(high, 1),
+                "Estimated Rate per 1000": round(estimate / len(df_raw) * 1000, 2),
+                "Rate CI Low": round(low / len(df_raw) * 1000, 2),
+                "Rate CI High": round(high / len(df_raw) * 1000, 2),
+            })
+        yield pd.DataFrame(records, columns=PREVIEW_COLUMNS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate PSI inclusion counts and rates from a stratified sample")
+    parser.add_argument("--input", required=True, help="PSI input file")
+    parser.add_argument("--appendix", required=True, help="PSI appendix (.xlsx or .json)")
+    parser.add_argument("--psis", default=",".join(ALL_PSIS), help="Comma-separated PSIs (default: all)")
+    parser.add_argument("--sample-size", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--no-timing", action="store_true", help="Disable timing validation")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    psi_names = [p.strip() for p in args.psis.split(",") if p.strip()]
+    unknown = [p for p in psi_names if p not in ALL_PSIS]
+    if unknown:
+        parser.error(f"Unknown PSI(s): {', '.join(unknown)}")
+
+    start = time.perf_counter()
+    validate_timing = not args.no_timing
+    df_raw, compiled_appendix = load_input_and_appendix(args.input, args.appendix, psi_names, validate_timing)
+
+    for estimates_df in iter_preview_estimates(df_raw, psi_names, compiled_appendix, sample_size=args.sample_size,
+                                               batch_size=args.batch_size, validate_timing=validate_timing, random_state=args.seed):
+        print(f"--- {estimates_df['Sampled Rows'].iat[0]} of {len(df_raw)} rows sampled ({time.perf_counter() - start:.1f}s)")
+        print(estimates_df.drop(columns=["Sampled Rows", "Total Cases"]).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+Multi-version appendix registry for PSI 05-15: score files that span fiscal-year boundaries in one job.
+
+Several compiled appendix versions are held at once, each effective from a discharge period (YEAR and DQTR).
+Every encounter is routed to the latest version in effect for its discharge period, and each version scores
+its own rows within the same pass. Code sets are shared between versions through a CodeSetPool: a code set
+that is identical in two versions is stored once and every code string is interned, so holding an extra
+version costs only the code sets that actually changed.
+
+Usage:
+    python psi_registry.py --input mixed_years.xlsx --appendix-version FY2024=Unified_PSI_Appendix_2024.xlsx \
+        --appendix-version FY2025=Unified_PSI_Appendix_2025.xlsx --output results.csv
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from bisect import bisect_right
+
+import numpy as np
+import pandas as pd
+
+from psi_engine import (
+    ALL_PSIS,
+    RESULT_BASE_COLUMNS,
+    build_data_quality_report,
+    compile_appendix,
+    compile_lazy_appendix,
+    fingerprint_encounters,
+    get_required_input_columns,
+    load_appendix_df,
+    load_input_df,
+    normalize_input_schema,
+    score_psi,
+)
+from psi_ingest import ConcurrentLoader
+
+APPENDIX_VERSION_COLUMN = "Appendix_Version"
+EFFECTIVE_PERIOD_PATTERN = re.compile(r"(?:FY(?P<fiscal_year>\d{4}))|(?:(?P<year>\d{4})(?:[-_ ]?Q(?P<quarter>[1-4]))?)", re.IGNORECASE)
+REGISTRY_SUMMARY_COLUMNS = ["Version", "Effective From", "Code Sets", "Codes", "Code Sets Shared"]
+
+
+def parse_effective_period(text):
+    """
+    Discharge period key YEAR * 10 + DQTR for "2024Q4", "2024" (= 2024Q1) or "FY2025" (federal fiscal year,
+    starting 2024Q4). Raises ValueError if `text` is none of these.
+    """
+    match = EFFECTIVE_PERIOD_PATTERN.fullmatch(str(text).strip())
+    if not match:
+        raise ValueError(f"Invalid effective period '{text}' (expected YYYY, YYYYQn or FYYYYY)")
+    if match.group("fiscal_year"):
+        return (int(match.group("fiscal_year")) - 1) * 10 + 4
+    return int(match.group("year")) * 10 + int(match.group("quarter") or 1)
+
+
+def format_effective_period(period):
+    return f"{period // 10}Q{period % 10}"
+
+
+def guess_effective_period(file_name):
+    """Effective period found in an appendix file name (e.g. "..._FY2025.xlsx" or "..._2024Q4.json"), or None."""
+    for token in re.findall(r"FY\d{4}|\d{4}[-_ ]?Q[1-4]", os.path.basename(file_name), re.IGNORECASE):
+        return format_effective_period(parse_effective_period(token))
+    return None
+
+
+class CodeSetPool:
+    """Shares code sets between appendix versions: identical sets are one list and every code string is interned."""
+
+    def __init__(self):
+        self._code_sets = {}
+        self.shared_count = 0 # Code sets handed out again instead of stored twice
+
+    def share(self, codes):
+        interned = [sys.intern(code) for code in codes]
+        key = tuple(interned) # Interned first, so the key never keeps the caller's own copies of the strings alive
+        shared = self._code_sets.get(key)
+        if shared is None:
+            shared = self._code_sets[key] = interned
+        else:
+            self.shared_count += 1
+        return shared
+
+
+class AppendixRegistry:
+    """Compiled appendix versions keyed by the discharge period they take effect; see route()."""
+
+    def __init__(self):
+        self.pool = CodeSetPool()
+        self.versions = [] # (effective_period, label, compiled_appendix), sorted by period
+
+    def add_version(self, effective_from, appendix_source, label=None, is_json=False, psi_names=None, lazy=False):
+        """
+        Compiles an appendix version effective from `effective_from` ("2024Q4", "FY2025", ...).
+        lazy=True reads only the code sets of `psi_names` up front (interactive runs; not picklable).
+        """
+        period = parse_effective_period(effective_from)
+        if any(p == period for p, _, _ in self.versions):
+            raise ValueError(f"Two appendix versions are effective from {format_effective_period(period)}")
+        label = label or (os.path.splitext(os.path.basename(appendix_source))[0] if isinstance(appendix_source, str)
+                          else getattr(appendix_source, "name", format_effective_period(period)))
+        if label in self.labels():
+            raise ValueError(f"Duplicate appendix version label '{label}'")
+        if lazy:
+            compiled_appendix = compile_lazy_appendix(appendix_source, is_json=is_json, psi_names=psi_names,
+                                                      share_code_set=self.pool.share)
+        else:
+            compiled_appendix = compile_appendix(load_appendix_df(appendix_source, is_json=is_json), share_code_set=self.pool.share)
+        self.versions.append((period, label, compiled_appendix))
+        self.versions.sort(key=lambda version: version[0])
+        return compiled_appendix
+
+    def labels(self):
+        return [label for _, label, _ in self.versions]
+
+    def latest(self):
+        """The compiled appendix of the most recent version."""
+        return self.versions[-1][2]
+
+    def route(self, df):
+        """
+        Version label per row: the latest version in effect for the row's YEAR/DQTR (a missing DQTR counts as
+        Q1). Rows before the first version use the first; rows without a YEAR use the latest.
+        """
+        years = pd.to_numeric(df["YEAR"], errors="coerce") if "YEAR" in df.columns else pd.Series(np.nan, index=df.index)
+        quarters = pd.to_numeric(df["DQTR"], errors="coerce") if "DQTR" in df.columns else pd.Series(np.nan, index=df.index)
+        periods = (years * 10 + quarters.fillna(1)).to_numpy()
+        starts = [period for period, _, _ in self.versions]
+        positions = np.searchsorted(starts, periods, side="right") - 1
+        positions = np.where(np.isnan(periods), len(starts) - 1, np.maximum(positions, 0))
+        return pd.Series(np.array(self.labels(), dtype=object)[positions], index=df.index)
+
+    def version_for(self, year, quarter=None):
+        """Label of the version in effect for one discharge period."""
+        starts = [period for period, _, _ in self.versions]
+        return self.versions[max(bisect_right(starts, int(year) * 10 + int(quarter or 1)) - 1, 0)][1]
+
+    def get(self, label):
+        for _, version_label, compiled_appendix in self.versions:
+            if version_label == label:
+                return compiled_appendix
+        raise KeyError(label)
+
+    def summary(self):
+        """One row per version: effective period, code set and code counts, and how many sets are shared with another version."""
+        seen = {}
+        for _, label, compiled_appendix in self.versions:
+            for codes in self._loaded_code_sets(compiled_appendix).values():
+                seen.setdefault(id(codes), set()).add(label)
+        records = []
+        for period, label, compiled_appendix in self.versions:
+            code_sets = self._loaded_code_sets(compiled_appendix)
+            records.append({
+                "Version": label,
+                "Effective From": format_effective_period(period),
+                "Code Sets": len(code_sets),
+                "Codes": sum(len(codes) for codes in code_sets.values()),
+                "Code Sets Shared": sum(len(seen[id(codes)]) > 1 for codes in code_sets.values()),
+            })
+        return pd.DataFrame(records, columns=REGISTRY_SUMMARY_COLUMNS)
+
+    @staticmethod
+    def _loaded_code_sets(compiled_appendix):
+        code_sets = compiled_appendix["code_sets"]
+        names = code_sets.loaded_names() if hasattr(code_sets, "loaded_names") else list(code_sets)
+        return {name: code_sets[name] for name in names}
+
+
+def score_psi_versioned(df_normalized, psi_name, registry, dq_rationales=None, debug_mode=False, validate_timing=True,
+                        carry_columns=None, progress_callback=None, fingerprints=None, version_labels=None):
+    """
+    score_psi with every row scored against the appendix version in effect for its discharge period
+    (pass `version_labels` from registry.route to avoid routing again). Adds an Appendix_Version column.
+    """
+    version_labels = registry.route(df_normalized) if version_labels is None else version_labels
+    fingerprints = fingerprint_encounters(df_normalized) if fingerprints is None else fingerprints
+    carry_columns = [c for c in (carry_columns or []) if c in df_normalized.columns]
+    frames = []
+    present_labels = [label for label in registry.labels() if (version_labels == label).any()]
+    for label in present_labels:
+        in_version = (version_labels == label).to_numpy()
+        version_df = df_normalized[in_version]
+        results_df = score_psi(
+            version_df, psi_name, registry.get(label),
+            dq_rationales=dq_rationales[in_version] if dq_rationales is not None else None,
+            debug_mode=debug_mode, validate_timing=validate_timing, carry_columns=carry_columns,
+            progress_callback=progress_callback, fingerprints=fingerprints[in_version]
+        )
+        results_df.index = np.flatnonzero(in_version)
+        frames.append(results_df.assign(**{APPENDIX_VERSION_COLUMN: label}))
+
+    if not frames:
+        return score_psi(df_normalized, psi_name, registry.latest(), validate_timing=validate_timing,
+                         carry_columns=carry_columns).assign(**{APPENDIX_VERSION_COLUMN: pd.Series(dtype="object")})
+    results_df = pd.concat(frames).sort_index()
+    detail_columns = [c for c in results_df.columns
+                      if c not in RESULT_BASE_COLUMNS and c not in carry_columns and c != APPENDIX_VERSION_COLUMN]
+    return results_df[RESULT_BASE_COLUMNS + detail_columns + carry_columns + [APPENDIX_VERSION_COLUMN]].reset_index(drop=True)
+
+
+def score_dataframe_versioned(df_raw, psi_names, registry, debug_mode=False, validate_timing=True, carry_columns=None):
+    """score_dataframe with per-row appendix versions (see score_psi_versioned). Returns (results_df, dq_summary_df)."""
+    df_normalized = normalize_input_schema(df_raw)
+    fingerprints = fingerprint_encounters(df_normalized)
+    dq_summary_df, dq_flags_df = build_data_quality_report(df_raw, df_normalized, fingerprints=fingerprints)
+    version_labels = registry.route(df_normalized)
+    results_frames = [
+        score_psi_versioned(df_normalized, psi, registry, dq_rationales=dq_flags_df["DQ_Rationale"], debug_mode=debug_mode,
+                            validate_timing=validate_timing, carry_columns=carry_columns, fingerprints=fingerprints,
+                            version_labels=version_labels)
+        for psi in psi_names
+    ]
+    results_df = (pd.concat(results_frames, ignore_index=True) if results_frames
+                  else pd.DataFrame(columns=RESULT_BASE_COLUMNS + [APPENDIX_VERSION_COLUMN]))
+    return results_df, dq_summary_df
+
+
+def parse_version_arguments(values):
+    """[(effective_from, path)] from "PERIOD=PATH" command-line values."""
+    versions = []
+    for value in values:
+        period, separator, path = value.partition("=")
+        if not separator or not path:
+            raise ValueError(f"Invalid appendix version '{value}' (expected PERIOD=PATH, e.g. FY2025=appendix.xlsx)")
+        parse_effective_period(period)
+        versions.append((period, path))
+    return versions
+
+
+def build_registry(versions, psi_names=None, lazy=False):
+    """AppendixRegistry from [(effective_from, appendix_path)]."""
+    registry = AppendixRegistry()
+    for effective_from, path in versions:
+        registry.add_version(effective_from, path, is_json=path.lower().endswith(".json"), psi_names=psi_names, lazy=lazy)
+    return registry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score an input whose discharges span several appendix versions")
+    parser.add_argument("--input", required=True, help="PSI input file")
+    parser.add_argument("--appendix-version", required=True, action="append", metavar="PERIOD=PATH",
+                        help="Appendix effective from PERIOD (YYYY, YYYYQn or FYYYYY); repeat for every version")
+    parser.add_argument("--output", required=True, help="Results CSV")
+    parser.add_argument("--psis", default=",".join(ALL_PSIS), help="Comma-separated PSIs (default: all)")
+    parser.add_argument("--no-timing", action="store_true", help="Disable timing validation")
+    args = parser.parse_args()
+
+    psi_names = [p.strip() for p in args.psis.split(",") if p.strip()]
+    unknown = [p for p in psi_names if p not in ALL_PSIS]
+    if unknown:
+        parser.error(f"Unknown PSI(s): {', '.join(unknown)}")
+    try:
+        versions = parse_version_arguments(args.appendix_version)
+    except ValueError as e:
+        parser.error(str(e))
+
+    start = time.perf_counter()
+    validate_timing = not args.no_timing
+    with ConcurrentLoader() as loader: # Input parsed in a worker while the versions are compiled here
+        loader.submit("Input load", load_input_df, args.input, columns=get_required_input_columns(psi_names, validate_timing))
+        registry = loader.run("Appendix versions", build_registry, versions, psi_names=psi_names, lazy=True)
+    print(registry.summary().to_string(index=False))
+    df_raw = loader.result("Input load")
+    results_df, _ = score_dataframe_versioned(df_raw, psi_names, registry, validate_timing=validate_timing)
+    results_df.to_csv(args.output, index=False)
+    rows_per_version = results_df.loc[results_df["PSI"] == psi_names[0], APPENDIX_VERSION_COLUMN].value_counts()
+    routed = ", ".join(f"{label}: {count} rows" for label, count in rows_per_version.items())
+    print(f"Done in {time.perf_counter() - start:.1f}s: {len(results_df)} result rows written to {args.output} ({routed})")
+
+
+if __name__ == "__main__":
+    main()
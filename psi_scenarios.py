@@ -0,0 +1,237 @@
+"""
+What-if scenarios for PSI 05-15: score several rule parameter sets in one pass and compare them side by side.
+
+A scenario is a name plus timing validation and any DEFAULT_PSI_PARAMETERS overrides (PSI_13 OR cutoff day,
+PSI_15 related-procedure window, minimum length of stay for PSI_07/PSI_14). Each PSI is evaluated once per
+distinct effective parameter set: the data quality and population prefilter, the diagnosis/procedure parsing
+of each encounter and scenarios that do not change a PSI's parameters are shared.
+
+Usage:
+    python psi_scenarios.py --input Unified_PSI_Input_Template_Enhanced.xlsx --appendix Unified_PSI_Appendix_05_14.xlsx \
+        --scenarios scenarios.csv --output-dir whatif
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from psi_engine import (
+    ALL_PSIS,
+    DEFAULT_PSI_PARAMETERS,
+    PSI_PARAMETER_NAMES,
+    TIMING_PSIS,
+    build_data_quality_report,
+    build_prefilter_rationales,
+    build_procedure_feature_records,
+    evaluate_psi_comprehensive,
+    extract_dx_codes_enhanced,
+    extract_proc_info_enhanced,
+    fingerprint_encounters,
+    get_organ_maps,
+    normalize_input_schema,
+)
+from psi_ingest import load_input_and_appendix
+
+# One scenario per row; the PSI_15 window is split into its first and last day
+SCENARIO_TABLE_COLUMNS = ["Scenario", "validate_timing", "psi13_or_cutoff_day", "psi15_window_first_day",
+                          "psi15_window_last_day", "min_length_of_stay"]
+DEFAULT_SCENARIOS = [
+    {"name": "Standard"},
+    {"name": "Timing validation off", "validate_timing": False},
+    {"name": "PSI_13 OR cutoff day 14", "psi13_or_cutoff_day": 14},
+    {"name": "PSI_15 window 1-14 days", "psi15_related_proc_window": (1, 14)},
+    {"name": "No LOS exclusion", "min_length_of_stay": 0},
+]
+SCENARIO_SUMMARY_COLUMNS = ["PSI", "Scenario", "Total Cases", "Inclusions", "Rate per 1000", "Inclusions vs Baseline",
+                            "Rate vs Baseline", "Status Changes vs Baseline"]
+
+
+def normalize_scenarios(scenarios):
+    """
+    Fills every scenario dict ({"name", "validate_timing", <parameter>: value, ...}) with the defaults.
+    Returns a list of {"name", "validate_timing", "parameters"}; the first scenario is the baseline.
+    """
+    normalized = []
+    for i, scenario in enumerate(scenarios):
+        scenario = {**scenario.get("parameters", {}), **{k: v for k, v in scenario.items() if k != "parameters"}} # Normalized input is accepted too
+        unknown = [k for k in scenario if k not in ("name", "validate_timing") and k not in DEFAULT_PSI_PARAMETERS]
+        if unknown:
+            raise ValueError(f"Unknown scenario parameter(s): {', '.join(unknown)}")
+        parameters = {k: scenario.get(k, default) for k, default in DEFAULT_PSI_PARAMETERS.items()}
+        parameters["psi15_related_proc_window"] = tuple(int(d) for d in parameters["psi15_related_proc_window"])
+        normalized.append({"name": str(scenario.get("name") or f"Scenario {i + 1}"),
+                           "validate_timing": bool(scenario.get("validate_timing", True)), "parameters": parameters})
+    names = [s["name"] for s in normalized]
+    if len(set(names)) != len(names):
+        raise ValueError("Scenario names must be unique")
+    return normalized
+
+
+def scenarios_from_table(scenarios_df):
+    """Scenario dicts from a SCENARIO_TABLE_COLUMNS table (CSV file or the app's editor); blank cells take the defaults."""
+    scenarios = []
+    for record in scenarios_df.to_dict("records"):
+        record = {k: v for k, v in record.items() if pd.notna(v) and str(v).strip() != ""}
+        scenario = {"name": record.get("Scenario")}
+        if "validate_timing" in record:
+            value = record["validate_timing"]
+            scenario["validate_timing"] = value if isinstance(value, (bool, np.bool_)) else str(value).strip().lower() in ("true", "1", "yes", "y")
+        for key in ["psi13_or_cutoff_day", "min_length_of_stay"]:
+            if key in record:
+                scenario[key] = int(record[key])
+        if "psi15_window_first_day" in record or "psi15_window_last_day" in record:
+            first_day, last_day = DEFAULT_PSI_PARAMETERS["psi15_related_proc_window"]
+            scenario["psi15_related_proc_window"] = (int(record.get("psi15_window_first_day", first_day)),
+                                                     int(record.get("psi15_window_last_day", last_day)))
+        scenarios.append(scenario)
+    return scenarios
+
+
+def scenarios_to_table(scenarios):
+    """SCENARIO_TABLE_COLUMNS table of scenario dicts (e.g. DEFAULT_SCENARIOS for the app's editor)."""
+    return pd.DataFrame([{
+        "Scenario": s["name"],
+        "validate_timing": s["validate_timing"],
+        "psi13_or_cutoff_day": s["parameters"]["psi13_or_cutoff_day"],
+        "psi15_window_first_day": s["parameters"]["psi15_related_proc_window"][0],
+        "psi15_window_last_day": s["parameters"]["psi15_related_proc_window"][1],
+        "min_length_of_stay": s["parameters"]["min_length_of_stay"],
+    } for s in normalize_scenarios(scenarios)], columns=SCENARIO_TABLE_COLUMNS)
+
+
+def get_effective_settings(psi_name, scenario):
+    """The part of a normalized scenario that can change psi_name's results (hashable)."""
+    validate_timing = scenario["validate_timing"] if psi_name in TIMING_PSIS else None
+    return validate_timing, tuple((k, scenario["parameters"][k]) for k in PSI_PARAMETER_NAMES.get(psi_name, []))
+
+
+def score_scenarios(df_normalized, psi_names, compiled_appendix, scenarios, dq_rationales=None, fingerprints=None,
+                    progress_callback=None):
+    """
+    Scores every PSI under every scenario in one pass over the encounters.
+    Returns a DataFrame with EncounterID, PSI, "Status: <scenario>" and "Rationale: <scenario>" per scenario and
+    "Changed" (any status differs from the first scenario's). progress_callback(psi, done, total) is called as
+    distinct candidates are scored.
+    """
+    scenarios = normalize_scenarios(scenarios)
+    fingerprints = fingerprint_encounters(df_normalized) if fingerprints is None else fingerprints
+    code_sets = compiled_appendix["code_sets"]
+    frames = []
+    for psi in psi_names:
+        settings = [get_effective_settings(psi, s) for s in scenarios]
+        variants = list(dict.fromkeys(settings)) # Distinct parameter sets for this PSI, evaluated once each
+        prefilter_rationales = build_prefilter_rationales(df_normalized, psi, compiled_appendix, dq_rationales)
+        is_candidate = prefilter_rationales.isna().to_numpy()
+
+        candidates = df_normalized[is_candidate]
+        candidate_fingerprints = fingerprints[is_candidate]
+        distinct_candidates = candidates[~candidate_fingerprints.duplicated().to_numpy()]
+        organ_systems, organ_code_index = get_organ_maps(compiled_appendix, psi)
+        variant_statuses = np.empty((len(variants), len(distinct_candidates)), dtype=object)
+        variant_rationales = np.empty((len(variants), len(distinct_candidates)), dtype=object)
+        feature_records = build_procedure_feature_records(distinct_candidates, psi, code_sets)
+        for j, ((_, row), procedure_features) in enumerate(zip(distinct_candidates.iterrows(), feature_records)):
+            parsed_codes = (extract_dx_codes_enhanced(row), extract_proc_info_enhanced(row))
+            for v, (validate_timing, parameters) in enumerate(variants):
+                status, rationale, _ = evaluate_psi_comprehensive(
+                    row, psi, code_sets, organ_systems, validate_timing=validate_timing is not False,
+                    organ_code_index=organ_code_index, parameters=dict(parameters), parsed_codes=parsed_codes,
+                    procedure_features=procedure_features
+                )
+                variant_statuses[v, j] = status
+                variant_rationales[v, j] = "; ".join(rationale)
+            if progress_callback and (j + 1) % 100 == 0:
+                progress_callback(psi, j + 1, len(distinct_candidates))
+        if progress_callback:
+            progress_callback(psi, len(distinct_candidates), len(distinct_candidates))
+
+        # Fan the distinct results out to every candidate; out-of-population rows are exclusions in every scenario
+        positions = pd.Index(candidate_fingerprints[distinct_candidates.index]).get_indexer(candidate_fingerprints)
+        frame = pd.DataFrame({"EncounterID": df_normalized["EncounterID"].to_numpy(), "PSI": psi})
+        for scenario, setting in zip(scenarios, settings):
+            v = variants.index(setting)
+            status = np.full(len(df_normalized), "Exclusion", dtype=object)
+            status[is_candidate] = variant_statuses[v, positions]
+            rationale = prefilter_rationales.to_numpy(dtype=object).copy()
+            rationale[is_candidate] = variant_rationales[v, positions]
+            frame[f"Status: {scenario['name']}"] = status
+            frame[f"Rationale: {scenario['name']}"] = rationale
+        status_columns = [f"Status: {s['name']}" for s in scenarios]
+        frame["Changed"] = frame[status_columns].ne(frame[status_columns[0]], axis=0).any(axis=1)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["EncounterID", "PSI", "Changed"])
+
+
+def summarize_scenarios(scenario_results_df):
+    """Inclusions and rate per 1000 per PSI and scenario, with the change from the first (baseline) scenario."""
+    scenario_names = [c[len("Status: "):] for c in scenario_results_df.columns if c.startswith("Status: ")]
+    records = []
+    for psi, psi_df in scenario_results_df.groupby("PSI", sort=False):
+        baseline_status = psi_df[f"Status: {scenario_names[0]}"]
+        baseline_inclusions = int((baseline_status == "Inclusion").sum())
+        total_cases = len(psi_df)
+        for name in scenario_names:
+            status = psi_df[f"Status: {name}"]
+            inclusions = int((status == "Inclusion").sum())
+            records.append({
+                "PSI": psi,
+                "Scenario": name,
+                "Total Cases": total_cases,
+                "Inclusions": inclusions,
+                "Rate per 1000": round(inclusions / total_cases * 1000, 2) if total_cases else 0.0,
+                "Inclusions vs Baseline": inclusions - baseline_inclusions,
+                "Rate vs Baseline": round((inclusions - baseline_inclusions) / total_cases * 1000, 2) if total_cases else 0.0,
+                "Status Changes vs Baseline": int((status != baseline_status).sum()),
+            })
+    return pd.DataFrame(records, columns=SCENARIO_SUMMARY_COLUMNS)
+
+
+def load_scenarios(path):
+    """Scenarios from a JSON list of scenario dicts or a SCENARIO_TABLE_COLUMNS CSV."""
+    if path.lower().endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return scenarios_from_table(pd.read_csv(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare PSI results under several rule parameter scenarios in one pass")
+    parser.add_argument("--input", required=True, help="PSI input file")
+    parser.add_argument("--appendix", required=True, help="PSI appendix (.xlsx or .json)")
+    parser.add_argument("--scenarios", default=None, help="Scenarios (.json list or .csv table; default: built-in set)")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--psis", default=",".join(ALL_PSIS), help="Comma-separated PSIs (default: all)")
+    args = parser.parse_args()
+
+    psi_names = [p.strip() for p in args.psis.split(",") if p.strip()]
+    unknown = [p for p in psi_names if p not in ALL_PSIS]
+    if unknown:
+        parser.error(f"Unknown PSI(s): {', '.join(unknown)}")
+    try:
+        scenarios = normalize_scenarios(load_scenarios(args.scenarios) if args.scenarios else DEFAULT_SCENARIOS)
+    except ValueError as e:
+        parser.error(str(e))
+
+    start = time.perf_counter()
+    validate_timing = any(s["validate_timing"] for s in scenarios)
+    df_raw, compiled_appendix = load_input_and_appendix(args.input, args.appendix, psi_names, validate_timing)
+    df_normalized = normalize_input_schema(df_raw)
+    fingerprints = fingerprint_encounters(df_normalized)
+    _, dq_flags_df = build_data_quality_report(df_raw, df_normalized, fingerprints=fingerprints)
+
+    scenario_results_df = score_scenarios(df_normalized, psi_names, compiled_appendix, scenarios,
+                                          dq_rationales=dq_flags_df["DQ_Rationale"], fingerprints=fingerprints)
+    summary_df = summarize_scenarios(scenario_results_df)
+    os.makedirs(args.output_dir, exist_ok=True)
+    scenario_results_df.to_csv(os.path.join(args.output_dir, "scenario_statuses.csv"), index=False)
+    summary_df.to_csv(os.path.join(args.output_dir, "scenario_summary.csv"), index=False)
+    print(summary_df.to_string(index=False))
+    print(f"Done in {time.perf_counter() - start:.1f}s: {len(scenarios)} scenario(s), "
+          f"{int(scenario_results_df['Changed'].sum())} encounter/PSI status change(s); written to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+Local HTTP scoring service for PSI 05-15.
+
+Loads and compiles the appendix once at startup, then scores batches of encounters with the same
+engine as the Streamlit analyzer (psi_engine). Standard library only; Arrow request bodies
+additionally need pyarrow.
+
+Usage:
+    python psi_service.py --appendix Unified_PSI_Appendix_05_14.xlsx --port 8765
+
+Endpoints:
+    GET  /health   Appendix summary (code sets loaded)
+    GET  /metrics  Request/encounter counters, latency and throughput
+    POST /score    Score a batch of encounters and return per-PSI status and reason codes
+                   - JSON body: {"encounters": [{...}, ...], "psis": ["PSI_13", ...], "validate_timing": true}
+                   - Arrow IPC body (Content-Type: application/vnd.apache.arrow.stream or .file),
+                     options in the query string: /score?psis=PSI_13,PSI_15&validate_timing=false
+                   "psis" defaults to all PSIs and "validate_timing" to true.
+"""
+import argparse
+import io
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from psi_engine import (
+    ALL_PSIS,
+    build_data_quality_report,
+    build_prefilter_rationales,
+    compile_appendix,
+    get_rationale_category,
+    load_appendix_df,
+    normalize_input_schema,
+    score_row,
+)
+
+try:
+    import pyarrow as pa
+    from pyarrow import ipc
+except ImportError: # Arrow request bodies are optional
+    pa = None
+
+ARROW_CONTENT_TYPES = ["application/vnd.apache.arrow.stream", "application/vnd.apache.arrow.file"]
+
+
+class ServiceMetrics:
+    """Thread-safe latency and throughput counters for the scoring service."""
+
+    def __init__(self, latency_window=1000):
+        self._lock = threading.Lock()
+        self._latencies_ms = deque(maxlen=latency_window) # Most recent /score latencies
+        self.started_at = time.time()
+        self.requests_total = 0
+        self.requests_failed = 0
+        self.encounters_scored = 0
+        self.evaluations = 0 # encounters x PSIs
+        self.busy_seconds = 0.0
+
+    def record(self, elapsed_seconds, encounters=0, psi_count=0, failed=False):
+        with self._lock:
+            self.requests_total += 1
+            if failed:
+                self.requests_failed += 1
+                return
+            self.encounters_scored += encounters
+            self.evaluations += encounters * psi_count
+            self.busy_seconds += elapsed_seconds
+            self._latencies_ms.append(elapsed_seconds * 1000)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self._latencies_ms)
+            uptime = time.time() - self.started_at
+
+            def percentile(p):
+                return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 2) if latencies else None
+
+            return {
+                "uptime_seconds": round(uptime, 1),
+                "requests_total": self.requests_total,
+                "requests_failed": self.requests_failed,
+                "encounters_scored": self.encounters_scored,
+                "evaluations": self.evaluations,
+                "latency_ms": {
+                    "mean": round(sum(latencies) / len(latencies), 2) if latencies else None,
+                    "p50": percentile(0.50),
+                    "p95": percentile(0.95),
+                    "max": round(latencies[-1], 2) if latencies else None,
+                },
+                "throughput": {
+                    "encounters_per_busy_second": round(self.encounters_scored / self.busy_seconds, 1) if self.busy_seconds else None,
+                    "encounters_per_uptime_second": round(self.encounters_scored / uptime, 3) if uptime else None,
+                },
+            }
+
+
+def score_batch(df_raw, psi_names, compiled_appendix, validate_timing=True):
+    """
+    Scores a batch of raw encounters for the given PSIs.
+    Returns a list of {"EncounterID", "PSI", "Status", "ReasonCodes", "Rationale"} dicts.
+    """
+    df_normalized = normalize_input_schema(df_raw)
+    _, dq_flags_df = build_data_quality_report(df_raw, df_normalized)
+
+    results = []
+    for psi in psi_names:
+        prefilter_rationales = build_prefilter_rationales(df_normalized, psi, compiled_appendix, dq_flags_df["DQ_Rationale"])
+        for idx, row in df_normalized.iterrows():
+            status, rationale, _ = score_row(
+                row, psi, compiled_appendix, prefilter_rationale=prefilter_rationales[idx], validate_timing=validate_timing
+            )
+            results.append({
+                "EncounterID": row.get("EncounterID"),
+                "PSI": psi,
+                "Status": status,
+                "ReasonCodes": list(dict.fromkeys(get_rationale_category(r) for r in rationale)), # Unique, in order
+                "Rationale": rationale,
+            })
+    return results
+
+
+def parse_psi_list(value):
+    """Validates a requested PSI list (list or comma-separated string). Empty means all PSIs."""
+    if not value:
+        return list(ALL_PSIS)
+    psi_names = [p.strip() for p in value.split(",")] if isinstance(value, str) else list(value)
+    unknown = [p for p in psi_names if p not in ALL_PSIS]
+    if unknown:
+        raise ValueError(f"Unknown PSI(s): {', '.join(map(str, unknown))}")
+    return psi_names
+
+
+def parse_bool(value, default=True):
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() not in ("0", "false", "no", "off")
+
+
+def read_arrow_body(body):
+    """Reads an Arrow IPC stream or file payload into a DataFrame."""
+    if pa is None:
+        raise ValueError("Arrow request bodies require pyarrow, which is not installed")
+    try:
+        table = ipc.open_stream(io.BytesIO(body)).read_all()
+    except pa.ArrowInvalid:
+        table = ipc.open_file(pa.BufferReader(body)).read_all()
+    return table.to_pandas()
+
+
+def make_handler(compiled_appendix, metrics):
+    """Builds a request handler class bound to a compiled appendix and a metrics collector."""
+
+    class PSIScoringHandler(BaseHTTPRequestHandler):
+        server_version = "PSIScoringService/1.0"
+
+        def _send_json(self, status_code, payload):
+            body = json.dumps(payload, default=str).encode("utf-8")
+            self.send_response(status_code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args): # Keep the console quiet; /metrics has the numbers
+            pass
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/health":
+                self._send_json(200, {"status": "ok", "code_sets": len(compiled_appendix["code_sets"])})
+            elif path == "/metrics":
+                self._send_json(200, metrics.snapshot())
+            else:
+                self._send_json(404, {"error": f"Unknown endpoint {path}"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != "/score":
+                self._send_json(404, {"error": f"Unknown endpoint {url.path}"})
+                return
+
+            start = time.perf_counter()
+            try:
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                content_type = self.headers.get("Content-Type", "application/json").split(";")[0].strip()
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+                if content_type in ARROW_CONTENT_TYPES:
+                    df_raw = read_arrow_body(body)
+                    options = query
+                else:
+                    request = json.loads(body or b"{}")
+                    if not isinstance(request.get("encounters"), list):
+                        raise ValueError("Expected a JSON object with an 'encounters' list")
+                    df_raw = pd.DataFrame(request["encounters"])
+                    options = {**query, **request}
+
+                psi_names = parse_psi_list(options.get("psis"))
+                validate_timing = parse_bool(options.get("validate_timing"))
+                results = score_batch(df_raw, psi_names, compiled_appendix, validate_timing=validate_timing) if len(df_raw) else []
+            except (ValueError, KeyError, TypeError) as e:
+                metrics.record(time.perf_counter() - start, failed=True)
+                self._send_json(400, {"error": str(e)})
+                return
+            except Exception as e:
+                metrics.record(time.perf_counter() - start, failed=True)
+                self._send_json(500, {"error": str(e)})
+                return
+
+            elapsed = time.perf_counter() - start
+            metrics.record(elapsed, encounters=len(df_raw), psi_count=len(psi_names))
+            self._send_json(200, {
+                "encounters": len(df_raw),
+                "psis": psi_names,
+                "elapsed_ms": round(elapsed * 1000, 2),
+                "results": results,
+            })
+
+    return PSIScoringHandler
+
+
+def create_server(compiled_appendix, host="127.0.0.1", port=8765):
+    """Creates a threaded scoring server (one thread per request) around a compiled appendix."""
+    metrics = ServiceMetrics()
+    server = ThreadingHTTPServer((host, port), make_handler(compiled_appendix, metrics))
+    server.metrics = metrics
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP scoring service for PSI 05-15")
+    parser.add_argument("--appendix", required=True, help="PSI appendix (.xlsx or .json)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    compiled_appendix = compile_appendix(load_appendix_df(args.appendix, is_json=args.appendix.lower().endswith(".json")))
+    print(f"Compiled {len(compiled_appendix['code_sets'])} code sets in {time.perf_counter() - start:.1f}s")
+
+    server = create_server(compiled_appendix, args.host, args.port)
+    print(f"PSI scoring service listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Pipeline-stage timers and memory telemetry for PSI 05-15.
+
+Each stage (input parse, appendix compile, normalization, per-PSI scoring, exports, ...) records its
+wall-clock time, rows/sec, the process RSS after the stage and the process peak RSS. With
+trace_memory=True, the peak Python allocation inside each stage is also traced with tracemalloc
+(slower; stages must not be nested then). Standard library only; psutil is used for RSS if installed.
+"""
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError: # Optional; RSS falls back to /proc on Linux
+    psutil = None
+
+TELEMETRY_COLUMNS = ["Stage", "Rows", "Seconds", "Rows/sec", "RSS MB", "Peak RSS MB", "Peak Traced MB"]
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB, or None if it cannot be determined."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2**20
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+    except (OSError, AttributeError, ValueError):
+        return None
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far in MB, or None if it cannot be determined."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10 # Bytes on macOS, KB on Linux
+
+
+class PipelineTelemetry:
+    """Collects one record per pipeline stage; see stage()."""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.records = []
+        self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """
+        Times the wrapped block as one stage. Yields the stage record, so the row count can also be set
+        once it is known: `with telemetry.stage("Input load") as record: ...; record["Rows"] = len(df)`.
+        """
+        record = {"Stage": name, "Rows": rows}
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            elapsed = time.perf_counter() - start
+            record["Seconds"] = round(elapsed, 3)
+            record["Rows/sec"] = round(record["Rows"] / elapsed, 1) if record["Rows"] and elapsed > 0 else None
+            rss, peak_rss = current_rss_mb(), peak_rss_mb()
+            record["RSS MB"] = round(rss, 1) if rss is not None else None
+            record["Peak RSS MB"] = round(peak_rss, 1) if peak_rss is not None else None
+            record["Peak Traced MB"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1) if self.trace_memory else None
+            self.records.append(record)
+
+    def add_overlapped(self, name, seconds, rows=None):
+        """
+        Records a step that ran concurrently with others inside an enclosing stage (e.g. one of several files
+        loaded in parallel, see psi_ingest). Only its time and rows are known; it is left out of total_seconds.
+        """
+        self.records.append({
+            "Stage": name, "Rows": rows, "Seconds": round(seconds, 3),
+            "Rows/sec": round(rows / seconds, 1) if rows and seconds > 0 else None, "Overlapped": True,
+        })
+
+    def stop(self):
+        """Stops tracemalloc if this collector started it."""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def to_dataframe(self):
+        return pd.DataFrame(self.records, columns=TELEMETRY_COLUMNS)
+
+    def to_dict(self):
+        """Machine-readable form: the stages plus run totals."""
+        peak_rss = peak_rss_mb()
+        return {
+            "stages": self.records,
+            "total_seconds": round(sum(r["Seconds"] for r in self.records if not r.get("Overlapped")), 3),
+            "peak_rss_mb": round(peak_rss, 1) if peak_rss is not None else None,
+        }
+
+    def write_json(self, path, **extra):
+        """Writes to_dict() (plus any `extra` top-level fields) as JSON."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({**self.to_dict(), **extra}, f, indent=2, default=str)
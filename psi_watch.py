@@ -0,0 +1,275 @@
+"""
+Watch-folder daemon for PSI 05-15: score input files as they land in a directory.
+
+The appendix is compiled once at startup and kept warm. The watched directory is polled; a new or changed input
+file is scored once its size and modification time have been stable for --stable-seconds, so files still
+being copied are left alone. Every file's results, PSI summary and stage metrics go to their own folder in
+--output-dir. Processed files are recorded (path, size, mtime and SHA-256) in watch_state.json after each
+file, so a restarted daemon neither re-scores finished files nor misses files that arrived while it was down.
+A file that fails (unreadable, removed mid-read, output disk full ...) is logged and not recorded; it is retried
+after --retry-seconds, doubling with each further failure, or as soon as it changes.
+
+Usage:
+    python psi_watch.py --watch-dir /mnt/extracts --appendix Unified_PSI_Appendix_05_14.xlsx --output-dir /mnt/psi_results
+
+Outputs (in --output-dir):
+    <file>-<hash>/results.csv   All PSI results of one input file (as batch_results.csv)
+    <file>-<hash>/summary.csv   Total Cases / Inclusions / Exclusions / Rate per 1000 per PSI
+    <file>-<hash>/metrics.json  Stage timings, rows/sec and memory (see psi_telemetry)
+    watch_files.csv             One line per processed file: status, error, rows, latency and output folder
+    watch_state.json            Processed-file state used on restart
+"""
+import argparse
+import json
+import os
+import signal
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from psi_batch import resolve_input_files, score_input_file
+from psi_checkpoint import hash_source
+from psi_engine import ALL_PSIS, compile_appendix, load_appendix_df, summarize_results
+from psi_registry import build_registry, parse_version_arguments
+from psi_telemetry import PipelineTelemetry
+
+WATCH_STATE_FILE = "watch_state.json"
+WATCH_LOG_FILE = "watch_files.csv"
+WATCH_LOG_COLUMNS = ["processed_at", "file", "sha256", "status", "error", "rows", "duplicates_collapsed",
+                     "elapsed_seconds", "latency_seconds", "output"]
+MAX_RETRY_SECONDS = 3600 # Longest wait before a failing file is tried again
+
+
+class WatchState:
+    """Processed-file state ({path: {size, mtime, sha256, ...}}), saved atomically after every file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.files = json.load(f).get("files", {})
+
+    def _scored_entry(self, file_path):
+        entry = self.files.get(os.path.abspath(file_path))
+        return entry if entry is not None and entry.get("status") != "failed" else None # Failures of older versions are retried
+
+    def is_processed(self, file_path, size, mtime):
+        entry = self._scored_entry(file_path)
+        return entry is not None and entry["size"] == size and entry["mtime"] == mtime
+
+    def is_processed_content(self, file_path, sha256):
+        """True if the file was already scored with this exact content (e.g. it was only touched or re-copied)."""
+        entry = self._scored_entry(file_path)
+        return entry is not None and entry["sha256"] == sha256
+
+    def record(self, file_path, size, mtime, sha256, **details):
+        self.files[os.path.abspath(file_path)] = {"size": size, "mtime": mtime, "sha256": sha256, **details}
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files}, f, indent=2)
+        os.replace(temp_path, self.path)
+
+
+class StabilityTracker:
+    """Reports a file as ready once its (size, mtime) has not changed for `stable_seconds`."""
+
+    def __init__(self, stable_seconds):
+        self.stable_seconds = stable_seconds
+        self._observed = {} # path -> ((size, mtime), first time this signature was seen)
+
+    def is_stable(self, path, signature, now):
+        previous = self._observed.get(path)
+        if previous is None or previous[0] != signature:
+            self._observed[path] = (signature, now)
+            return self.stable_seconds <= 0
+        return now - previous[1] >= self.stable_seconds
+
+    def forget(self, path):
+        self._observed.pop(path, None)
+
+
+class RetryBackoff:
+    """
+    Holds back files that failed: a file is tried again `retry_seconds` after its first failure, twice as long
+    after each further one (at most MAX_RETRY_SECONDS), or as soon as its (size, mtime) changes.
+    """
+
+    def __init__(self, retry_seconds):
+        self.retry_seconds = retry_seconds
+        self._failures = {} # path -> ((size, mtime), failures, time of the next attempt)
+
+    def is_waiting(self, path, signature, now):
+        entry = self._failures.get(path)
+        return entry is not None and entry[0] == signature and now < entry[2]
+
+    def failed(self, path, signature, now):
+        """Records a failure; returns the seconds until the next attempt."""
+        failures = self._failures[path][1] + 1 if path in self._failures else 1
+        delay = min(self.retry_seconds * 2 ** (failures - 1), MAX_RETRY_SECONDS)
+        self._failures[path] = (signature, failures, now + delay)
+        return delay
+
+    def succeeded(self, path):
+        self._failures.pop(path, None)
+
+
+def write_file_outputs(output_dir, path, sha256, outcome, psi_names):
+    """Writes results.csv, summary.csv and metrics.json for one scored file; returns the folder."""
+    file_dir = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(path))[0]}-{sha256[:8]}")
+    os.makedirs(file_dir, exist_ok=True)
+    results_df = outcome["results_df"]
+    if results_df is not None:
+        results_df.to_csv(os.path.join(file_dir, "results.csv"), index=False)
+        summarize_results(results_df).to_csv(os.path.join(file_dir, "summary.csv"), index=False)
+    with open(os.path.join(file_dir, "metrics.json"), "w", encoding="utf-8") as f:
+        json.dump({k: v for k, v in outcome.items() if k != "results_df"} | {"psis": psi_names}, f, indent=2, default=str)
+    return file_dir
+
+
+def append_watch_log(output_dir, record):
+    log_path = os.path.join(output_dir, WATCH_LOG_FILE)
+    pd.DataFrame([record], columns=WATCH_LOG_COLUMNS).to_csv(log_path, mode="a", index=False, header=not os.path.exists(log_path))
+
+
+def process_file(path, stat, output_dir, compiled_appendix, psi_names, state, validate_timing=True, facility_column=None):
+    """
+    Scores one stable file and writes its outputs. Returns its watch log record, or None if its content was
+    already scored. Only successfully scored files are recorded in the state. Raises OSError if the file
+    cannot be read or the outputs cannot be written.
+    """
+    sha256 = hash_source(path)
+    if state.is_processed_content(path, sha256): # Touched or re-copied only: remember the new mtime, don't re-score
+        details = {k: v for k, v in state.files[os.path.abspath(path)].items() if k not in ("size", "mtime", "sha256")}
+        state.record(path, stat.st_size, stat.st_mtime, sha256, **details)
+        return None
+    outcome = score_input_file(path, psi_names, validate_timing, facility_column, compiled_appendix=compiled_appendix)
+    file_dir = write_file_outputs(output_dir, path, sha256, outcome, psi_names)
+    processed_at = datetime.now().isoformat(timespec="seconds")
+    record = {
+        "processed_at": processed_at, "file": path, "sha256": sha256, "status": outcome["status"], "error": outcome["error"],
+        "rows": outcome["rows"], "duplicates_collapsed": outcome.get("duplicates_collapsed", 0),
+        "elapsed_seconds": outcome["elapsed_seconds"], "latency_seconds": round(time.time() - stat.st_mtime, 1), "output": file_dir,
+    }
+    append_watch_log(output_dir, record)
+    if outcome["status"] == "ok":
+        state.record(path, stat.st_size, stat.st_mtime, sha256, status=outcome["status"], processed_at=processed_at, output=file_dir)
+    return record
+
+
+def process_ready_files(watch_dir, output_dir, compiled_appendix, psi_names, state, tracker, validate_timing=True,
+                        facility_column=None, on_file_done=None, backoff=None):
+    """
+    One poll of the watched directory: scores every new or changed input file that has become stable.
+    A file that fails is not recorded as processed; with `backoff` (RetryBackoff) it is held back before the
+    next attempt, otherwise it is tried again once it is stable on a later poll. Returns the number of files
+    scored or failed.
+    """
+    scored = 0
+    now = time.time()
+    for path in resolve_input_files([watch_dir]):
+        try:
+            stat = os.stat(path)
+        except OSError: # Removed between listing and stat
+            tracker.forget(path)
+            continue
+        if state.is_processed(path, stat.st_size, stat.st_mtime):
+            continue
+        signature = (stat.st_size, stat.st_mtime)
+        if backoff and backoff.is_waiting(path, signature, now):
+            continue
+        if not tracker.is_stable(path, signature, now):
+            continue
+        tracker.forget(path)
+
+        try:
+            record = process_file(path, stat, output_dir, compiled_appendix, psi_names, state, validate_timing, facility_column)
+        except OSError as e: # Removed or renamed since stat, locked, output disk full ...
+            record = {"processed_at": datetime.now().isoformat(timespec="seconds"), "file": path, "sha256": "", "status": "failed",
+                      "error": f"{type(e).__name__}: {e}", "rows": 0, "duplicates_collapsed": 0, "elapsed_seconds": 0,
+                      "latency_seconds": round(time.time() - stat.st_mtime, 1), "output": ""}
+            try:
+                append_watch_log(output_dir, record)
+            except OSError:
+                pass # The output disk itself is failing; the failure is still reported below
+        if record is None:
+            continue
+        if backoff:
+            if record["status"] == "ok":
+                backoff.succeeded(path)
+            else:
+                record["error"] += f" (retrying in {backoff.failed(path, signature, now):.0f}s)"
+        scored += 1
+        if on_file_done:
+            on_file_done(record)
+    return scored
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a directory and score PSI input files as they arrive")
+    parser.add_argument("--watch-dir", required=True)
+    appendix_group = parser.add_mutually_exclusive_group(required=True)
+    appendix_group.add_argument("--appendix", help="PSI appendix (.xlsx or .json)")
+    appendix_group.add_argument("--appendix-version", action="append", metavar="PERIOD=PATH",
+                                help="Appendix effective from discharge PERIOD (YYYY, YYYYQn or FYYYYY); repeat per version")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--psis", default=",".join(ALL_PSIS), help="Comma-separated PSIs (default: all)")
+    parser.add_argument("--no-timing", action="store_true", help="Disable timing validation")
+    parser.add_argument("--facility-column", default=None,
+                        help="Input column holding the facility id (default: tag rows with the file name)")
+    parser.add_argument("--poll-seconds", type=float, default=1.0, help="Seconds between directory scans")
+    parser.add_argument("--stable-seconds", type=float, default=2.0,
+                        help="A file is scored once its size and mtime are unchanged for this long")
+    parser.add_argument("--retry-seconds", type=float, default=30.0,
+                        help="A file that failed is tried again after this long, doubling with each further failure")
+    parser.add_argument("--once", action="store_true", help="Score the files that are ready now and exit")
+    args = parser.parse_args()
+
+    psi_names = [p.strip() for p in args.psis.split(",") if p.strip()]
+    unknown = [p for p in psi_names if p not in ALL_PSIS]
+    if unknown:
+        parser.error(f"Unknown PSI(s): {', '.join(unknown)}")
+    try:
+        appendix_versions = parse_version_arguments(args.appendix_version or [])
+    except ValueError as e:
+        parser.error(str(e))
+    if not os.path.isdir(args.watch_dir):
+        parser.error(f"Not a directory: {args.watch_dir}")
+
+    telemetry = PipelineTelemetry()
+    with telemetry.stage("Appendix load + compile"):
+        if appendix_versions:
+            compiled_appendix = build_registry(appendix_versions)
+        else:
+            compiled_appendix = compile_appendix(load_appendix_df(args.appendix, is_json=args.appendix.lower().endswith(".json")))
+    os.makedirs(args.output_dir, exist_ok=True)
+    state = WatchState(os.path.join(args.output_dir, WATCH_STATE_FILE))
+    tracker = StabilityTracker(0 if args.once else args.stable_seconds)
+    backoff = None if args.once else RetryBackoff(args.retry_seconds)
+    print(f"Appendix ready in {telemetry.records[-1]['Seconds']}s; watching {args.watch_dir} "
+          f"({len(state.files)} file(s) already processed)")
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True)) # Finish the current file, then exit
+
+    def report(record):
+        detail = f"{record['rows']} rows" if record["status"] == "ok" else record["error"]
+        print(f"  [{record['status']}] {os.path.basename(record['file'])} ({detail}, scored in {record['elapsed_seconds']}s, "
+              f"{record['latency_seconds']}s after it landed) -> {record['output']}")
+
+    try:
+        while not stopping:
+            process_ready_files(args.watch_dir, args.output_dir, compiled_appendix, psi_names, state, tracker,
+                                validate_timing=not args.no_timing, facility_column=args.facility_column, on_file_done=report,
+                                backoff=backoff)
+            if args.once:
+                break
+            time.sleep(args.poll_seconds)
+    except KeyboardInterrupt:
+        pass
+    print(f"Stopped; {len(state.files)} file(s) recorded in {state.path}")
+
+
+if __name__ == "__main__":
+    main()